@@ -0,0 +1,112 @@
+import bisect
+import itertools
+import logging
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+logger = logging.getLogger("tryouts-bot")
+
+
+class LobbyAdmissionQueue:
+    """FIFO of players waiting for a tournament match slot.
+
+    `in_flight` holds players whose `!mp make` was sent but not answered yet.
+    BanchoBot answers them in order, so a refusal belongs to the oldest one
+    while a "Created the tournament match" reply is matched by its title.
+    `waiting` holds players that were refused and wait for a free slot, ordered
+    by when they first asked so a refused retry keeps its place.
+
+    Replies can get lost, so requests remember when they were sent and
+    `expired` hands back the ones that went unanswered for too long.
+    """
+
+    def __init__(self, max_waiting: int = 100):
+        self.max_waiting = max_waiting
+        self.in_flight: Deque[str] = deque()
+        self.waiting: List[str] = []
+        self._sent_at: Dict[str, float] = {}
+        self._tickets: Dict[str, int] = {}
+        self._ticket_counter = itertools.count()
+
+    def __contains__(self, player: str) -> bool:
+        return player in self._tickets
+
+    def position(self, player: str) -> Optional[int]:
+        try:
+            return self.waiting.index(player) + 1
+        except ValueError:
+            return None
+
+    def request_sent(self, player: str):
+        self._take_ticket(player)
+        self.in_flight.append(player)
+        self._sent_at[player] = time.monotonic()
+
+    def created(self, player: str):
+        try:
+            self.in_flight.remove(player)
+        except ValueError:
+            logger.warning(f"Lobby created for {player} without a pending request.")
+        self._sent_at.pop(player, None)
+        self._tickets.pop(player, None)
+
+    def refused(self) -> Optional[str]:
+        if not self.in_flight:
+            logger.warning("Lobby creation refused without a pending request.")
+            return None
+        player = self.in_flight.popleft()
+        self._sent_at.pop(player, None)
+        return player
+
+    def expired(self, timeout: float, unsent: int = 0) -> List[str]:
+        """Take the requests that went unanswered for `timeout` seconds, oldest first.
+
+        The `unsent` newest requests are still waiting in the outbox, their
+        time starts over. Players of expired requests keep their ticket, to be
+        requested again.
+        """
+        now = time.monotonic()
+        for player in itertools.islice(reversed(self.in_flight), unsent):
+            self._sent_at[player] = now
+        deadline = now - timeout
+        players = []
+        while len(self.in_flight) > unsent and self._sent_at[self.in_flight[0]] <= deadline:
+            players.append(self.in_flight.popleft())
+            self._sent_at.pop(players[-1])
+        return players
+
+    def lost(self, unsent: int = 0) -> List[str]:
+        """Take every request but the `unsent` newest, whose replies were lost."""
+        players = []
+        while len(self.in_flight) > unsent:
+            players.append(self.in_flight.popleft())
+            self._sent_at.pop(players[-1])
+        return players
+
+    def restart_timeouts(self):
+        now = time.monotonic()
+        for player in self.in_flight:
+            self._sent_at[player] = now
+
+    def enqueue(self, player: str) -> Optional[int]:
+        """Add a player to the waiting queue. Returns None when the queue is full."""
+        position = self.position(player)
+        if position is not None:
+            return position
+        if len(self.waiting) >= self.max_waiting:
+            self._tickets.pop(player, None)
+            return None
+        self._take_ticket(player)
+        bisect.insort(self.waiting, player, key=self._tickets.__getitem__)
+        return self.position(player)
+
+    def pop_next(self) -> Optional[str]:
+        return self.waiting.pop(0) if self.waiting else None
+
+    def clear(self):
+        self.waiting.clear()
+
+    def _take_ticket(self, player: str):
+        if player not in self._tickets:
+            self._tickets[player] = next(self._ticket_counter)
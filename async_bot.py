@@ -0,0 +1,113 @@
+import asyncio
+import logging
+
+import irc.client
+import irc.client_aio
+
+from irc_bot import TryoutsBot
+from outbox import Priority
+
+logger = logging.getLogger("tryouts-bot")
+
+
+class SchedulingAioReactor(irc.client_aio.AioReactor):
+    """AioReactor with the scheduler the select Reactor has, run by the bot."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.scheduler = self.scheduler_class()
+
+
+class AsyncTryoutsBot(TryoutsBot):
+    """TryoutsBot running on an asyncio event loop instead of the select reactor.
+
+    Handlers (`on_privmsg`, `on_pubmsg`, `_on_kick`, ...) are the same as the
+    TryoutsBot ones. The socket is read by an asyncio protocol, outgoing
+    messages are paced by an async task that sleeps until the next token, and
+    the reactor scheduler (lobby queue retries, sheets mirroring, reconnects)
+    is run by another task. Sheets calls, mirror syncs included, run on the
+    sheets worker thread like they do for TryoutsBot.
+    """
+
+    reactor_class = SchedulingAioReactor
+    SCHEDULER_INTERVAL = 0.05
+
+    def __init__(self, *args, **kwargs):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self._outbox_wakeup = asyncio.Event()
+        self._tasks = []
+        super().__init__(*args, **kwargs)
+
+    def schedule_outbox_pacing(self):
+        # Paced by _pace_outbox instead of the reactor scheduler.
+        pass
+
+    def send(self, target: str, message: str, priority: Priority = None):
+        super().send(target, message, priority)
+        if self.outbox.queue_depth:
+            self._outbox_wakeup.set()
+
+    def on_welcome(
+        self, connection: irc.client.ServerConnection, event: irc.client.Event
+    ):
+        super().on_welcome(connection, event)
+        self._outbox_wakeup.set()
+
+    def _connect(self):
+        server = self.servers.peek()
+        self.loop.create_task(
+            self._connect_async(server.host, server.port, server.password)
+        )
+
+    async def _connect_async(self, host: str, port: int, password: str):
+        try:
+            await self.connection.connect(
+                host, port, self._nickname, password, ircname=self._realname
+            )
+        except (OSError, irc.client.ServerConnectionError):
+            logger.exception(f"Could not connect to {host}:{port}.")
+            self.connection._handle_event(
+                irc.client.Event("disconnect", self.connection.server, "", [""])
+            )
+
+    def start(self):
+        self._tasks = [
+            self.loop.create_task(self._pace_outbox()),
+            self.loop.create_task(self._run_scheduler()),
+        ]
+        super().start()
+
+    async def _pace_outbox(self):
+        while True:
+            # Also parked while disconnected, on_welcome wakes it up again.
+            if not self.outbox.queue_depth or not self.outbox.can_send():
+                self._outbox_wakeup.clear()
+                await self._outbox_wakeup.wait()
+                continue
+            await asyncio.sleep(self.outbox.seconds_until_token())
+            self.outbox.drain()
+
+    async def _run_scheduler(self):
+        while True:
+            self.reactor.scheduler.run_pending()
+            await asyncio.sleep(self.SCHEDULER_INTERVAL)
+
+    def shutdown(self):
+        for task in self._tasks:
+            task.cancel()
+        # The loop is stopped by now, run it again to get the outbox written.
+        self.loop.run_until_complete(self._flush_outbox())
+        super().shutdown()
+
+    async def _flush_outbox(self, timeout: float = 30):
+        deadline = self.loop.time() + timeout
+        while (
+            self.outbox.queue_depth
+            and self.outbox.can_send()
+            and self.loop.time() < deadline
+        ):
+            await asyncio.sleep(self.outbox.seconds_until_token())
+            self.outbox.drain()
+        # Give the transport a moment to write what was sent.
+        await asyncio.sleep(0.1)
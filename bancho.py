@@ -0,0 +1,192 @@
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Pattern, Tuple, Type, Callable, Any
+
+BANCHO_BOT = "BanchoBot"
+
+
+@dataclass(frozen=True, slots=True)
+class AllPlayersReady:
+    pass
+
+
+@dataclass(frozen=True, slots=True)
+class CountdownFinished:
+    pass
+
+
+@dataclass(frozen=True, slots=True)
+class MatchStarted:
+    pass
+
+
+@dataclass(frozen=True, slots=True)
+class PlayerFinished:
+    player: str
+    score: Optional[int] = None
+    passed: Optional[bool] = None
+
+
+@dataclass(frozen=True, slots=True)
+class PlayerJoined:
+    player: str
+    slot: int
+
+
+@dataclass(frozen=True, slots=True)
+class PlayerLeft:
+    player: str
+
+
+@dataclass(frozen=True, slots=True)
+class SettingsRoom:
+    """First line of the `!mp settings` reply."""
+    match_id: str
+
+
+@dataclass(frozen=True, slots=True)
+class SettingsBeatmap:
+    beatmap_id: str
+
+
+@dataclass(frozen=True, slots=True)
+class SettingsPlayers:
+    count: int
+
+
+@dataclass(frozen=True, slots=True)
+class SettingsSlot:
+    slot: int
+    status: str
+    player: str
+
+
+@dataclass
+class MatchSettings:
+    """A `!mp settings` reply, assembled from its lines."""
+    beatmap_id: Optional[str] = None
+    player_count: Optional[int] = None
+    players: List[str] = field(default_factory=list)
+
+    @property
+    def complete(self) -> bool:
+        return self.player_count is not None and len(self.players) >= self.player_count
+
+
+@dataclass(frozen=True, slots=True)
+class MatchCreated:
+    match_id: str
+    title: str
+
+    @property
+    def player(self) -> str:
+        return self.title.split(" ")[-1]
+
+
+@dataclass(frozen=True, slots=True)
+class MatchLimitReached:
+    pass
+
+
+@dataclass(frozen=True, slots=True)
+class PlayerStats:
+    player: str
+    player_id: str
+
+
+BanchoEvent = Any
+
+_PUBMSG_EXACT: Dict[str, BanchoEvent] = {
+    "All players are ready": AllPlayersReady(),
+    "Countdown finished": CountdownFinished(),
+    "The match has started!": MatchStarted(),
+}
+
+
+def _player_finished(match: re.Match) -> PlayerFinished:
+    score = match.group("score")
+    status = match.group("status")
+    return PlayerFinished(
+        player=match.group("player"),
+        score=int(score) if score is not None else None,
+        passed=status == "PASSED" if status is not None else None,
+    )
+
+
+_PUBMSG_PATTERNS: Tuple[Tuple[Pattern, Callable[[re.Match], BanchoEvent]], ...] = (
+    (
+        re.compile(
+            r"(?P<player>.+?) finished playing"
+            r"(?: \(Score: (?P<score>\d+), (?P<status>PASSED|FAILED)\))?"
+        ),
+        _player_finished,
+    ),
+    (
+        re.compile(r"(?P<player>.+?) joined in slot (?P<slot>\d+)"),
+        lambda match: PlayerJoined(match.group("player"), int(match.group("slot"))),
+    ),
+    (
+        re.compile(r"(?P<player>.+?) left the game\."),
+        lambda match: PlayerLeft(match.group("player")),
+    ),
+    (
+        re.compile(r"Room name: .*, History: \S+/(?P<match_id>\d+)"),
+        lambda match: SettingsRoom(match.group("match_id")),
+    ),
+    (
+        re.compile(r"Beatmap: \S+/(?P<beatmap_id>\d+)"),
+        lambda match: SettingsBeatmap(match.group("beatmap_id")),
+    ),
+    (
+        re.compile(r"Players: (?P<count>\d+)"),
+        lambda match: SettingsPlayers(int(match.group("count"))),
+    ),
+    (
+        re.compile(
+            r"Slot (?P<slot>\d+) +(?P<status>Not Ready|Ready|No Map) +\S+/\d+"
+            r" (?P<player>.+?) *(?:\[.*\])?$"
+        ),
+        lambda match: SettingsSlot(
+            int(match.group("slot")), match.group("status"), match.group("player")
+        ),
+    ),
+)
+
+_PRIVMSG_PATTERNS: Tuple[Tuple[Pattern, Callable[[re.Match], BanchoEvent]], ...] = (
+    (
+        re.compile(r"Created the tournament match \S+/(?P<match_id>\d+) (?P<title>.+)"),
+        lambda match: MatchCreated(match.group("match_id"), match.group("title")),
+    ),
+    (
+        re.compile(r"You cannot create any more tournament matches\."),
+        lambda match: MatchLimitReached(),
+    ),
+    (
+        re.compile(r"Stats for \((?P<player>.+)\)\[\S+/(?P<player_id>\d+)\]"),
+        lambda match: PlayerStats(match.group("player"), match.group("player_id")),
+    ),
+)
+
+
+def parse_pubmsg(message: str) -> Optional[BanchoEvent]:
+    """Parse a BanchoBot message sent to a `#mp_` channel."""
+    event = _PUBMSG_EXACT.get(message)
+    if event is not None:
+        return event
+    return _match(_PUBMSG_PATTERNS, message)
+
+
+def parse_privmsg(message: str) -> Optional[BanchoEvent]:
+    """Parse a BanchoBot private message."""
+    return _match(_PRIVMSG_PATTERNS, message)
+
+
+def _match(patterns, message: str) -> Optional[BanchoEvent]:
+    for pattern, make_event in patterns:
+        match = pattern.match(message)
+        if match is not None:
+            return make_event(match)
+    return None
+
+
+EventHandlers = Dict[Type, Callable[[str, BanchoEvent], Any]]
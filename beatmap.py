@@ -1,7 +1,11 @@
+from typing import Optional
+
+
 class Beatmap:
-    def __init__(self, beatmap_id: str, mod: str):
+    def __init__(self, beatmap_id: str, mod: str, length_seconds: Optional[int] = None):
         self.beatmap_id = beatmap_id
         self.mod = mod
+        self.length_seconds = length_seconds
 
     def __str__(self):
         return f"Beatmap {self.beatmap_id} played with {self.mod}"
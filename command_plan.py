@@ -0,0 +1,59 @@
+from typing import Callable, Mapping, Sequence, Tuple
+
+from beatmap import Beatmap
+
+
+class CommandPlan:
+    """Every lobby message of one config version, built once.
+
+    `map_lines[idx]` are the `!mp map` and `!mp mods` lines of map `idx`, and
+    the settings templates that only depend on bot constants are formatted
+    here too, so advancing a lobby only indexes into tuples.
+    """
+
+    __slots__ = (
+        "beatmap_ids",
+        "map_lines",
+        "map_count",
+        "setup_line",
+        "ready_timer_line",
+        "disconnect_timer_line",
+        "greetings",
+        "no_aborts_left",
+        "leave_detected",
+        "abandon_message",
+    )
+
+    def __init__(
+        self,
+        mappool: Sequence[Beatmap],
+        settings: Mapping,
+        before_ready_wait_seconds: int,
+        disconnect_wait_timeout: int,
+        max_allowed_leaves: int,
+    ):
+        self.beatmap_ids: Tuple[str, ...] = tuple(b.beatmap_id for b in mappool)
+        self.map_lines: Tuple[Tuple[str, str], ...] = tuple(
+            b.to_multiplayer_cmd() for b in mappool
+        )
+        self.map_count = len(mappool)
+        self.setup_line = "!mp set 0 3 1"
+        self.ready_timer_line = f"!mp timer {before_ready_wait_seconds}"
+        self.disconnect_timer_line = f"!mp timer {disconnect_wait_timeout}"
+        self.greetings: Tuple[str, ...] = tuple(settings["greetings"])
+        self.no_aborts_left: str = settings["noAbortsLeft"]
+        # Indexed by player_leave_count.
+        self.leave_detected: Tuple[str, ...] = tuple(
+            settings["lobbyLeaveDetected"].format(
+                disconnects_left=max_allowed_leaves - leave_count + 1,
+                player_leave_count=leave_count,
+                max_allowed_leaves=max_allowed_leaves,
+            )
+            for leave_count in range(max_allowed_leaves + 1)
+        )
+        self.abandon_message: Callable[..., str] = settings["lobbyAbandonMessage"].format
+
+    def __setattr__(self, name, value):
+        if hasattr(self, name):
+            raise AttributeError(f"CommandPlan.{name} is read-only.")
+        super().__setattr__(name, value)
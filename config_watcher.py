@@ -0,0 +1,156 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Tuple
+
+from beatmap import Beatmap
+
+logger = logging.getLogger("tryouts-bot")
+
+
+@dataclass(frozen=True)
+class ConfigVersion:
+    """An immutable mappool and settings pair.
+
+    `version` is a digest of both, so it names the same content across
+    restarts and can be journaled with the lobbies that use it.
+    """
+    version: str
+    mappool: Tuple[Beatmap, ...]
+    settings: Mapping[str, Any]
+
+
+def _freeze(value: Any) -> Any:
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def mappool_key(mappool: List[Beatmap]) -> List[tuple]:
+    return [(b.beatmap_id, b.mod, b.length_seconds) for b in mappool]
+
+
+def _make_version(mappool: List[Beatmap], settings: dict) -> ConfigVersion:
+    content = json.dumps([mappool_key(mappool), settings], sort_keys=True)
+    digest = hashlib.sha1(content.encode("utf-8")).hexdigest()[:12]
+    return ConfigVersion(digest, tuple(mappool), _freeze(settings))
+
+
+class ConfigWatcher:
+    """Reloads the mappool and `settings.json` when they change.
+
+    `poll` only stats the settings file and asks `mappool_revision` for the
+    spreadsheet's modified time; the mappool is fetched again only when that
+    changed, or on every poll when no revision is available. A new version
+    replaces `current` in a single assignment. Older versions are kept for
+    as long as a lobby is pinned to them, see `retain`.
+
+    A new version missing a setting the current one has, or rejected by
+    `validate`, is logged and the current version is kept, so a typo in the
+    settings cannot reach the lobbies.
+
+    `poll` blocks on the network, so run it off the reactor thread.
+    """
+
+    def __init__(
+        self,
+        load_mappool: Callable[[], List[Beatmap]],
+        mappool_revision: Optional[Callable[[], Optional[str]]] = None,
+        settings_path: str = "settings.json",
+        validate: Optional[Callable[[ConfigVersion], Any]] = None,
+    ):
+        self.load_mappool = load_mappool
+        self.mappool_revision = mappool_revision or (lambda: None)
+        self.settings_path = settings_path
+        self.validate = validate or (lambda config_version: None)
+        self._lock = threading.Lock()
+
+        self._settings_mtime = os.stat(settings_path).st_mtime_ns
+        self._settings = self._read_settings()
+        self._revision = self.mappool_revision()
+        self._mappool = list(load_mappool())
+        self.current = _make_version(self._mappool, self._settings)
+        self._versions: Dict[str, ConfigVersion] = {self.current.version: self.current}
+        # Only the mappool given at start is used when it cannot be reloaded.
+        self._static_mappool = mappool_revision is None
+
+    def __contains__(self, version: str) -> bool:
+        with self._lock:
+            return version in self._versions
+
+    def get(self, version: str) -> ConfigVersion:
+        """The version a lobby is pinned to, or the current one if it is gone."""
+        with self._lock:
+            config_version = self._versions.get(version)
+        if config_version is None:
+            logger.warning(f"Config version {version!r} is gone, using the current one.")
+            return self.current
+        return config_version
+
+    def retain(self, versions: Iterable[str]):
+        """Forget the versions that no lobby is pinned to anymore."""
+        keep = set(versions)
+        keep.add(self.current.version)
+        with self._lock:
+            for version in list(self._versions):
+                if version not in keep:
+                    del self._versions[version]
+
+    def poll(self) -> bool:
+        """Reload what changed. Returns True if a new version was swapped in."""
+        changed = False
+
+        settings_mtime = os.stat(self.settings_path).st_mtime_ns
+        if settings_mtime != self._settings_mtime:
+            try:
+                settings = self._read_settings()
+            except json.JSONDecodeError:
+                # Probably caught mid-save, the next poll will see the whole file.
+                logger.exception(f"Could not read {self.settings_path}, keeping the old one.")
+            else:
+                self._settings_mtime = settings_mtime
+                changed |= settings != self._settings
+                self._settings = settings
+
+        if not self._static_mappool:
+            revision = self.mappool_revision()
+            if revision is None or revision != self._revision:
+                mappool = list(self.load_mappool())
+                changed |= mappool_key(mappool) != mappool_key(self._mappool)
+                self._mappool = mappool
+                self._revision = revision
+
+        if not changed:
+            return False
+        config_version = _make_version(self._mappool, self._settings)
+        if config_version.version == self.current.version:
+            return False
+        missing = set(self.current.settings) - set(config_version.settings)
+        try:
+            if missing:
+                raise KeyError(f"Missing settings: {', '.join(sorted(missing))}")
+            self.validate(config_version)
+        except Exception:
+            logger.exception(
+                f"Config version {config_version.version} is not usable, "
+                f"keeping {self.current.version}."
+            )
+            return False
+        with self._lock:
+            self._versions[config_version.version] = config_version
+        self.current = config_version
+        logger.info(
+            f"Loaded config version {config_version.version} with "
+            f"{len(config_version.mappool)} maps."
+        )
+        return True
+
+    def _read_settings(self) -> dict:
+        with open(self.settings_path, encoding="utf-8") as f:
+            return json.load(f)
@@ -0,0 +1,289 @@
+from __future__ import annotations
+
+import json
+import logging
+import multiprocessing
+import queue
+import signal
+import sys
+from typing import Dict, List, Set, Tuple
+
+import irc
+import irc.bot
+import irc.client
+
+from beatmap import Beatmap
+from irc_bot import TryoutsBot
+from logs import setup_logging, stop_logging
+from outbox import OutboundScheduler
+from sheets_worker import SheetsWorker
+from store import TryoutStore, SheetsMirror
+
+logger = logging.getLogger("tryouts-bot")
+
+
+class WorkerBot(TryoutsBot):
+    """A TryoutsBot that takes `!play` requests from the coordinator.
+
+    Lobby starts and closes, and its load, are reported back on `events`.
+    The coordinator stops it with `interrupt`, which closes its lobbies like
+    Ctrl-C does, or `shutdown`, which leaves them open to be resumed.
+    """
+
+    POLL_INTERVAL = 0.1
+
+    def __init__(
+        self,
+        worker_id: int,
+        commands: multiprocessing.Queue,
+        events: multiprocessing.Queue,
+        *args,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.worker_id = worker_id
+        self.commands = commands
+        self.events = events
+        self.reactor.scheduler.execute_every(self.POLL_INTERVAL, self.poll_commands)
+
+    def poll_commands(self):
+        while True:
+            try:
+                command, player = self.commands.get_nowait()
+            except queue.Empty:
+                return
+            if command == "play":
+                self.make_lobby(author=player)
+                if (
+                    player not in self.active_lobbies
+                    and player not in self.lobby_queue
+                ):
+                    # make_lobby turned the player away, release the assignment.
+                    self.report("released", player)
+            elif command == "invite":
+                self.invite_lobby(author=player)
+            elif command == "interrupt":
+                raise KeyboardInterrupt
+            elif command == "shutdown":
+                sys.exit(0)
+
+    def report(self, event: str, *args):
+        load = len(self.active_lobbies) + len(self.lobby_queue.in_flight) + len(
+            self.lobby_queue.waiting
+        )
+        self.events.put((event, self.worker_id, load, args))
+
+    def start_created_lobby(self, match_id: str, player: str):
+        super().start_created_lobby(match_id, player)
+        lobby_details = self.active_lobbies.get(player)
+        if lobby_details is not None:
+            self.report("started", player, lobby_details.lobby_url)
+
+    def close_match(self, author: str):
+        super().close_match(author)
+        if author not in self.active_lobbies:
+            self.report("released", author)
+
+    def _on_kick(
+        self, connection: irc.client.ServerConnection, event: irc.client.Event
+    ):
+        lobby_details = self.active_lobbies.get_by_channel(event.target)
+        super()._on_kick(connection, event)
+        if lobby_details is not None:
+            self.report("released", lobby_details.player)
+
+
+def run_worker(
+    worker_id: int,
+    commands: multiprocessing.Queue,
+    events: multiprocessing.Queue,
+    bot_kwargs: dict,
+    log_level: str,
+):
+    # The parent's log listener thread does not survive the fork.
+    setup_logging(log_level)
+    # Ctrl-C reaches the whole process group, the coordinator passes it on.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # terminate() from the coordinator shuts down without closing lobbies.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    bot = WorkerBot(worker_id, commands, events, **bot_kwargs)
+    try:
+        bot.start()
+    except KeyboardInterrupt:
+        bot.cleanup()
+    except SystemExit:
+        bot.shutdown()
+    except BaseException as e:
+        # Keep the lobbies open, they are resumed from the journal on restart.
+        logger.exception(e)
+        bot.shutdown()
+    finally:
+        # Worker processes skip atexit handlers, write out what is queued.
+        stop_logging()
+
+
+class CoordinatorBot(irc.bot.SingleServerIRCBot):
+    """Front-door bot that spreads `!play` requests over several worker bots.
+
+    Every worker is a separate process logged in with its own account, so the
+    tournament match limit applies per worker. The coordinator keeps the only
+    view of which player is assigned to which worker and which lobbies they
+    already played, so MAX_ALLOWED_PLAYS holds across workers.
+    """
+
+    POLL_INTERVAL = 0.1
+
+    def __init__(
+        self,
+        nickname: str,
+        password: str,
+        workers: List[Tuple[str, str]],
+        mappool: List[Beatmap],
+        allowed_players: List[str] = None,
+        admins: List[str] = None,
+        server: str = "irc.ppy.sh",
+        port: int = 6667,
+        store_path: str = "tryouts.sqlite3",
+    ):
+        irc.bot.SingleServerIRCBot.__init__(
+            self, [(server, port, password)], nickname, nickname
+        )
+        with open("settings.json", encoding="utf-8") as f:
+            self.settings = json.load(f)
+        self.recon = irc.bot.ExponentialBackoff(min_interval=5, max_interval=30)
+
+        self.events: multiprocessing.Queue = multiprocessing.Queue()
+        self.worker_commands: List[multiprocessing.Queue] = []
+        self.worker_processes: List[multiprocessing.Process] = []
+        self.worker_loads: List[int] = []
+        log_level = logging.getLevelName(logger.getEffectiveLevel())
+        for worker_id, (worker_nickname, worker_password) in enumerate(workers):
+            commands = multiprocessing.Queue()
+            bot_kwargs = dict(
+                nickname=worker_nickname,
+                password=worker_password,
+                mappool=mappool,
+                allowed_players=allowed_players,
+                admins=admins,
+                server=server,
+                port=port,
+                journal_path=f"lobbies-{worker_nickname}.journal",
+                store_path=store_path,
+                mirror_to_sheets=False,
+            )
+            process = multiprocessing.Process(
+                target=run_worker,
+                args=(worker_id, commands, self.events, bot_kwargs, log_level),
+                name=f"tryouts-worker-{worker_nickname}",
+                daemon=True,
+            )
+            self.worker_commands.append(commands)
+            self.worker_processes.append(process)
+            self.worker_loads.append(0)
+
+        self.assignments: Dict[str, int] = {}
+        # Workers share the store file, the coordinator alone mirrors it.
+        self.store = TryoutStore(store_path)
+        self.sheets_worker = SheetsWorker()
+        self.sheets_mirror = SheetsMirror(self.store)
+
+        self.outbox = OutboundScheduler(
+            send_func=self.connection.privmsg,
+            rate=TryoutsBot.MESSAGES_PER_SECOND,
+            burst=TryoutsBot.MESSAGE_BURST,
+        )
+        self.reactor.scheduler.execute_every(
+            TryoutsBot.OUTBOX_DRAIN_INTERVAL, self.outbox.drain
+        )
+        self.reactor.scheduler.execute_every(self.POLL_INTERVAL, self.poll_events)
+
+    def start(self):
+        self.sheets_mirror.import_sheets(only_if_empty=True)
+        self.sheets_worker.start()
+        self.reactor.scheduler.execute_every(
+            TryoutsBot.SHEETS_MIRROR_INTERVAL, self.mirror_to_sheets
+        )
+        for process in self.worker_processes:
+            process.start()
+        super().start()
+
+    def on_privmsg(
+        self, connection: irc.client.ServerConnection, event: irc.client.Event
+    ):
+        author = event.source.nick
+        message = event.arguments[0]
+
+        if message == "!play":
+            self.route_play(author)
+        elif message == "!invite" and author in self.assignments:
+            self.worker_commands[self.assignments[author]].put(("invite", author))
+
+    def get_played_lobby_urls(self, player: str) -> Set[str]:
+        return {lobby.lobby_url for lobby in self.store.get_played_lobbies(player)}
+
+    def mirror_to_sheets(self):
+        if self.sheets_worker.queue_depth == 0:
+            self.sheets_worker.submit("mirror store to sheets", self.sheets_mirror.sync)
+
+    def route_play(self, player: str):
+        played_lobby_urls = self.get_played_lobby_urls(player)
+        if player in self.assignments:
+            worker_id = self.assignments[player]
+        elif len(played_lobby_urls) >= TryoutsBot.MAX_ALLOWED_PLAYS:
+            # The worker caches may not know about lobbies played on other
+            # workers yet, so the coordinator answers this one itself.
+            self.outbox.push(
+                player,
+                self.settings["playerPlayedLobbies"].format(
+                    lobby_urls_str=" - ".join(sorted(played_lobby_urls))
+                ),
+            )
+            return
+        else:
+            worker_id = self.least_loaded_worker()
+            self.assignments[player] = worker_id
+            self.worker_loads[worker_id] += 1
+        logger.info(f"Routing !play of {player} to worker {worker_id}.")
+        self.worker_commands[worker_id].put(("play", player))
+
+    def least_loaded_worker(self) -> int:
+        return min(range(len(self.worker_loads)), key=self.worker_loads.__getitem__)
+
+    def poll_events(self):
+        while True:
+            try:
+                event, worker_id, load, args = self.events.get_nowait()
+            except queue.Empty:
+                return
+            self.worker_loads[worker_id] = load
+            if event == "released":
+                (player,) = args
+                if self.assignments.get(player) == worker_id:
+                    self.assignments.pop(player)
+
+    def stop_workers(self, command: str, timeout: float = 60):
+        """Send `command` to every worker and wait for them to exit."""
+        for commands in self.worker_commands:
+            commands.put((command, None))
+        for process in self.worker_processes:
+            process.join(timeout=timeout)
+        for process in self.worker_processes:
+            if process.is_alive():
+                logger.warning(f"{process.name} did not stop, terminating it.")
+                process.terminate()
+                process.join(timeout=timeout)
+
+    def cleanup(self):
+        """Stop the workers, each of them closes its own lobbies."""
+        self.stop_workers("interrupt")
+        self.close()
+
+    def shutdown(self):
+        """Stop the workers without closing lobbies, so a restart can resume them."""
+        self.stop_workers("shutdown")
+        self.close()
+
+    def close(self):
+        self.sheets_worker.submit("mirror store to sheets", self.sheets_mirror.sync)
+        self.sheets_worker.stop()
+        self.store.close()
@@ -0,0 +1,305 @@
+"""A local IRC server that imitates enough of Bancho to run TryoutsBot against.
+
+It answers `!mp make`, `!stats` and the `!mp` lobby commands the bot uses, and
+plays the invited player itself: the player joins slot 1, readies up on every
+map, finishes it after `map_seconds` and can leave with `leave_probability`.
+Waits (`!mp timer`, `!mp start N`, map length) are multiplied by `time_scale`
+so full mappools can be run in seconds.
+
+Matches outlive their client's connection like on Bancho: what happens while
+the client is away is lost to it, and rejoining the channel picks them up.
+`drop_client` simulates a network blip.
+"""
+import asyncio
+import itertools
+import logging
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger("tryouts-bot")
+
+BANCHO = ":BanchoBot!cho@ppy.sh"
+
+
+@dataclass
+class FakeMatch:
+    match_id: int
+    title: str
+    owner: "FakeClient"
+    player: Optional[str] = None
+    beatmap_id: Optional[str] = None
+    in_lobby: bool = False
+    playing: bool = False
+    timer: Optional[asyncio.TimerHandle] = None
+    game: Optional[asyncio.TimerHandle] = None
+    handles: List[asyncio.TimerHandle] = field(default_factory=list)
+
+    @property
+    def channel(self) -> str:
+        return f"#mp_{self.match_id}"
+
+
+class FakeClient(asyncio.Protocol):
+    def __init__(self, server: "FakeBancho"):
+        self.server = server
+        self.transport = None
+        self.nickname = "*"
+        self.buffer = b""
+        self.tokens = float(server.burst)
+        self.last_refill = time.monotonic()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        if time.monotonic() < self.server.refuse_until:
+            transport.close()
+
+    def connection_lost(self, exc):
+        if self.server.clients.get(self.nickname) is self:
+            del self.server.clients[self.nickname]
+
+    def data_received(self, data: bytes):
+        self.buffer += data
+        *lines, self.buffer = self.buffer.split(b"\r\n")
+        for line in lines:
+            if line:
+                self.server.handle_line(self, line.decode("utf-8"))
+
+    def write(self, line: str):
+        if self.transport is not None and not self.transport.is_closing():
+            self.transport.write(line.encode("utf-8") + b"\r\n")
+
+    def take_token(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(
+            self.server.burst, self.tokens + (now - self.last_refill) * self.server.rate
+        )
+        self.last_refill = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class FakeBancho:
+    def __init__(
+        self,
+        max_matches: int = 4,
+        rate: float = 10.0,
+        burst: int = 10,
+        time_scale: float = 0.01,
+        map_seconds: float = 120,
+        ready_seconds: float = 5,
+        leave_probability: float = 0.0,
+    ):
+        self.max_matches = max_matches
+        self.rate = rate
+        self.burst = burst
+        self.time_scale = time_scale
+        self.map_seconds = map_seconds
+        self.ready_seconds = ready_seconds
+        self.leave_probability = leave_probability
+
+        self.clients: Dict[str, FakeClient] = {}
+        self.matches: Dict[str, FakeMatch] = {}
+        self.match_ids = itertools.count(100000)
+        self.user_ids: Dict[str, int] = {}
+
+        self.messages_received = 0
+        self.messages_dropped = 0
+        self.matches_closed = 0
+        self.refuse_until = 0.0
+        # Called with (nickname, target, message) for every PRIVMSG a client sends.
+        self.listeners: List[Callable[[str, str, str], None]] = []
+        self._server = None
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        return asyncio.get_running_loop()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 6667):
+        self._server = await self.loop.create_server(
+            lambda: FakeClient(self), host, port
+        )
+        logger.info(f"Fake Bancho listening on {host}:{port}.")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    def drop_client(self, nickname: str, downtime: float = 0.0):
+        """Cut the connection of `nickname` and refuse new ones for `downtime` seconds."""
+        self.refuse_until = time.monotonic() + downtime
+        client = self.clients.get(nickname)
+        if client is not None:
+            client.transport.abort()
+
+    def player_says(self, player: str, target: str, message: str):
+        """Send a PRIVMSG from a simulated player to a connected client."""
+        client = self.clients.get(target)
+        if client is not None:
+            client.write(f":{player}!{player}@ppy.sh PRIVMSG {target} :{message}")
+
+    def handle_line(self, client: FakeClient, line: str):
+        command, _, rest = line.partition(" ")
+        command = command.upper()
+        if command == "NICK":
+            client.nickname = rest.strip()
+            self.clients[client.nickname] = client
+        elif command == "USER":
+            client.write(f":cho.ppy.sh 001 {client.nickname} :Welcome to osu!Bancho.")
+        elif command == "PING":
+            client.write(f":cho.ppy.sh PONG cho.ppy.sh {rest}")
+        elif command == "JOIN":
+            for channel in rest.split(" ")[0].split(","):
+                if channel.startswith("#mp_"):
+                    match = self.matches.get(channel)
+                    if match is None:
+                        client.write(
+                            f":cho.ppy.sh 403 {client.nickname} {channel} :No such channel"
+                        )
+                        continue
+                    match.owner = client
+                client.write(f":{client.nickname}!cho@ppy.sh JOIN :{channel}")
+        elif command == "PRIVMSG":
+            target, _, message = rest.partition(" :")
+            self.messages_received += 1
+            if not client.take_token():
+                self.messages_dropped += 1
+                return
+            for listener in self.listeners:
+                listener(client.nickname, target, message)
+            if target == "BanchoBot":
+                self.handle_bancho_command(client, message)
+            elif target in self.matches:
+                self.handle_match_command(client, self.matches[target], message)
+
+    def handle_bancho_command(self, client: FakeClient, message: str):
+        reply = lambda text: client.write(f"{BANCHO} PRIVMSG {client.nickname} :{text}")
+        if message.startswith("!mp make "):
+            owned = sum(1 for match in self.matches.values() if match.owner is client)
+            if owned >= self.max_matches:
+                reply(
+                    "You cannot create any more tournament matches. "
+                    "Please close any previous tournament matches you have open."
+                )
+                return
+            match = FakeMatch(next(self.match_ids), message[len("!mp make "):], client)
+            self.matches[match.channel] = match
+            client.write(f":{client.nickname}!cho@ppy.sh JOIN :{match.channel}")
+            reply(
+                f"Created the tournament match "
+                f"https://osu.ppy.sh/mp/{match.match_id} {match.title}"
+            )
+        elif message.startswith("!stats "):
+            player = message[len("!stats "):].replace("_", " ")
+            user_id = self.user_ids.setdefault(player, len(self.user_ids) + 1)
+            reply(f"Stats for ({player})[https://osu.ppy.sh/u/{user_id}] is Online:")
+
+    def handle_match_command(self, client: FakeClient, match: FakeMatch, message: str):
+        args = message.split(" ")
+        if args[0] != "!mp" or len(args) < 2:
+            return
+        command = args[1]
+        if command == "invite":
+            match.player = args[2]
+            if not match.in_lobby:
+                self.later(match, 1, self.player_joins, match)
+        elif command == "map":
+            match.beatmap_id = args[2]
+            self.later(match, self.ready_seconds, self.player_ready, match)
+        elif command == "settings":
+            self.send_settings(match)
+        elif command == "timer":
+            self.cancel(match.timer)
+            match.timer = self.later(
+                match, float(args[2]), self.say, match, "Countdown finished"
+            )
+        elif command == "start":
+            self.cancel(match.timer)
+            delay = float(args[2]) if len(args) > 2 else 0
+            match.timer = self.later(match, delay, self.start_game, match)
+        elif command == "abort":
+            self.cancel(match.game)
+            match.playing = False
+            self.say(match, "Aborted the match")
+        elif command == "close":
+            self.close_match(match)
+
+    def send_settings(self, match: FakeMatch):
+        self.say(
+            match,
+            f"Room name: {match.title}, History: https://osu.ppy.sh/mp/{match.match_id}",
+        )
+        self.say(match, f"Beatmap: https://osu.ppy.sh/b/{match.beatmap_id} Fake - Map [Hard]")
+        self.say(match, "Team mode: HeadToHead, Win condition: ScoreV2")
+        self.say(match, "Active mods: NoFail")
+        self.say(match, f"Players: {int(match.in_lobby)}")
+        if match.in_lobby:
+            player = self.player_name(match)
+            user_id = self.user_ids.setdefault(player, len(self.user_ids) + 1)
+            self.say(
+                match,
+                f"Slot 1  Not Ready https://osu.ppy.sh/u/{user_id} {player:<16}[Host]",
+            )
+
+    def later(self, match: FakeMatch, seconds: float, callback, *args):
+        handle = self.loop.call_later(seconds * self.time_scale, callback, *args)
+        match.handles.append(handle)
+        return handle
+
+    @staticmethod
+    def cancel(handle: Optional[asyncio.TimerHandle]):
+        if handle is not None:
+            handle.cancel()
+
+    def say(self, match: FakeMatch, text: str):
+        match.owner.write(f"{BANCHO} PRIVMSG {match.channel} :{text}")
+
+    def player_name(self, match: FakeMatch) -> str:
+        return match.player.replace("_", " ")
+
+    def player_joins(self, match: FakeMatch):
+        match.in_lobby = True
+        self.say(match, f"{self.player_name(match)} joined in slot 1.")
+        self.later(match, self.ready_seconds, self.player_ready, match)
+
+    def player_ready(self, match: FakeMatch):
+        if match.in_lobby and not match.playing:
+            self.say(match, "All players are ready")
+
+    def start_game(self, match: FakeMatch):
+        if not match.in_lobby:
+            return
+        match.playing = True
+        self.say(match, "The match has started!")
+        if random.random() < self.leave_probability:
+            match.game = self.later(
+                match, self.map_seconds / 2, self.player_leaves, match
+            )
+        else:
+            match.game = self.later(match, self.map_seconds, self.finish_game, match)
+
+    def finish_game(self, match: FakeMatch):
+        match.playing = False
+        score = random.randint(100000, 1000000)
+        self.say(
+            match,
+            f"{self.player_name(match)} finished playing (Score: {score}, PASSED).",
+        )
+        self.say(match, "The match has finished!")
+
+    def player_leaves(self, match: FakeMatch):
+        match.playing = False
+        match.in_lobby = False
+        self.say(match, f"{self.player_name(match)} left the game.")
+        self.later(match, 30, self.player_joins, match)
+
+    def close_match(self, match: FakeMatch):
+        for handle in match.handles:
+            handle.cancel()
+        self.matches.pop(match.channel, None)
+        self.matches_closed += 1
+        self.say(match, "Closed the match")
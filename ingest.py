@@ -0,0 +1,149 @@
+"""Build BeatmapScores from stored osu! multiplayer match JSON.
+
+Reads match files in the osu! API v1 `get_match` format, named
+`<match_id>.json`, either from a directory or downloaded from an API (a local
+stub works the same way) with `download_match`. Keeps the best score per player
+on each mappool map and remembers which matches are already processed so
+re-runs only parse new ones.
+"""
+import argparse
+import json
+import logging
+import os
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from beatmap import Beatmap
+from score import BeatmapScores, OsuScore
+
+logger = logging.getLogger("tryouts-bot")
+
+# (beatmap_id, user_id, score)
+ScoreRow = Tuple[str, str, int]
+
+
+def iter_match_scores(match: dict) -> Iterator[ScoreRow]:
+    """Yield every score of every game in a `get_match` response."""
+    for game in match.get("games", []):
+        beatmap_id = str(game["beatmap_id"])
+        for score in game.get("scores", []):
+            yield beatmap_id, str(score["user_id"]), int(score["score"])
+
+
+def parse_match_file(path: str) -> Tuple[str, List[ScoreRow]]:
+    with open(path, encoding="utf-8") as f:
+        match = json.load(f)
+    return _match_id_from_path(path), list(iter_match_scores(match))
+
+
+def download_match(api_url: str, api_key: str, match_id: str, directory: str) -> str:
+    """Save `get_match` for `match_id` to `directory` and return the file path."""
+    path = os.path.join(directory, f"{match_id}.json")
+    url = f"{api_url.rstrip('/')}/get_match?k={api_key}&mp={match_id}"
+    with urllib.request.urlopen(url, timeout=30) as response:
+        data = response.read()
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+def _match_id_from_path(path: str) -> str:
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+class MatchIngestion:
+    """Incrementally ingests match files into per-beatmap scores.
+
+    Extracted rows are kept in `state_path` keyed by match id, so a match is
+    parsed once no matter how many times the ingestion is run.
+    """
+
+    def __init__(self, mappool: List[Beatmap], state_path: str = "ingest_state.json"):
+        self.beatmap_ids = {beatmap.beatmap_id for beatmap in mappool}
+        self.state_path = state_path
+        self.matches: Dict[str, List[ScoreRow]] = {}
+        if os.path.exists(state_path):
+            with open(state_path, encoding="utf-8") as f:
+                self.matches = {
+                    match_id: [tuple(row) for row in rows]
+                    for match_id, rows in json.load(f).items()
+                }
+
+    def ingest(self, paths: Iterable[str], max_workers: Optional[int] = None) -> int:
+        """Parse the match files that are not processed yet, in parallel."""
+        new_paths = [
+            path for path in paths if _match_id_from_path(path) not in self.matches
+        ]
+        if not new_paths:
+            return 0
+
+        worker_count = max_workers or os.cpu_count() or 1
+        chunksize = max(1, len(new_paths) // (worker_count * 4))
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            for match_id, rows in executor.map(
+                parse_match_file, new_paths, chunksize=chunksize
+            ):
+                self.matches[match_id] = rows
+
+        self.save()
+        logger.info(f"Ingested {len(new_paths)} new matches.")
+        return len(new_paths)
+
+    def ingest_directory(self, directory: str, max_workers: Optional[int] = None):
+        paths = [
+            os.path.join(directory, name)
+            for name in os.listdir(directory)
+            if name.endswith(".json")
+        ]
+        return self.ingest(paths, max_workers=max_workers)
+
+    def save(self):
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.matches, f)
+        os.replace(tmp_path, self.state_path)
+
+    def build_beatmap_scores(
+        self, player_names: Optional[Dict[str, str]] = None
+    ) -> Dict[str, BeatmapScores]:
+        """Best score per player on every map, named through `player_names` if given."""
+        player_names = player_names or {}
+        best: Dict[str, Dict[str, int]] = {
+            beatmap_id: {} for beatmap_id in self.beatmap_ids
+        }
+        for rows in self.matches.values():
+            for beatmap_id, user_id, score in rows:
+                map_best = best.get(beatmap_id)
+                if map_best is None:
+                    # Not a map of the current mappool.
+                    continue
+                if score > map_best.get(user_id, -1):
+                    map_best[user_id] = score
+
+        return {
+            beatmap_id: BeatmapScores(
+                beatmap_id,
+                [
+                    OsuScore(player_names.get(user_id, user_id), beatmap_id, score)
+                    for user_id, score in map_best.items()
+                ],
+            )
+            for beatmap_id, map_best in best.items()
+        }
+
+
+if __name__ == "__main__":
+    from sheets import MappoolSpreadsheet
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("directory", help="Directory with <match_id>.json files.")
+    parser.add_argument("--state", default="ingest_state.json")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    ingestion = MatchIngestion(MappoolSpreadsheet().get_mappool(), args.state)
+    ingestion.ingest_directory(args.directory, max_workers=args.workers)
+    for beatmap_id, beatmap_scores in ingestion.build_beatmap_scores().items():
+        print(beatmap_id, len(beatmap_scores.scores))
@@ -1,17 +1,49 @@
 from __future__ import annotations
 
 import datetime
-import json
 import logging
-from typing import List, Callable, Any, Dict
+import time
+from collections import Counter
+from typing import List, Callable, Any, Dict, Optional
 
 import irc
 import irc.bot
 import irc.client
 
+from admission import LobbyAdmissionQueue
+from bancho import (
+    BANCHO_BOT,
+    AllPlayersReady,
+    CountdownFinished,
+    EventHandlers,
+    MatchCreated,
+    MatchSettings,
+    MatchLimitReached,
+    MatchStarted,
+    PlayerFinished,
+    PlayerJoined,
+    PlayerLeft,
+    PlayerStats,
+    SettingsBeatmap,
+    SettingsPlayers,
+    SettingsRoom,
+    SettingsSlot,
+    parse_privmsg,
+    parse_pubmsg,
+)
 from beatmap import Beatmap
-from lobbies import LobbyState, LobbyDetails
-from sheets import TryoutLobbiesSheet, PlayersSheet
+from command_plan import CommandPlan
+from config_watcher import ConfigVersion, ConfigWatcher
+from irc_trace import TraceWriter
+from journal import LobbyJournal
+from lobbies import LobbyState, LobbyDetails, LobbyRegistry
+from metrics import MetricsRegistry, MetricsServer
+from outbox import OutboundScheduler, Priority
+from player_index import PlayerIndex
+from sheets_worker import SheetsWorker
+from store import TryoutStore, SheetsMirror, irc_nickname, player_key
+from timer_wheel import TimerWheel
+from tournaments import Tournament, TournamentIndex, tournament_window
 
 logger = logging.getLogger("tryouts-bot")
 
@@ -23,6 +55,25 @@ class TryoutsBot(irc.bot.SingleServerIRCBot):
     BEFORE_READY_WAIT_SECONDS = 120
     DISCONNECT_WAIT_TIMEOUT = 300
     MAX_ALLOWED_PLAYS = 1
+    MESSAGES_PER_SECOND = 1
+    MESSAGE_BURST = 4
+    OUTBOX_DRAIN_INTERVAL = 0.1
+    LOBBY_QUEUE_RETRY_SECONDS = 60
+    LOBBY_REQUEST_TIMEOUT_SECONDS = 30
+    SHEETS_MIRROR_INTERVAL = 10
+    TRACE_FLUSH_INTERVAL = 1
+    METRICS_UPDATE_INTERVAL = 1
+    CONFIG_POLL_INTERVAL = 30
+    LOBBY_TIMER_TICK_SECONDS = 1
+    # Deadlines are the Bancho timers we start plus this much slack.
+    LOBBY_DEADLINE_GRACE_SECONDS = 30
+    INVITE_WAIT_TIMEOUT = 600
+    DEFAULT_MAP_SECONDS = 600
+    MAX_MISSED_DEADLINES = 2
+    RECONNECT_MIN_INTERVAL = 5
+    RECONNECT_MAX_INTERVAL = 30
+    # IRC lines are at most 512 bytes with the command and CRLF.
+    MAX_JOIN_LINE_LENGTH = 500
 
     def __init__(
         self,
@@ -30,59 +81,404 @@ class TryoutsBot(irc.bot.SingleServerIRCBot):
         password: str,
         mappool: List[Beatmap],
         allowed_players: List[str] = None,
+        admins: List[str] = None,
+        server: str = "irc.ppy.sh",
+        port: int = 6667,
+        journal_path: str = "lobbies.journal",
+        store_path: str = "tryouts.sqlite3",
+        mirror_to_sheets: bool = True,
+        trace_path: str = None,
+        metrics_port: int = None,
+        config: ConfigWatcher = None,
+        tournaments: List[Tournament] = None,
     ):
+        self.started_at = time.monotonic()
         logger.debug(f"TryoutsBot initating: {nickname} {password} {mappool}")
         irc.bot.SingleServerIRCBot.__init__(
-            self, [("irc.ppy.sh", 6667, password)], nickname, nickname
+            self, [(server, port, password)], nickname, nickname
         )
-        with open("settings.json", encoding="utf-8") as f:
-            self.settings = json.load(f)
+        # Shared by all tournaments, versions with the same content share a plan.
+        self.command_plans: Dict[str, CommandPlan] = {}
+        if tournaments is None:
+            tournaments = [
+                Tournament(
+                    "",
+                    config or ConfigWatcher(load_mappool=lambda: mappool),
+                    allowed_players,
+                )
+            ]
+        self.tournaments = tournaments
+        self.tournaments_by_key = {tournament.key: tournament for tournament in tournaments}
+        self.default_tournament = tournaments[0]
+        for tournament in tournaments:
+            self.apply_config(tournament, tournament.config.current)
+            tournament.config.validate = self.check_config
+
+        self.recon = irc.bot.ExponentialBackoff(
+            min_interval=self.RECONNECT_MIN_INTERVAL,
+            max_interval=self.RECONNECT_MAX_INTERVAL,
+        )
+        # Set between the welcome and a disconnect, messages wait in the outbox otherwise.
+        self.registered = False
+        self.disconnected_at: Optional[float] = None
+        # lobby_channel: its `!mp settings` reply, None until the reply starts
+        self.lobby_resyncs: Dict[str, Optional[MatchSettings]] = {}
+        self.recovery_started_at = self.started_at
+        self.last_recovery_seconds: Optional[float] = None
+
+        self.ignored_events = ["all_raw_messages", "quit"]
 
-        self.recon = irc.bot.ExponentialBackoff(min_interval=5, max_interval=30)
+        self.admins = admins or []
+
+        self.lobby_queue = LobbyAdmissionQueue()
+
+        self.active_lobbies = LobbyRegistry()
+
+        self.bancho_privmsg_handlers: EventHandlers = {
+            MatchCreated: lambda event: self.start_created_lobby(
+                match_id=event.match_id, player=event.player
+            ),
+            MatchLimitReached: lambda event: self.queue_refused_lobby_request(),
+            PlayerStats: lambda event: self.add_player_to_sheet(
+                player_id=event.player_id, player_name=event.player
+            ),
+        }
+        self.bancho_pubmsg_handlers: EventHandlers = {
+            AllPlayersReady: lambda channel, event: self.start_lobby(channel),
+            CountdownFinished: lambda channel, event: self.resolve_countdown_finished(
+                channel
+            ),
+            MatchStarted: lambda channel, event: self.start_lobby_callback(channel),
+            PlayerFinished: self.bancho_player_finished,
+            PlayerJoined: self.bancho_player_joined,
+            PlayerLeft: self.bancho_player_left,
+            SettingsRoom: self.bancho_settings_room,
+            SettingsBeatmap: self.bancho_settings_beatmap,
+            SettingsPlayers: self.bancho_settings_players,
+            SettingsSlot: self.bancho_settings_slot,
+        }
+        self.privmsg_commands = {
+            "!play": self.make_lobby,
+            "!invite": self.invite_lobby,
+            "!resync": self.resync_command,
+        }
+        self.pubmsg_commands = {
+            "!abort": lambda author, channel: self.abort_map(author),
+            "!skip": lambda author, channel: self.skip_map(author),
+            "!quit": lambda author, channel: self.close_match(author),
+            "!play": lambda author, channel: self.start_lobby(channel),
+        }
+        self.event_methods: Dict[str, Callable] = {}
+
+        self.trace = None
+        if trace_path is not None:
+            self.trace = TraceWriter(trace_path)
+            self.reactor.scheduler.execute_every(
+                self.TRACE_FLUSH_INTERVAL, self.trace.flush
+            )
 
-        self.tournament_start = datetime.datetime.fromisoformat(
-            self.settings["tournamentStart"]
+        self.metrics = MetricsRegistry()
+        self.dispatch_seconds = self.metrics.histogram(
+            "tryouts_dispatch_seconds", "Time spent handling an IRC event.", "event"
         )
-        self.tournament_end = datetime.datetime.fromisoformat(
-            self.settings["tournamentEnd"]
+        self.handler_seconds = self.metrics.histogram(
+            "tryouts_lobby_handler_seconds", "Time spent in a lobby handler.", "handler"
+        )
+        self.send_seconds = self.metrics.histogram(
+            "tryouts_send_seconds", "Time spent queueing an outgoing message."
+        ).labels()
+        self.lobbies_gauge = self.metrics.gauge(
+            "tryouts_active_lobbies", "Active lobbies by lobby state.", "state"
+        )
+        self.outbox_depth_gauge = self.metrics.gauge(
+            "tryouts_outbox_depth", "Messages waiting in the outbox."
+        ).labels()
+        self.pending_requests_gauge = self.metrics.gauge(
+            "tryouts_pending_lobby_requests",
+            "Lobby requests sent to BanchoBot (in_flight) or queued (waiting).",
+            "stage",
+        )
+        self.sheets_queue_gauge = self.metrics.gauge(
+            "tryouts_sheets_queue_depth", "Jobs waiting for the sheets worker."
+        ).labels()
+        self.sheets_quota_gauge = self.metrics.gauge(
+            "tryouts_sheets_requests_last_minute",
+            "Sheets API requests made in the last minute (used) and allowed (limit).",
+            "quota",
+        )
+        self.lobby_timers_gauge = self.metrics.gauge(
+            "tryouts_lobby_timers", "Lobbies with a pending local deadline."
+        ).labels()
+        self.recovery_seconds = self.metrics.histogram(
+            "tryouts_recovery_seconds",
+            "Time from a start or disconnect until every active lobby was resynced.",
+        ).labels()
+        self.metrics_server = None
+        if metrics_port is not None:
+            self.metrics_server = MetricsServer(self.metrics, metrics_port)
+        self.reactor.scheduler.execute_every(
+            self.METRICS_UPDATE_INTERVAL, self.update_metrics
         )
 
-        self.ignored_events = ["all_raw_messages", "quit"]
+        self.lobby_timers = TimerWheel(tick_seconds=self.LOBBY_TIMER_TICK_SECONDS)
+        # player: [(lobby_state, next_map_idx) the timer is for, missed deadlines]
+        self.lobby_deadlines: Dict[str, list] = {}
+        self.reactor.scheduler.execute_every(
+            self.LOBBY_TIMER_TICK_SECONDS, self.lobby_timers.advance
+        )
 
-        self.mappool = mappool
-        if allowed_players is None:
-            self.allowed_players = []
-        else:
-            self.allowed_players = allowed_players
+        self.journal = LobbyJournal(journal_path)
+        for player, lobby_details in self.journal.replay().items():
+            tournament = self.tournaments_by_key.get(lobby_details.tournament)
+            if tournament is None:
+                logger.warning(
+                    f"{player} lobby belongs to the {lobby_details.tournament!r} "
+                    f"tournament which is not hosted anymore, moving it to "
+                    f"{self.default_tournament.key!r}."
+                )
+                tournament = self.default_tournament
+                lobby_details.tournament = tournament.key
+            if lobby_details.config_version not in tournament.config:
+                logger.warning(
+                    f"{player} lobby was started with config version "
+                    f"{lobby_details.config_version!r} which changed while we were "
+                    f"away, moving it to {tournament.config_version.version}."
+                )
+                lobby_details.config_version = tournament.config_version.version
+            self.active_lobbies[player] = lobby_details
+        self.outbox = OutboundScheduler(
+            send_func=self.connection.privmsg,
+            rate=self.MESSAGES_PER_SECOND,
+            burst=self.MESSAGE_BURST,
+            can_send=lambda: self.registered,
+        )
+        self.schedule_outbox_pacing()
+        self.reactor.scheduler.execute_every(
+            self.LOBBY_QUEUE_RETRY_SECONDS, self.retry_lobby_queue
+        )
+
+        self.store = TryoutStore(store_path)
+        self.sheets_worker = SheetsWorker(registry=self.metrics)
+        self.sheets_worker.start()
+        self.reactor.scheduler.execute_every(
+            self.CONFIG_POLL_INTERVAL, self.poll_config
+        )
+        self.sheets_mirrors: List[SheetsMirror] = []
+        if mirror_to_sheets:
+            for tournament in tournaments:
+                sheets_mirror = SheetsMirror(
+                    self.store,
+                    tournament.key,
+                    spreadsheet_id=tournament.stats_spreadsheet_id,
+                    lobbies_range=tournament.lobbies_range,
+                    players_range=tournament.players_range,
+                    registry=self.metrics,
+                )
+                try:
+                    sheets_mirror.import_sheets(only_if_empty=True)
+                except Exception:
+                    logger.exception(
+                        f"Could not import the {tournament.key!r} sheets into the store."
+                    )
+                self.sheets_mirrors.append(sheets_mirror)
+            self.reactor.scheduler.execute_every(
+                self.SHEETS_MIRROR_INTERVAL, self.mirror_to_sheets
+            )
+        self.rebuild_player_index()
 
-        self.last_lobby_requester = ""
+    def start(self):
+        if self.metrics_server is not None:
+            self.metrics_server.start()
+        if self.trace is not None:
+            self.trace.write_header(self._nickname, self.admins, self.tournaments)
+        super().start()
 
-        self.tournament_name = self.settings["tournamentName"]
+    def apply_config(self, tournament: Tournament, config_version: ConfigVersion):
+        """Use `config_version` for the new lobbies of `tournament`."""
+        command_plan = self.compile_command_plan(config_version)
+        tournament.apply_config(config_version)
+        self.command_plans[config_version.version] = command_plan
 
-        self.active_lobbies: Dict[str, LobbyDetails] = {}
-        self.played_lobbies: Dict[str, List[LobbyDetails]] = {}
-        self.connection.set_rate_limit(1)
+    def check_config(self, config_version: ConfigVersion):
+        """Raise if `config_version` cannot be applied, before `poll` swaps it in."""
+        tournament_window(config_version.settings)
+        config_version.settings["tournamentName"]
+        self.compile_command_plan(config_version)
+
+    def compile_command_plan(self, config_version: ConfigVersion) -> CommandPlan:
+        return CommandPlan(
+            config_version.mappool,
+            config_version.settings,
+            before_ready_wait_seconds=self.BEFORE_READY_WAIT_SECONDS,
+            disconnect_wait_timeout=self.DISCONNECT_WAIT_TIMEOUT,
+            max_allowed_leaves=self.MAX_ALLOWED_LEAVES,
+        )
+
+    def lobby_plan(self, lobby_details: LobbyDetails) -> CommandPlan:
+        """The command plan of the config version the lobby was started with."""
+        command_plan = self.command_plans.get(lobby_details.config_version)
+        if command_plan is None:
+            config_version = self.lobby_config(lobby_details)
+            command_plan = self.command_plans.get(config_version.version)
+            if command_plan is None:
+                command_plan = self.compile_command_plan(config_version)
+                self.command_plans[config_version.version] = command_plan
+        return command_plan
+
+    def lobby_config(self, lobby_details: LobbyDetails) -> ConfigVersion:
+        """The config version the lobby was started with."""
+        tournament = self.tournaments_by_key[lobby_details.tournament]
+        return tournament.config.get(lobby_details.config_version)
+
+    def rebuild_player_index(self):
+        """Load the player identities and played lobbies from the store."""
+        self.player_index_stale = False
+        self.player_index = PlayerIndex.from_store(self.store)
+        self.tournament_index = TournamentIndex(self.tournaments, self.player_index)
+        logger.info(f"Indexed {len(self.player_index)} players.")
+
+    def player_tournament(self, player: str) -> Tournament:
+        """The tournament of `player`, or the default one for players in none."""
+        return self.tournament_index.tournament_for(player) or self.default_tournament
+
+    def poll_config(self):
+        """Switch to the configs the last poll loaded and start the next poll."""
+        for tournament in self.tournaments:
+            config = tournament.config
+            if config.current is not tournament.config_version:
+                self.apply_config(tournament, config.current)
+                logger.info(
+                    f"Switched {tournament.key!r} to config version "
+                    f"{tournament.config_version.version}."
+                )
+            config.retain(
+                lobby_details.config_version
+                for lobby_details in self.active_lobbies.values()
+                if lobby_details.tournament == tournament.key
+            )
+        for version in list(self.command_plans):
+            if not any(version in tournament.config for tournament in self.tournaments):
+                del self.command_plans[version]
+        if self.sheets_worker.queue_depth == 0:
+            for tournament in self.tournaments:
+                self.sheets_worker.submit(
+                    f"poll {tournament.key!r} config", tournament.config.poll
+                )
+
+    def update_metrics(self):
+        lobby_states = Counter(
+            lobby_details.lobby_state for lobby_details in self.active_lobbies.values()
+        )
+        for lobby_state in LobbyState:
+            self.lobbies_gauge.labels(lobby_state.name).set(lobby_states[lobby_state])
+        self.outbox_depth_gauge.set(self.outbox.queue_depth)
+        self.pending_requests_gauge.labels("in_flight").set(
+            len(self.lobby_queue.in_flight)
+        )
+        self.pending_requests_gauge.labels("waiting").set(len(self.lobby_queue.waiting))
+        self.sheets_queue_gauge.set(self.sheets_worker.queue_depth)
+        self.sheets_quota_gauge.labels("used").set(self.sheets_worker.requests_last_minute)
+        self.sheets_quota_gauge.labels("limit").set(self.sheets_worker.requests_per_minute)
+        self.lobby_timers_gauge.set(len(self.lobby_timers))
+
+    def schedule_outbox_pacing(self):
+        """Drain the outbox periodically as tokens are refilled."""
+        self.reactor.scheduler.execute_every(
+            self.OUTBOX_DRAIN_INTERVAL, self.outbox.drain
+        )
 
     def _on_kick(
         self, connection: irc.client.ServerConnection, event: irc.client.Event
     ):
         channel = event.target
 
-        player_to_be_removed = None
-        for player, lobby_details in self.active_lobbies.items():
-            if lobby_details.lobby_channel == channel:
-                player_to_be_removed = player
-
-        if player_to_be_removed:
+        lobby_details = self.active_lobbies.pop_by_channel(channel)
+        if lobby_details:
             logger.debug(
-                f"Removing {player_to_be_removed} from active lobbies because we are kicked?"
+                f"Removed {lobby_details.player} from active lobbies because we are kicked?"
             )
-            self.active_lobbies.pop(player_to_be_removed)
+            self.journal.remove(lobby_details.player)
+            self.track_lobby_deadline(lobby_details.player)
+            if channel in self.lobby_resyncs:
+                del self.lobby_resyncs[channel]
+                self.check_lobbies_recovered()
+            self.admit_next_lobby_request()
         else:
             logger.debug(
                 f"We are kicked but I couldn't find the active lobby. The lobbies were: {self.active_lobbies}"
             )
 
+    def on_welcome(
+        self, connection: irc.client.ServerConnection, event: irc.client.Event
+    ):
+        """Rejoin the active lobbies and resync them with `!mp settings`.
+
+        All channels are joined in a few pipelined JOIN lines, then every lobby
+        is reconciled with the settings reply Bancho sends for it.
+        """
+        self.registered = True
+        self.recovery_started_at = self.disconnected_at or self.started_at
+        self.disconnected_at = None
+        self.lobby_resyncs = {}
+        # Lobby requests queued while away are only sent now, time them from here.
+        self.lobby_queue.restart_timeouts()
+        lobbies = list(self.active_lobbies.values())
+        self.join_channels(connection, [lobby.lobby_channel for lobby in lobbies])
+        for lobby_details in lobbies:
+            self.lobby_resyncs[lobby_details.lobby_channel] = None
+            # Served before player messages, after what the channel already has queued.
+            self.send(
+                lobby_details.lobby_channel, "!mp settings", priority=Priority.CRITICAL
+            )
+        logger.info(f"Rejoined {len(lobbies)} lobbies, waiting for their settings.")
+        self.check_lobbies_recovered()
+
+    def on_disconnect(
+        self, connection: irc.client.ServerConnection, event: irc.client.Event
+    ):
+        self.registered = False
+        if self.disconnected_at is None:
+            self.disconnected_at = time.monotonic()
+        # Replies to the !mp make lines already sent were lost with the connection.
+        for player in self.lobby_queue.lost(self.unsent_lobby_requests()):
+            logger.info(f"Requesting the lobby of {player} again after reconnecting.")
+            self.request_lobby(player)
+        logger.warning(
+            f"Disconnected with {len(self.active_lobbies)} active lobbies, reconnecting."
+        )
+
+    def on_nosuchchannel(
+        self, connection: irc.client.ServerConnection, event: irc.client.Event
+    ):
+        # The match was closed while we were away, same as being kicked from it.
+        channel = event.arguments[0]
+        if channel in self.lobby_resyncs:
+            self._on_kick(connection, irc.client.Event("kick", event.source, channel))
+
+    def join_channels(self, connection: irc.client.ServerConnection, channels: List[str]):
+        """Join `channels` with as few JOIN lines as fit, without waiting for replies."""
+        line: List[str] = []
+        length = len("JOIN ")
+        for channel in channels:
+            if line and length + len(channel) > self.MAX_JOIN_LINE_LENGTH:
+                connection.send_raw("JOIN " + ",".join(line))
+                line = []
+                length = len("JOIN ")
+            line.append(channel)
+            length += len(channel) + 1
+        if line:
+            connection.send_raw("JOIN " + ",".join(line))
+
+    def check_lobbies_recovered(self):
+        if self.lobby_resyncs:
+            return
+        self.last_recovery_seconds = time.monotonic() - self.recovery_started_at
+        self.recovery_seconds.observe(self.last_recovery_seconds)
+        logger.info(
+            f"Serving {len(self.active_lobbies)} recovered lobbies "
+            f"{self.last_recovery_seconds:.2f}s after losing them."
+        )
+
     def on_privmsg(
         self, connection: irc.client.ServerConnection, event: irc.client.Event
     ):
@@ -90,23 +486,22 @@ class TryoutsBot(irc.bot.SingleServerIRCBot):
 
         Handles a privmsg event. Calls the corresponding function depending on the message.
         If the message is:
-        - !q: Handle queue command. Start a private lobby for the player.
+        - !play: Start a private lobby for the player.
+        - !invite: Re-send the invite for the player's active lobby.
+        - !resync: (admins only) Reload the played lobbies cache from sheets.
         """
         author = event.source.nick
         message = event.arguments[0]
 
-        if author == "BanchoBot":
-            if message.startswith("Created the tournament"):
-                self.parse_and_start_lobby(message=message)
-            elif message.startswith("You cannot create any more tournament matches."):
-                self.send(self.last_lobby_requester, self.settings["lobbyFull"])
-            elif message.startswith("Stats for"):
-                self.add_player_to_sheet(message=message)
+        if author == BANCHO_BOT:
+            bancho_event = parse_privmsg(message)
+            handler = self.bancho_privmsg_handlers.get(type(bancho_event))
+            if handler is not None:
+                handler(bancho_event)
         else:
-            if message == "!play":
-                self.make_lobby(author=author)
-            elif message == "!invite":
-                self.invite_lobby(author=author)
+            handler = self.privmsg_commands.get(message)
+            if handler is not None:
+                handler(author)
 
     def on_pubmsg(
         self, connection: irc.client.ServerConnection, event: irc.client.Event
@@ -121,45 +516,83 @@ class TryoutsBot(irc.bot.SingleServerIRCBot):
         channel = event.target
         message = event.arguments[0]
 
-        if author == "BanchoBot":
-            if message == "All players are ready":
-                self.start_lobby(channel)
-            elif message == "Countdown finished":
-                self.resolve_countdown_finished(channel)
-            elif message == "The match has started!":
-                self.start_lobby_callback(channel)
-            elif "finished playing" in message:
-                player = message.split(" finished playing")[0]
-                player = player.replace(" ", "_")
-                self.change_map_lobby(player)
-            elif "joined in slot 1" in message:
-                player = message.split(" joined in slot")[0]
-                player = player.replace(" ", "_")
-                self.greet_player(player)
-            elif "left the game." in message:
-                player = message.split(" left the game")[0]
-                player = player.replace(" ", "_")
-                self.resolve_player_leave(player)
+        if author == BANCHO_BOT:
+            bancho_event = parse_pubmsg(message)
+            handler = self.bancho_pubmsg_handlers.get(type(bancho_event))
+            if handler is not None:
+                handler(channel, bancho_event)
+        else:
+            handler = self.pubmsg_commands.get(message)
+            if handler is not None:
+                handler(author, channel)
+
+    def resync_command(self, author: str):
+        if author in self.admins:
+            self.update_played_lobbies()
+            self.send(author, "Resyncing played lobbies from sheets.")
+
+    def bancho_player_finished(self, channel: str, event: PlayerFinished):
+        self.change_map_lobby(irc_nickname(event.player))
+
+    def bancho_player_joined(self, channel: str, event: PlayerJoined):
+        if event.slot == 1:
+            self.greet_player(irc_nickname(event.player))
+
+    def bancho_player_left(self, channel: str, event: PlayerLeft):
+        self.resolve_player_leave(irc_nickname(event.player))
+
+    def bancho_settings_room(self, channel: str, event: SettingsRoom):
+        if channel in self.lobby_resyncs:
+            self.lobby_resyncs[channel] = MatchSettings()
+
+    def bancho_settings_beatmap(self, channel: str, event: SettingsBeatmap):
+        match_settings = self.lobby_resyncs.get(channel)
+        if match_settings is not None:
+            match_settings.beatmap_id = event.beatmap_id
+
+    def bancho_settings_players(self, channel: str, event: SettingsPlayers):
+        match_settings = self.lobby_resyncs.get(channel)
+        if match_settings is not None:
+            match_settings.player_count = event.count
+            self.lobby_settings_updated(channel, match_settings)
+
+    def bancho_settings_slot(self, channel: str, event: SettingsSlot):
+        match_settings = self.lobby_resyncs.get(channel)
+        if match_settings is not None:
+            match_settings.players.append(event.player)
+            self.lobby_settings_updated(channel, match_settings)
+
+    def lobby_settings_updated(self, channel: str, match_settings: MatchSettings):
+        if not match_settings.complete:
+            return
+        lobby_details = self.active_lobbies.get_by_channel(channel)
+        if lobby_details is None:
+            self.lobby_resyncs.pop(channel)
         else:
-            if message == "!abort":
-                self.abort_map(author=author)
-            elif message == "!skip":
-                self.skip_map(author=author)
-            elif message == "!quit":
-                self.close_match(author=author)
-            elif message == "!play":
-                self.start_lobby(channel)
+            self.reconcile_lobby(lobby_details.player)
+        self.check_lobbies_recovered()
 
     @staticmethod
     def lobby_decorator(function: Callable[[TryoutsBot, str], Any]):
         def wrapper(self, author: str) -> Any:
             if author in self.active_lobbies:
+                start = time.perf_counter()
                 lobby_details = self.active_lobbies.get(author)
-                logger.debug(f"{function.__name__} called with: {lobby_details}")
+                debug = logger.isEnabledFor(logging.DEBUG)
+                if debug:
+                    logger.debug("%s called with: %s", function.__name__, lobby_details)
                 function(self, lobby_details)
-                lobby_details_new = self.active_lobbies.get(author)
-                logger.debug(
-                    f"Lobby details after {function.__name__}: {lobby_details_new}"
+                if debug:
+                    logger.debug(
+                        "Lobby details after %s: %s",
+                        function.__name__,
+                        self.active_lobbies.get(author),
+                    )
+                self.journal_lobby(author)
+                self.track_lobby_deadline(author)
+                self.record_lobby_event(author, function.__name__)
+                self.handler_seconds.labels(function.__name__).observe(
+                    time.perf_counter() - start
                 )
                 return
             else:
@@ -170,24 +603,174 @@ class TryoutsBot(irc.bot.SingleServerIRCBot):
 
         return wrapper
 
+    def record_lobby_event(self, player: str, event: str):
+        lobby_details = self.active_lobbies.get(player)
+        if lobby_details is not None:
+            self.store.add_lobby_event(
+                lobby_details.match_id, event, lobby_details.lobby_state
+            )
+
+    def journal_lobby(self, player: str):
+        lobby_details = self.active_lobbies.get(player)
+        if lobby_details is None:
+            self.journal.remove(player)
+        else:
+            self.journal.record(lobby_details)
+
+    def lobby_deadline_seconds(self, lobby_details: LobbyDetails) -> Optional[float]:
+        """How long a lobby may stay in its state before we stop waiting for Bancho."""
+        lobby_state = lobby_details.lobby_state
+        if lobby_state == LobbyState.LOBBY_INITIALIZED:
+            return self.INVITE_WAIT_TIMEOUT
+        elif lobby_state == LobbyState.LOBBY_WAITING:
+            if not lobby_details.ready_timer_sent:
+                # Greeted, the first map starts when the player readies up.
+                return self.INVITE_WAIT_TIMEOUT
+            return self.BEFORE_READY_WAIT_SECONDS + self.LOBBY_DEADLINE_GRACE_SECONDS
+        elif lobby_state == LobbyState.LOBBY_DISCONNECTED:
+            return self.DISCONNECT_WAIT_TIMEOUT + self.LOBBY_DEADLINE_GRACE_SECONDS
+        elif lobby_state == LobbyState.LOBBY_PLAYING:
+            current_map = self.lobby_config(lobby_details).mappool[
+                lobby_details.next_map_idx - 1
+            ]
+            map_seconds = current_map.length_seconds or self.DEFAULT_MAP_SECONDS
+            return map_seconds + self.LOBBY_DEADLINE_GRACE_SECONDS
+        return None
+
+    def track_lobby_deadline(self, player: str):
+        """(Re)arm the deadline of a lobby when its state or map changed."""
+        lobby_details = self.active_lobbies.get(player)
+        if lobby_details is None:
+            self.lobby_deadlines.pop(player, None)
+            self.lobby_timers.cancel(player)
+            return
+        armed_for = (lobby_details.lobby_state, lobby_details.next_map_idx)
+        deadline = self.lobby_deadlines.get(player)
+        if deadline is not None and deadline[0] == armed_for and player in self.lobby_timers:
+            return
+        if deadline is None or deadline[0] != armed_for:
+            self.lobby_deadlines[player] = [armed_for, 0]
+
+        seconds = self.lobby_deadline_seconds(lobby_details)
+        if seconds is None:
+            self.lobby_timers.cancel(player)
+        else:
+            self.lobby_timers.schedule(player, seconds, self.lobby_deadline_expired)
+
+    def lobby_deadline_expired(self, player: str):
+        """Act on the Bancho message we did not get, or close a stuck lobby."""
+        lobby_details = self.active_lobbies.get(player)
+        if lobby_details is None:
+            self.lobby_deadlines.pop(player, None)
+            return
+        if not self.registered:
+            # Bancho could not reach us, the resync after reconnecting sorts it out.
+            self.lobby_timers.schedule(
+                player, self.LOBBY_DEADLINE_GRACE_SECONDS, self.lobby_deadline_expired
+            )
+            return
+        deadline = self.lobby_deadlines[player]
+        deadline[1] += 1
+        lobby_state = lobby_details.lobby_state
+        logger.warning(
+            f"{player} lobby missed its {lobby_state.name} deadline ({deadline[1]} times)."
+        )
+        self.store.add_lobby_event(
+            lobby_details.match_id, "deadline_expired", lobby_state
+        )
+
+        if (
+            lobby_state == LobbyState.LOBBY_INITIALIZED
+            or (
+                lobby_state == LobbyState.LOBBY_WAITING
+                and not lobby_details.ready_timer_sent
+            )
+            or deadline[1] > self.MAX_MISSED_DEADLINES
+        ):
+            self.close_match(player)
+        elif lobby_state in (LobbyState.LOBBY_WAITING, LobbyState.LOBBY_DISCONNECTED):
+            # Same as the "Countdown finished" we should have received.
+            self.resolve_countdown_finished(lobby_details.lobby_channel)
+        elif lobby_state == LobbyState.LOBBY_PLAYING:
+            self.skip_map(player)
+        self.track_lobby_deadline(player)
+
+    @lobby_decorator
+    def reconcile_lobby(self, lobby_details: LobbyDetails):
+        """Bring a lobby in line with its `!mp settings` reply after we were away."""
+        match_settings = self.lobby_resyncs.pop(lobby_details.lobby_channel)
+        lobby_channel = lobby_details.lobby_channel
+        player = lobby_details.player
+        command_plan = self.lobby_plan(lobby_details)
+
+        beatmap_id = match_settings.beatmap_id
+        loaded_idx = lobby_details.next_map_idx - 1
+        if (
+            beatmap_id in command_plan.beatmap_ids
+            and command_plan.beatmap_ids[loaded_idx] != beatmap_id
+        ):
+            bancho_idx = command_plan.beatmap_ids.index(beatmap_id)
+            logger.warning(
+                f"{player} lobby has map {bancho_idx} loaded instead of {loaded_idx}."
+            )
+            if bancho_idx < loaded_idx:
+                # Our map change was lost with the connection, send it again.
+                map_cmd, mod_cmd = command_plan.map_lines[loaded_idx]
+                self.send(lobby_channel, map_cmd)
+                self.send(lobby_channel, mod_cmd)
+            else:
+                # Only from an outdated journal, Bancho knows better.
+                lobby_details.next_map_idx = bancho_idx + 1
+
+        in_lobby = player_key(player) in {
+            player_key(lobby_player) for lobby_player in match_settings.players
+        }
+        lobby_state = lobby_details.lobby_state
+        logger.info(f"Resyncing {player} lobby in {lobby_state}, in lobby: {in_lobby}.")
+        if lobby_state == LobbyState.LOBBY_PLAYING:
+            # Still playing, or the lobby deadline catches the finish we missed.
+            if not in_lobby:
+                self.send(lobby_channel, command_plan.disconnect_timer_line)
+                lobby_details.lobby_state = LobbyState.LOBBY_DISCONNECTED
+        elif in_lobby:
+            if lobby_state == LobbyState.LOBBY_INITIALIZED:
+                for greeting in command_plan.greetings:
+                    self.send(lobby_channel, greeting, priority=Priority.LOW)
+            self.run_default_timer(lobby_channel, player)
+        elif lobby_state == LobbyState.LOBBY_INITIALIZED:
+            self.send(lobby_channel, f"!mp invite {player}")
+        else:
+            self.send(lobby_channel, command_plan.disconnect_timer_line)
+            lobby_details.lobby_state = LobbyState.LOBBY_DISCONNECTED
+
     @lobby_decorator
     def abort_map(self, lobby_details: LobbyDetails):
         lobby_state = lobby_details.lobby_state
         lobby_channel = lobby_details.lobby_channel
         player = lobby_details.player
         if lobby_details.player_abort_count >= self.MAX_ABORT_COUNT:
-            self.send(lobby_channel, self.settings["noAbortsLeft"])
+            self.send(lobby_channel, self.lobby_plan(lobby_details).no_aborts_left)
             return
         if lobby_state == LobbyState.LOBBY_PLAYING:
             self.active_lobbies[player].player_abort_count += 1
             self.send(lobby_channel, "!mp abort")
             self.run_default_timer(lobby_channel, player)
 
-    def add_player_to_sheet(self, message: str):
-        player_name = message.split("(")[-1].split(")")[0]
-        player_id = message.split("[")[-1].split("]")[0].split("/")[-1]
-        player_sheet = PlayersSheet()
-        player_sheet.add_player(player_id=player_id, player_name=player_name)
+    def add_player_to_sheet(self, player_id: str, player_name: str):
+        self.store.add_player(player_id=player_id, player_name=player_name)
+        self.player_index.add_player(player_id, player_name)
+        self.tournament_index.add_player(player_id, player_name)
+
+    def mirror_to_sheets(self):
+        """Hand a mirror pass to the sheets worker unless it is still busy."""
+        if self.sheets_worker.queue_depth == 0:
+            self.submit_sheets_sync()
+
+    def submit_sheets_sync(self):
+        for sheets_mirror in self.sheets_mirrors:
+            self.sheets_worker.submit(
+                f"mirror {sheets_mirror.tournament!r} store to sheets", sheets_mirror.sync
+            )
 
     def start_lobby(self, lobby_channel: str):
         """Start the lobby for the given channel"""
@@ -196,21 +779,22 @@ class TryoutsBot(irc.bot.SingleServerIRCBot):
     def start_lobby_callback(self, lobby_channel: str):
         """Lobby start callback received by BanchoBot that changes the lobby_state"""
         logger.info("Received lobby started callback, changing lobby state")
-        for author, lobby_details in self.active_lobbies.items():
-            if lobby_channel == lobby_details.lobby_channel:
-                self.active_lobbies[author].lobby_state = LobbyState.LOBBY_PLAYING
-                logger.info(f"Changed {author} lobby state to LOBBY_PLAYING")
-                break
+        lobby_details = self.active_lobbies.get_by_channel(lobby_channel)
+        if lobby_details is None:
+            logger.warning(f"Lobby started in {lobby_channel} but it is not active!")
+            return
+        lobby_details.lobby_state = LobbyState.LOBBY_PLAYING
+        self.journal.record(lobby_details)
+        self.track_lobby_deadline(lobby_details.player)
+        logger.info("Changed %s lobby state to LOBBY_PLAYING", lobby_details.player)
 
     def resolve_countdown_finished(self, lobby_channel):
         logger.info("Resolving the countdown finished event")
-        player = None
-        active_lobby = None
-        for author, lobby_details in self.active_lobbies.items():
-            if lobby_channel == lobby_details.lobby_channel:
-                player = author
-                active_lobby = lobby_details
-                break
+        active_lobby = self.active_lobbies.get_by_channel(lobby_channel)
+        if active_lobby is None:
+            logger.warning(f"Countdown finished in {lobby_channel} but it is not active!")
+            return
+        player = active_lobby.player
 
         if active_lobby.lobby_state == LobbyState.LOBBY_DISCONNECTED:
             logger.warning(
@@ -249,39 +833,43 @@ class TryoutsBot(irc.bot.SingleServerIRCBot):
             self.change_to_next_map(lobby_details)
 
         logger.debug(
-            f"Lobby details after changing map: {self.active_lobbies.get(player)}"
+            "Lobby details after changing map: %s", self.active_lobbies.get(player)
         )
 
     def change_to_next_map(self, lobby_details: LobbyDetails):
         player = lobby_details.player
         next_map_idx = lobby_details.next_map_idx
+        command_plan = self.lobby_plan(lobby_details)
 
-        if next_map_idx == len(self.mappool):
+        if next_map_idx == command_plan.map_count:
             logger.info("Exhausted all mappool, ending the lobby!")
             self.active_lobbies[player].lobby_state = LobbyState.LOBBY_ENDING
             self.close_match(player)
             return
 
-        next_map = self.mappool[next_map_idx]
-
         logger.info(
-            f"Changing the map for {lobby_details.player} to {next_map.beatmap_id}."
+            "Changing the map for %s to %s.",
+            lobby_details.player,
+            command_plan.beatmap_ids[next_map_idx],
         )
-        map_cmd, mod_cmd = next_map.to_multiplayer_cmd()
+        map_cmd, mod_cmd = command_plan.map_lines[next_map_idx]
         self.send(lobby_details.lobby_channel, map_cmd)
         self.send(lobby_details.lobby_channel, mod_cmd)
         self.active_lobbies[lobby_details.player].next_map_idx += 1
         self.run_default_timer(lobby_details.lobby_channel, lobby_details.player)
 
     def run_default_timer(self, lobby_channel: str, player: str):
-        self.send(lobby_channel, f"!mp timer {self.BEFORE_READY_WAIT_SECONDS}")
-        self.active_lobbies[player].lobby_state = LobbyState.LOBBY_WAITING
+        lobby_details = self.active_lobbies[player]
+        self.send(lobby_channel, self.lobby_plan(lobby_details).ready_timer_line)
+        lobby_details.lobby_state = LobbyState.LOBBY_WAITING
+        lobby_details.ready_timer_sent = True
 
     @lobby_decorator
     def resolve_player_leave(self, lobby_details: LobbyDetails):
         if lobby_details.player_leave_count < self.MAX_ALLOWED_LEAVES:
             self.send(
-                lobby_details.lobby_channel, f"!mp timer {self.DISCONNECT_WAIT_TIMEOUT}"
+                lobby_details.lobby_channel,
+                self.lobby_plan(lobby_details).disconnect_timer_line,
             )
             self.active_lobbies[
                 lobby_details.player
@@ -290,9 +878,10 @@ class TryoutsBot(irc.bot.SingleServerIRCBot):
         else:
             author = lobby_details.player
             self.send(
-                lobby_details.player, self.settings["lobbyAbandonMessage"].format(
+                lobby_details.player,
+                self.lobby_plan(lobby_details).abandon_message(
                     lobby_url=lobby_details.lobby_url
-                )
+                ),
             )
             self.close_match(author=author)
 
@@ -302,104 +891,184 @@ class TryoutsBot(irc.bot.SingleServerIRCBot):
         player = lobby_details.player
         lobby_state = lobby_details.lobby_state
         if lobby_state == LobbyState.LOBBY_INITIALIZED:
-            for greeting in self.settings["greetings"]:
-                self.send(channel, greeting)
+            for greeting in self.lobby_plan(lobby_details).greetings:
+                self.send(channel, greeting, priority=Priority.LOW)
             self.active_lobbies[player].lobby_state = LobbyState.LOBBY_WAITING
         elif lobby_state == LobbyState.LOBBY_DISCONNECTED:
-            disconnects_left = (
-                self.MAX_ALLOWED_LEAVES - lobby_details.player_leave_count
-            ) + 1
             self.active_lobbies[player].lobby_state = LobbyState.LOBBY_WAITING
             self.send(
                 channel,
-                self.settings["lobbyLeaveDetected"].format(
-                    disconnects_left=disconnects_left,
-                    player_leave_count=lobby_details.player_leave_count,
-                    max_allowed_leaves=self.MAX_ALLOWED_LEAVES,
-                ),
+                self.lobby_plan(lobby_details).leave_detected[
+                    lobby_details.player_leave_count
+                ],
             )
             self.run_default_timer(lobby_channel=channel, player=player)
 
     def update_played_lobbies(self):
-        players_sheet = PlayersSheet()
-        players = players_sheet.get_players()
-        lobby_sheet = TryoutLobbiesSheet()
-        self.played_lobbies = lobby_sheet.get_played_lobbies(players)
+        for sheets_mirror in self.sheets_mirrors:
+            self.sheets_worker.submit(
+                f"import {sheets_mirror.tournament!r} sheets into store",
+                self.import_sheets,
+                sheets_mirror,
+            )
+
+    def import_sheets(self, sheets_mirror: SheetsMirror):
+        """Runs on the sheets worker, the next !play rebuilds the player index."""
+        sheets_mirror.import_sheets()
+        self.player_index_stale = True
+
+    def current_time(self) -> datetime.datetime:
+        return datetime.datetime.now(tz=datetime.timezone.utc)
 
     def make_lobby(self, author: str):
-        self.update_played_lobbies()
+        if self.player_index_stale:
+            self.rebuild_player_index()
+        tournament = self.tournament_index.tournament_for(author)
+        # Players in no tournament still get the default tournament's messages.
+        window = tournament or self.default_tournament
+        settings = window.settings
+        played_lobby_urls = self.player_index.played_lobby_urls(author, window.key)
         # Check tournament times
-        time_now = datetime.datetime.now(tz=datetime.timezone.utc)
-        if time_now < self.tournament_start:
+        time_now = self.current_time()
+        if time_now < window.tournament_start:
             time_in_turkey = time_now + datetime.timedelta(hours=3)
-            tournament_start_str = self.tournament_start.strftime("%Y-%m-%d %H:%M")
+            tournament_start_str = window.tournament_start.strftime("%Y-%m-%d %H:%M")
             self.send(
                 author,
-                self.settings["tournamentNotStartedYet"].format(
+                settings["tournamentNotStartedYet"].format(
                     tournament_start_str=tournament_start_str,
                     time_in_turkey=time_in_turkey.strftime("%Y-%m-%d %H:%M"),
                 ),
             )
             return
-        elif time_now > self.tournament_end:
-            tournament_end_str = self.tournament_end.strftime("%Y-%m-%d %H:%M")
+        elif time_now > window.tournament_end:
+            tournament_end_str = window.tournament_end.strftime("%Y-%m-%d %H:%M")
             self.send(
                 author,
-                self.settings["tournamentEnded"].format(
+                settings["tournamentEnded"].format(
                     tournament_end_str=tournament_end_str
                 ),
             )
-            if (
-                author in self.played_lobbies
-                or author.replace("_", " ") in self.played_lobbies
-            ):
-                lobby_urls = [lobby.lobby_url for lobby in self.played_lobbies[author]]
-                lobby_urls_str = " - ".join(lobby_urls)
+            if played_lobby_urls:
+                lobby_urls_str = " - ".join(played_lobby_urls)
                 self.send(
                     author,
-                    self.settings["playerPlayedLobbies"].format(
+                    settings["playerPlayedLobbies"].format(
                         lobby_urls_str=lobby_urls_str
                     ),
                 )
             return
         # Check if player signed-up for the tournament
-        if (
-            len(self.allowed_players) > 0
-            and (author not in self.allowed_players)
-            and (author.replace("_", " ") not in self.allowed_players)
-        ):
-            self.send(author, self.settings["allowedPlayers"])
+        if tournament is None:
+            self.send(author, settings["allowedPlayers"])
             return
         if author in self.active_lobbies:
-            self.send(author, self.settings["playerAlreadyInLobby"])
+            self.send(author, settings["playerAlreadyInLobby"])
             self.invite_lobby(author=author)
-        elif (
-            author in self.played_lobbies
-            and len(self.played_lobbies[author]) >= self.MAX_ALLOWED_PLAYS
-        ):
-            lobby_urls = [lobby.lobby_url for lobby in self.played_lobbies[author]]
-            lobby_urls_str = " - ".join(lobby_urls)
+        elif len(played_lobby_urls) >= self.MAX_ALLOWED_PLAYS:
+            lobby_urls_str = " - ".join(played_lobby_urls)
             self.send(
                 author,
-                self.settings["playerPlayedLobbies"].format(
+                settings["playerPlayedLobbies"].format(
                     lobby_urls_str=lobby_urls_str
                 ),
             )
+        elif author in self.lobby_queue:
+            self.send_queue_position(author)
+        elif self.lobby_queue.waiting:
+            self.queue_lobby_request(author)
         else:
-            self.last_lobby_requester = author
-            self.send("BanchoBot", f"!mp make {self.tournament_name} - {author}")
+            self.request_lobby(author)
+
+    def request_lobby(self, player: str):
+        self.lobby_queue.request_sent(player)
+        tournament_name = self.player_tournament(player).tournament_name
+        self.send(
+            "BanchoBot",
+            f"!mp make {tournament_name} - {player}",
+            priority=Priority.CRITICAL,
+        )
 
-    def parse_and_start_lobby(self, message: str):
-        match_id = message.split("/")[-1].split(" ")[0]
-        player = message.split(" ")[-1]
+    def queue_lobby_request(self, player: str):
+        queue_position = self.lobby_queue.enqueue(player)
+        if queue_position is None:
+            self.send(player, self.player_tournament(player).settings["lobbyFull"])
+            return
+        logger.info(f"Queued lobby request of {player} at {queue_position}.")
+        self.send_queue_position(player)
+
+    def send_queue_position(self, player: str):
+        queue_position = self.lobby_queue.position(player)
+        if queue_position is None:
+            # Our !mp make is still waiting for an answer from BanchoBot.
+            return
+        self.send(
+            player,
+            self.player_tournament(player).settings["lobbyQueued"].format(
+                queue_position=queue_position
+            ),
+        )
+
+    def queue_refused_lobby_request(self):
+        player = self.lobby_queue.refused()
+        if player is not None:
+            self.queue_lobby_request(player)
+
+    def admit_next_lobby_request(self):
+        player = self.lobby_queue.pop_next()
+        if player is None:
+            return
+        logger.info(f"Admitting queued lobby request of {player}.")
+        self.request_lobby(player)
+        for waiting_player in self.lobby_queue.waiting:
+            self.send_queue_position(waiting_player)
+
+    def unsent_lobby_requests(self) -> int:
+        """How many `!mp make` lines still wait in the outbox."""
+        return sum(
+            1
+            for message in self.outbox.queued("BanchoBot")
+            if message.startswith("!mp make ")
+        )
+
+    def retry_lobby_queue(self):
+        """Retry unanswered lobby requests, and the queue head in case no lobby
+        closes to free a slot for it."""
+        if self.registered:
+            for player in self.lobby_queue.expired(
+                self.LOBBY_REQUEST_TIMEOUT_SECONDS, self.unsent_lobby_requests()
+            ):
+                logger.warning(f"No answer to the lobby request of {player}, retrying.")
+                self.request_lobby(player)
+        if self.lobby_queue.waiting and not self.lobby_queue.in_flight:
+            self.admit_next_lobby_request()
+
+    def start_created_lobby(self, match_id: str, player: str):
+        if player in self.active_lobbies:
+            # A retried request was answered twice, keep the lobby we have.
+            logger.warning(f"Closing match {match_id}, {player} already has a lobby.")
+            self.send(f"#mp_{match_id}", "!mp close")
+            self.admit_next_lobby_request()
+            return
+        self.lobby_queue.created(player)
+        tournament = self.player_tournament(player)
         lobby_url = f"https://osu.ppy.sh/community/matches/{match_id}"
         self.active_lobbies[player] = LobbyDetails(
-            lobby_channel=f"#mp_{match_id}", lobby_url=lobby_url, player=player
+            lobby_channel=f"#mp_{match_id}",
+            lobby_url=lobby_url,
+            player=player,
+            config_version=tournament.config_version.version,
+            tournament=tournament.key,
         )
-        logger.info(f"Started an active lobby: {self.active_lobbies.get(player)}")
+        logger.info("Started an active lobby: %s", self.active_lobbies.get(player))
 
-        lobby_sheet = TryoutLobbiesSheet()
-        lobby_sheet.append_lobby(lobby_url=lobby_url)
+        self.store.add_lobby(
+            match_id=match_id,
+            lobby_url=lobby_url,
+            player=player,
+            tournament=tournament.key,
+        )
+        self.player_index.add_lobby(player, lobby_url, tournament.key)
         self.request_player_info(player=player)
 
         self.setup_lobby(player)
@@ -407,9 +1076,13 @@ class TryoutsBot(irc.bot.SingleServerIRCBot):
     def request_player_info(self, player: str):
         self.send("BanchoBot", f"!stats {player}")
 
-    def send(self, target: str, message: str):
-        logger.info(f"Sending {message} to {target}")
-        self.connection.privmsg(target, message)
+    def send(self, target: str, message: str, priority: Priority = None):
+        start = time.perf_counter()
+        logger.info("Queueing %s to %s", message, target)
+        if self.trace is not None:
+            self.trace.record_send(target, message)
+        self.outbox.push(target, message, priority)
+        self.send_seconds.observe(time.perf_counter() - start)
 
     @lobby_decorator
     def setup_lobby(self, lobby_details: LobbyDetails):
@@ -417,10 +1090,10 @@ class TryoutsBot(irc.bot.SingleServerIRCBot):
         current_map_idx = lobby_details.next_map_idx
         player = lobby_details.player
 
-        current_map = self.mappool[current_map_idx]
-        map_cmd, mod_cmd = current_map.to_multiplayer_cmd()
+        command_plan = self.lobby_plan(lobby_details)
+        map_cmd, mod_cmd = command_plan.map_lines[current_map_idx]
 
-        self.send(lobby_channel, "!mp set 0 3 1")
+        self.send(lobby_channel, command_plan.setup_line)
         self.send(lobby_channel, f"!mp invite {player}")
         self.send(lobby_channel, map_cmd)
         self.send(lobby_channel, mod_cmd)
@@ -428,7 +1101,7 @@ class TryoutsBot(irc.bot.SingleServerIRCBot):
         self.active_lobbies[player].next_map_idx += 1
         self.active_lobbies[player].lobby_state = LobbyState.LOBBY_INITIALIZED
 
-        logger.info(f"Lobby details after setup: {self.active_lobbies.get(player)}")
+        logger.info("Lobby details after setup: %s", self.active_lobbies.get(player))
 
     @lobby_decorator
     def close_match(self, lobby_details):
@@ -436,13 +1109,31 @@ class TryoutsBot(irc.bot.SingleServerIRCBot):
         lobby_channel = lobby_details.lobby_channel
         player = lobby_details.player
         self.send(lobby_channel, "!mp close")
+        self.store.add_lobby_event(
+            lobby_details.match_id, "close_match", lobby_details.lobby_state
+        )
         self.active_lobbies.pop(player)
+        self.admit_next_lobby_request()
 
     def cleanup(self):
         """Cleanup function that closes all the active lobbies."""
+        self.lobby_queue.clear()
         players = [player for player in self.active_lobbies.keys()]
         for player in players:
             self.close_match(player)
+        self.shutdown()
+
+    def shutdown(self):
+        """Flush pending work without closing lobbies, so a restart can resume them."""
+        self.outbox.flush()
+        self.journal.close()
+        if self.trace is not None:
+            self.trace.close()
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+        self.submit_sheets_sync()
+        self.sheets_worker.stop()
+        self.store.close()
 
     def _dispatcher(
         self, connection: irc.client.ServerConnection, event: irc.client.Event
@@ -450,11 +1141,19 @@ class TryoutsBot(irc.bot.SingleServerIRCBot):
         """
         Dispatch events to on_<event.type> method, if present.
         """
-        if not event.type in self.ignored_events:
-            logger.debug(f"{event}")
+        if logger.isEnabledFor(logging.DEBUG) and event.type not in self.ignored_events:
+            logger.debug("%s", event)
+        if self.trace is not None and event.type != "all_raw_messages":
+            self.trace.record_event(event)
 
-        def do_nothing(*args):
-            return None
-
-        method = getattr(self, "on_" + event.type, do_nothing)
-        method(connection, event)
+        try:
+            method = self.event_methods[event.type]
+        except KeyError:
+            method = getattr(self, "on_" + event.type, None)
+            self.event_methods[event.type] = method
+        if method is not None:
+            start = time.perf_counter()
+            method(connection, event)
+            self.dispatch_seconds.labels(event.type).observe(
+                time.perf_counter() - start
+            )
@@ -0,0 +1,120 @@
+"""Record the IRC traffic of a TryoutsBot run.
+
+A trace is a JSONL file. The first line is a header with the bot nickname,
+admins and every tournament's key, mappool, settings, window and players,
+then every inbound `irc.client.Event` and every outbound `send()` follows as
+one line, timestamped in seconds since the trace started:
+
+    {"t": 12.3051, "e": ["pubmsg", "BanchoBot!cho@ppy.sh", "#mp_1", ["..."]]}
+    {"t": 12.3054, "s": ["#mp_1", "!mp start 5"]}
+
+See `replay.py` to feed a trace back into the bot.
+"""
+import json
+import logging
+import time
+from types import MappingProxyType
+from typing import Any, Iterator, List, Tuple
+
+import irc.client
+
+from tournaments import Tournament
+
+logger = logging.getLogger("tryouts-bot")
+
+TRACE_VERSION = 1
+
+
+def _thaw(value: Any) -> Any:
+    """Plain JSON values from frozen `ConfigVersion` settings."""
+    if isinstance(value, (dict, MappingProxyType)):
+        return {key: _thaw(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_thaw(item) for item in value]
+    return value
+
+
+class TraceWriter:
+    """Appends events and sends to a trace file, buffered, never fsynced."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._started_at = time.monotonic()
+        self._file = open(path, "w", encoding="utf-8", buffering=1 << 16)
+
+    def write_header(self, nickname: str, admins: List[str], tournaments: List[Tournament]):
+        """Write what the replay needs to build the same bot, and start the clock."""
+        self._started_at = time.monotonic()
+        self._write(
+            {
+                "trace": TRACE_VERSION,
+                "wall_time": time.time(),
+                "nickname": nickname,
+                "admins": admins,
+                "tournaments": [
+                    {
+                        "key": tournament.key,
+                        "mappool": [
+                            [beatmap.beatmap_id, beatmap.mod, beatmap.length_seconds]
+                            for beatmap in tournament.mappool
+                        ],
+                        "settings": _thaw(tournament.settings),
+                        "allowed_players": tournament.allowed_players,
+                        "tournament_start": tournament.tournament_start.isoformat(),
+                        "tournament_end": tournament.tournament_end.isoformat(),
+                    }
+                    for tournament in tournaments
+                ],
+            }
+        )
+
+    def record_event(self, event: irc.client.Event):
+        source = str(event.source) if event.source is not None else None
+        self._write(
+            {
+                "t": round(time.monotonic() - self._started_at, 4),
+                "e": [event.type, source, event.target, list(event.arguments)],
+            }
+        )
+
+    def record_send(self, target: str, message: str):
+        self._write(
+            {
+                "t": round(time.monotonic() - self._started_at, 4),
+                "s": [target, message],
+            }
+        )
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _write(self, entry: dict):
+        if self._file is not None:
+            self._file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+
+
+def read_trace(path: str) -> Tuple[dict, Iterator[dict]]:
+    """Return the header and an iterator over the remaining trace lines."""
+    f = open(path, encoding="utf-8")
+    header = json.loads(f.readline())
+    if header.get("trace") != TRACE_VERSION:
+        f.close()
+        raise ValueError(f"{path} is not a version {TRACE_VERSION} trace.")
+
+    def entries():
+        with f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # The last line can be cut short if the bot died while writing it.
+                    logger.warning(f"Skipping broken trace line: {line!r}")
+
+    return header, entries()
+
@@ -0,0 +1,88 @@
+import json
+import logging
+import os
+from dataclasses import asdict
+from typing import Dict
+
+from lobbies import LobbyState, LobbyDetails
+
+logger = logging.getLogger("tryouts-bot")
+
+
+class LobbyJournal:
+    """Append-only log of active lobby changes, used to resume after a crash.
+
+    Every line is either the full `LobbyDetails` of a lobby after a change or a
+    removal. Replaying keeps the last line per player. The file is rewritten
+    with only the live lobbies once it grows past `compact_threshold` lines.
+    """
+
+    def __init__(self, path: str, compact_threshold: int = 1000):
+        self.path = path
+        self.compact_threshold = compact_threshold
+        self._lobbies: Dict[str, LobbyDetails] = {}
+        self._line_count = 0
+        self._file = None
+
+    def replay(self) -> Dict[str, LobbyDetails]:
+        """Read the journal back and open it for appending."""
+        self._lobbies = {}
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    self._apply(line)
+        logger.info(f"Replayed {len(self._lobbies)} lobbies from {self.path}.")
+        self.compact()
+        return dict(self._lobbies)
+
+    def record(self, lobby_details: LobbyDetails):
+        self._lobbies[lobby_details.player] = lobby_details
+        entry = asdict(lobby_details)
+        entry["lobby_state"] = lobby_details.lobby_state.name
+        self._write({"op": "set", "lobby": entry})
+
+    def remove(self, player: str):
+        if self._lobbies.pop(player, None) is not None:
+            self._write({"op": "del", "player": player})
+
+    def compact(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for lobby_details in self._lobbies.values():
+                entry = asdict(lobby_details)
+                entry["lobby_state"] = lobby_details.lobby_state.name
+                f.write(json.dumps({"op": "set", "lobby": entry}) + "\n")
+        if self._file is not None:
+            self._file.close()
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._line_count = len(self._lobbies)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _write(self, entry: dict):
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(json.dumps(entry) + "\n")
+        # Flushing is enough to survive the process dying, we don't fsync.
+        self._file.flush()
+        self._line_count += 1
+        if self._line_count > max(self.compact_threshold, 2 * len(self._lobbies)):
+            self.compact()
+
+    def _apply(self, line: str):
+        try:
+            entry = json.loads(line)
+        except json.JSONDecodeError:
+            # The last line can be cut short if we died while writing it.
+            logger.warning(f"Skipping broken journal line: {line!r}")
+            return
+        if entry["op"] == "set":
+            lobby = entry["lobby"]
+            lobby["lobby_state"] = LobbyState[lobby["lobby_state"]]
+            self._lobbies[lobby["player"]] = LobbyDetails(**lobby)
+        elif entry["op"] == "del":
+            self._lobbies.pop(entry["player"], None)
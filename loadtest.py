@@ -0,0 +1,304 @@
+"""End-to-end load test of TryoutsBot against the fake Bancho server.
+
+Starts `FakeBancho` on localhost, runs a bot against it on a background
+thread, and has `--players` simulated players send `!play` every
+`--arrival-interval` seconds. Each player plays the whole mappool. Reports
+lobby throughput, `!play`-to-invite latency percentiles and the messages per
+second the bot sent.
+
+With `--blip-at`, the bot's connection is cut that many seconds into the run
+and refused for `--blip-downtime` seconds, and the time until the bot has
+resynced every active lobby is reported.
+
+    python loadtest.py --players 20 --maps 8 --message-rate 10
+    python loadtest.py --players 20 --asyncio
+    python loadtest.py --players 8 --blip-at 2 --blip-downtime 1
+
+200 concurrent lobbies, reactor against asyncio (add --asyncio):
+
+    python loadtest.py --players 200 --maps 2 --max-matches 200 \\
+        --message-rate 100 --server-rate 100 --server-burst 100 \\
+        --arrival-interval 0.01
+"""
+import argparse
+import asyncio
+import datetime
+import logging
+import math
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from async_bot import AsyncTryoutsBot
+from beatmap import Beatmap
+from fake_bancho import FakeBancho
+from irc_bot import TryoutsBot
+from logs import setup_logging
+
+logger = logging.getLogger("tryouts-bot")
+
+BOT_NICKNAME = "TryoutsBot"
+MODS = ["NM", "HD", "HR", "DT", "FM"]
+
+
+@dataclass
+class LoadTestResult:
+    players: int
+    elapsed_seconds: float
+    lobbies_closed: int
+    messages_sent: int
+    messages_dropped: int
+    invite_latencies: List[float] = field(default_factory=list)
+    lobbies_at_blip: int = 0
+    recovery_seconds: Optional[float] = None
+
+    @property
+    def lobbies_per_minute(self) -> float:
+        return self.lobbies_closed / self.elapsed_seconds * 60
+
+    @property
+    def messages_per_second(self) -> float:
+        return self.messages_sent / self.elapsed_seconds
+
+    def latency_percentiles(self) -> Dict[str, float]:
+        if len(self.invite_latencies) < 2:
+            return {
+                name: (self.invite_latencies or [float("nan")])[0]
+                for name in ("p50", "p95", "p99")
+            }
+        quantiles = statistics.quantiles(self.invite_latencies, n=100)
+        return {"p50": quantiles[49], "p95": quantiles[94], "p99": quantiles[98]}
+
+    def report(self) -> str:
+        percentiles = ", ".join(
+            f"{name} {seconds * 1000:.0f}ms"
+            for name, seconds in self.latency_percentiles().items()
+        )
+        return (
+            f"{self.lobbies_closed}/{self.players} lobbies in {self.elapsed_seconds:.1f}s"
+            f" ({self.lobbies_per_minute:.1f} lobbies/min)\n"
+            f"!play to invite: {percentiles}"
+            f" over {len(self.invite_latencies)} invites\n"
+            f"{self.messages_sent} messages sent ({self.messages_per_second:.2f}/s),"
+            f" {self.messages_dropped} dropped by the rate limit"
+            + self.recovery_report()
+        )
+
+    def recovery_report(self) -> str:
+        if self.recovery_seconds is None:
+            return "" if not self.lobbies_at_blip else "\nNever recovered from the blip"
+        return (
+            f"\n{self.lobbies_at_blip} active lobbies recovered"
+            f" {self.recovery_seconds:.2f}s after the blip"
+        )
+
+
+class LoadTest:
+    def __init__(
+        self,
+        server: FakeBancho,
+        bot_class: type,
+        players: int,
+        maps: int,
+        message_rate: float,
+        arrival_interval: float,
+        port: int,
+        trace_path: str = None,
+        metrics_port: int = None,
+        blip_at: float = None,
+        blip_downtime: float = 0.0,
+        reconnect_interval: int = 1,
+    ):
+        self.server = server
+        self.bot_class = bot_class
+        self.players = [f"player_{idx}" for idx in range(players)]
+        # Real lengths, so lobby deadlines catch the finishes lost to a blip.
+        map_seconds = math.ceil(server.map_seconds * server.time_scale)
+        self.mappool = [
+            Beatmap(str(1000 + idx), MODS[idx % len(MODS)], map_seconds)
+            for idx in range(maps)
+        ]
+        self.message_rate = message_rate
+        self.arrival_interval = arrival_interval
+        self.port = port
+        self.trace_path = trace_path
+        self.metrics_port = metrics_port
+        self.blip_at = blip_at
+        self.blip_downtime = blip_downtime
+        self.reconnect_interval = reconnect_interval
+        self.lobbies_at_blip = 0
+        self.recovery_seconds = None
+
+        self.play_times: Dict[str, float] = {}
+        self.invite_latencies: List[float] = []
+        self.messages_sent = 0
+        self.lobbies_closed = 0
+        self.done = asyncio.Event()
+        self.bot = None
+        self.server.listeners.append(self.on_bot_message)
+
+    def on_bot_message(self, nickname: str, target: str, message: str):
+        if nickname != BOT_NICKNAME:
+            return
+        self.messages_sent += 1
+        if message.startswith("!mp invite "):
+            played_at = self.play_times.pop(message[len("!mp invite "):], None)
+            if played_at is not None:
+                self.invite_latencies.append(time.monotonic() - played_at)
+        elif message == "!mp close":
+            self.lobbies_closed += 1
+            if self.lobbies_closed == len(self.players):
+                self.done.set()
+
+    def run_bot(self, directory: str):
+        bot_class = type(
+            f"LoadTest{self.bot_class.__name__}",
+            (self.bot_class,),
+            {
+                "MESSAGES_PER_SECOND": self.message_rate,
+                "RECONNECT_MIN_INTERVAL": self.reconnect_interval,
+                "RECONNECT_MAX_INTERVAL": self.reconnect_interval,
+                "LOBBY_DEADLINE_GRACE_SECONDS": 1,
+            },
+        )
+        self.bot = bot = bot_class(
+            nickname=BOT_NICKNAME,
+            password="",
+            mappool=self.mappool,
+            server="127.0.0.1",
+            port=self.port,
+            journal_path=os.path.join(directory, "lobbies.journal"),
+            store_path=os.path.join(directory, "tryouts.sqlite3"),
+            mirror_to_sheets=False,
+            trace_path=self.trace_path,
+            metrics_port=self.metrics_port,
+        )
+        now = datetime.datetime.now(tz=datetime.timezone.utc)
+        for tournament in bot.tournaments:
+            tournament.tournament_start = now - datetime.timedelta(days=1)
+            tournament.tournament_end = now + datetime.timedelta(days=1)
+        try:
+            bot.start()
+        except SystemExit:
+            bot.shutdown()
+
+    async def blip(self):
+        """Cut the bot off and wait until it resynced its lobbies."""
+        await asyncio.sleep(self.blip_at)
+        self.lobbies_at_blip = len(self.bot.active_lobbies)
+        blipped_at = time.monotonic()
+        logger.warning(f"Cutting the bot off with {self.lobbies_at_blip} active lobbies.")
+        self.server.drop_client(BOT_NICKNAME, self.blip_downtime)
+        # Polls the bot thread's state, good enough for a harness.
+        while not (
+            self.bot.registered
+            and not self.bot.lobby_resyncs
+            and self.bot.recovery_started_at >= blipped_at
+        ):
+            await asyncio.sleep(0.01)
+        self.recovery_seconds = time.monotonic() - blipped_at
+
+    def stop_bot(self):
+        # Raised out of the bot's reactor loop, on the bot thread.
+        self.bot.reactor.scheduler.execute_after(0, sys.exit)
+
+    async def run(self, timeout: float) -> LoadTestResult:
+        with tempfile.TemporaryDirectory() as directory:
+            bot_thread = threading.Thread(
+                target=self.run_bot, args=(directory,), name="bot", daemon=True
+            )
+            bot_thread.start()
+            while BOT_NICKNAME not in self.server.clients:
+                await asyncio.sleep(0.05)
+            # Let the bot finish registering before players talk to it.
+            await asyncio.sleep(0.5)
+
+            start = time.monotonic()
+            blip = None
+            if self.blip_at is not None:
+                blip = asyncio.create_task(self.blip())
+            for player in self.players:
+                self.play_times[player] = time.monotonic()
+                self.server.player_says(player, BOT_NICKNAME, "!play")
+                await asyncio.sleep(self.arrival_interval)
+            try:
+                await asyncio.wait_for(self.done.wait(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Load test timed out after {timeout}s.")
+            elapsed_seconds = time.monotonic() - start
+            if blip is not None:
+                blip.cancel()
+
+            self.stop_bot()
+            await asyncio.to_thread(bot_thread.join, 30)
+            return LoadTestResult(
+                players=len(self.players),
+                elapsed_seconds=elapsed_seconds,
+                lobbies_closed=self.lobbies_closed,
+                messages_sent=self.messages_sent,
+                messages_dropped=self.server.messages_dropped,
+                invite_latencies=self.invite_latencies,
+                lobbies_at_blip=self.lobbies_at_blip,
+                recovery_seconds=self.recovery_seconds,
+            )
+
+
+async def main(args: argparse.Namespace):
+    server = FakeBancho(
+        max_matches=args.max_matches,
+        rate=args.server_rate,
+        burst=args.server_burst,
+        time_scale=args.time_scale,
+        leave_probability=args.leave_probability,
+    )
+    await server.start(port=args.port)
+    load_test = LoadTest(
+        server,
+        AsyncTryoutsBot if args.asyncio else TryoutsBot,
+        players=args.players,
+        maps=args.maps,
+        message_rate=args.message_rate,
+        arrival_interval=args.arrival_interval,
+        port=args.port,
+        trace_path=args.trace,
+        metrics_port=args.metrics_port,
+        blip_at=args.blip_at,
+        blip_downtime=args.blip_downtime,
+        reconnect_interval=args.reconnect_interval,
+    )
+    result = await load_test.run(args.timeout)
+    await server.stop()
+    print(result.report())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--players", type=int, default=10)
+    parser.add_argument("--maps", type=int, default=6)
+    parser.add_argument("--asyncio", action="store_true")
+    parser.add_argument("--message-rate", type=float, default=10.0)
+    parser.add_argument("--arrival-interval", type=float, default=0.05)
+    parser.add_argument("--max-matches", type=int, default=4)
+    parser.add_argument("--server-rate", type=float, default=10.0)
+    parser.add_argument("--server-burst", type=int, default=10)
+    parser.add_argument("--time-scale", type=float, default=0.01)
+    parser.add_argument("--leave-probability", type=float, default=0.0)
+    parser.add_argument("--port", type=int, default=16667)
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--trace", help="Record the bot's IRC traffic to this file.")
+    parser.add_argument("--metrics-port", type=int, help="Serve the bot's metrics.")
+    parser.add_argument(
+        "--blip-at", type=float, help="Cut the bot's connection after this many seconds."
+    )
+    parser.add_argument("--blip-downtime", type=float, default=0.0)
+    parser.add_argument("--reconnect-interval", type=int, default=1)
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    setup_logging(args.log_level)
+    asyncio.run(main(args))
@@ -1,5 +1,6 @@
 from dataclasses import dataclass
 from enum import Enum
+from typing import Dict, Iterator, Optional, ItemsView, KeysView, ValuesView
 
 
 class LobbyState(Enum):
@@ -11,7 +12,7 @@ class LobbyState(Enum):
     LOBBY_ENDING = 5
 
 
-@dataclass
+@dataclass(slots=True)
 class LobbyDetails:
     """Class for keeping track of the played lobby."""
     lobby_channel: str
@@ -21,3 +22,82 @@ class LobbyDetails:
     lobby_state: LobbyState = LobbyState.LOBBY_STARTED
     player_leave_count: int = 0
     player_abort_count: int = 0
+    # Whether LOBBY_WAITING is counting down an `!mp timer` we sent.
+    ready_timer_sent: bool = False
+    config_version: str = ""
+    tournament: str = ""
+
+    @property
+    def match_id(self) -> str:
+        return self.lobby_channel.split("_", 1)[-1]
+
+
+class LobbyRegistry:
+    """Active lobbies indexed by player, channel and match id.
+
+    Behaves like the `Dict[str, LobbyDetails]` keyed by player that it replaces,
+    while keeping the channel and match id indexes in sync on every insert/pop.
+    """
+    __slots__ = ("_by_player", "_by_channel", "_by_match_id")
+
+    def __init__(self):
+        self._by_player: Dict[str, LobbyDetails] = {}
+        self._by_channel: Dict[str, LobbyDetails] = {}
+        self._by_match_id: Dict[str, LobbyDetails] = {}
+
+    def __setitem__(self, player: str, lobby_details: LobbyDetails):
+        if player in self._by_player:
+            self._unindex(self._by_player[player])
+        self._by_player[player] = lobby_details
+        self._by_channel[lobby_details.lobby_channel] = lobby_details
+        self._by_match_id[lobby_details.match_id] = lobby_details
+
+    def __getitem__(self, player: str) -> LobbyDetails:
+        return self._by_player[player]
+
+    def __contains__(self, player: str) -> bool:
+        return player in self._by_player
+
+    def __len__(self) -> int:
+        return len(self._by_player)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._by_player)
+
+    def __repr__(self):
+        return f"LobbyRegistry({self._by_player})"
+
+    def get(self, player: str, default: Optional[LobbyDetails] = None):
+        return self._by_player.get(player, default)
+
+    def get_by_channel(self, lobby_channel: str) -> Optional[LobbyDetails]:
+        return self._by_channel.get(lobby_channel)
+
+    def get_by_match_id(self, match_id: str) -> Optional[LobbyDetails]:
+        return self._by_match_id.get(match_id)
+
+    def pop(self, player: str, *default) -> LobbyDetails:
+        if player not in self._by_player and default:
+            return default[0]
+        lobby_details = self._by_player.pop(player)
+        self._unindex(lobby_details)
+        return lobby_details
+
+    def pop_by_channel(self, lobby_channel: str) -> Optional[LobbyDetails]:
+        lobby_details = self._by_channel.get(lobby_channel)
+        if lobby_details is not None:
+            self.pop(lobby_details.player)
+        return lobby_details
+
+    def keys(self) -> KeysView[str]:
+        return self._by_player.keys()
+
+    def values(self) -> ValuesView[LobbyDetails]:
+        return self._by_player.values()
+
+    def items(self) -> ItemsView[str, LobbyDetails]:
+        return self._by_player.items()
+
+    def _unindex(self, lobby_details: LobbyDetails):
+        self._by_channel.pop(lobby_details.lobby_channel, None)
+        self._by_match_id.pop(lobby_details.match_id, None)
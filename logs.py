@@ -0,0 +1,73 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import os
+import sys
+from typing import Optional
+
+LOG_QUEUE_SIZE = 10000
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_listener_pid: Optional[int] = None
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records instead of blocking when the queue is full."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(level: str) -> logging.handlers.QueueListener:
+    """Log to stdout from a listener thread so the reactor never waits on writes.
+
+    Records are put on a bounded queue by a `QueueHandler` and formatted and
+    written by the listener. Records that do not fit are dropped. The listener
+    is stopped (and drained) at exit, or by `stop_logging`.
+
+    Threads do not survive a fork, so forked processes call this again to
+    start their own listener in place of the inherited one.
+    """
+    global _listener, _listener_pid
+    stop_logging()
+    logger = logging.getLogger("tryouts-bot")
+    logger.setLevel(level)
+    for handler in list(logger.handlers):
+        if isinstance(handler, logging.handlers.QueueHandler):
+            logger.removeHandler(handler)
+
+    ch = logging.StreamHandler(sys.stdout)
+    formatter = logging.Formatter(
+        "%(asctime)s | %(levelname)s | %(process)d | %(name)s | %(funcName)s | %(message)s",
+        datefmt="%d/%m/%Y %I:%M:%S",
+    )
+    ch.setFormatter(formatter)
+
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    logger.addHandler(DroppingQueueHandler(log_queue))
+
+    listener = logging.handlers.QueueListener(
+        log_queue, ch, respect_handler_level=True
+    )
+    listener.start()
+    _listener, _listener_pid = listener, os.getpid()
+    return listener
+
+
+def stop_logging():
+    """Write out the queued records and stop the listener of this process."""
+    global _listener
+    if _listener is not None and _listener_pid == os.getpid():
+        _listener.stop()
+    _listener = None
+
+
+atexit.register(stop_logging)
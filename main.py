@@ -1,41 +1,70 @@
 import logging
 import sys
 
+from async_bot import AsyncTryoutsBot
+from config_watcher import ConfigWatcher
+from coordinator import CoordinatorBot
 from irc_bot import TryoutsBot
+from logs import setup_logging
 from settings import Settings
 from sheets import MappoolSpreadsheet, PlayersSheet
+from tournaments import Tournament, load_tournaments
 
 config = Settings()
 
 logger = logging.getLogger("tryouts-bot")
-logger.setLevel(config.log_level)
-
-ch = logging.StreamHandler(sys.stdout)
-formatter = logging.Formatter(
-    "%(asctime)s | %(levelname)s | %(process)d | %(name)s | %(funcName)s | %(message)s",
-    datefmt="%d/%m/%Y %I:%M:%S",
-)
-ch.setFormatter(formatter)
-
-logger.addHandler(ch)
+setup_logging(config.log_level)
 
 if __name__ == "__main__":
-    mappool_sheet = MappoolSpreadsheet()
-    mappool = mappool_sheet.get_mappool()
-    allowed_players = []
+    def select_mappool(mappool):
+        if config.environment == "testing":
+            mappool = [mappool[1], mappool[5], mappool[7], mappool[-1]]
+        return mappool
 
-    if config.environment == "testing":
-        mappool = [mappool[1], mappool[5], mappool[7], mappool[-1]]
+    allowed_players = []
+    if config.tournaments_path:
+        tournaments = load_tournaments(config.tournaments_path, select_mappool)
+    else:
+        config_watcher = ConfigWatcher(
+            lambda: select_mappool(MappoolSpreadsheet().get_mappool()),
+            mappool_revision=lambda: MappoolSpreadsheet().get_modified_time(),
+        )
+        tournaments = [Tournament("", config_watcher, allowed_players)]
+    mappool = list(tournaments[0].mappool)
 
-    bot = TryoutsBot(
-        nickname=config.irc_nickname,
-        password=config.irc_password,
-        mappool=mappool,
-        allowed_players=allowed_players,
-    )
+    if config.worker_irc_nicknames:
+        bot = CoordinatorBot(
+            nickname=config.irc_nickname,
+            password=config.irc_password,
+            workers=list(
+                zip(config.worker_irc_nicknames, config.worker_irc_passwords)
+            ),
+            mappool=mappool,
+            allowed_players=allowed_players,
+            admins=config.admins,
+            server=config.irc_server,
+            port=config.irc_port,
+        )
+    else:
+        bot_class = AsyncTryoutsBot if config.irc_asyncio else TryoutsBot
+        bot = bot_class(
+            nickname=config.irc_nickname,
+            password=config.irc_password,
+            mappool=mappool,
+            allowed_players=allowed_players,
+            admins=config.admins,
+            server=config.irc_server,
+            port=config.irc_port,
+            trace_path=config.irc_trace_path,
+            metrics_port=config.metrics_port,
+            tournaments=tournaments,
+        )
     try:
         bot.start()
+    except KeyboardInterrupt:
+        bot.cleanup()
     except BaseException as e:
+        # Keep the lobbies open, they are resumed from the journal on restart.
         logger.exception(e)
-        bot.cleanup()
+        bot.shutdown()
         sys.exit(1)
@@ -0,0 +1,194 @@
+"""Latency histograms and gauges served in the Prometheus text format.
+
+Histograms have fixed buckets, so an observation is a `bisect` and two
+additions. Every histogram is only observed from one thread (the reactor or
+the sheets worker), so they are not locked; a scrape may see a count that is
+one observation ahead of the buckets. Gauges are set periodically by their
+owner instead of being computed by the scrape, so the HTTP thread never
+walks structures the reactor is changing.
+"""
+import bisect
+import http.server
+import logging
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger("tryouts-bot")
+
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        # The last count is the +Inf bucket.
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _Family:
+    """A metric with one child per label value."""
+
+    kind = ""
+
+    def __init__(self, name: str, description: str, label: Optional[str]):
+        self.name = name
+        self.description = description
+        self.label = label
+        self._children: Dict[Optional[str], object] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, value: Optional[str] = None):
+        child = self._children.get(value)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(value, self._make_child())
+        return child
+
+    def children(self) -> List[Tuple[Optional[str], object]]:
+        with self._lock:
+            return list(self._children.items())
+
+    def _make_child(self):
+        raise NotImplementedError
+
+    def _labels(self, value: Optional[str], extra: str = "") -> str:
+        pairs = [f'{self.label}="{value}"'] if self.label is not None else []
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class HistogramFamily(_Family):
+    kind = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(*args)
+        self.buckets = buckets
+
+    def _make_child(self) -> Histogram:
+        return Histogram(self.buckets)
+
+    def render(self) -> List[str]:
+        lines = []
+        for value, histogram in self.children():
+            cumulative = 0
+            for bound, count in zip(self.buckets, histogram.counts):
+                cumulative += count
+                labels = self._labels(value, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = self._labels(value, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {histogram.count}")
+            lines.append(f"{self.name}_sum{self._labels(value)} {histogram.sum}")
+            lines.append(f"{self.name}_count{self._labels(value)} {histogram.count}")
+        return lines
+
+
+class Gauge:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = value
+
+
+class GaugeFamily(_Family):
+    kind = "gauge"
+
+    def _make_child(self) -> Gauge:
+        return Gauge()
+
+    def render(self) -> List[str]:
+        return [
+            f"{self.name}{self._labels(value)} {gauge.value}"
+            for value, gauge in self.children()
+        ]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._families: Dict[str, _Family] = {}
+        self._lock = threading.Lock()
+
+    def histogram(
+        self,
+        name: str,
+        description: str,
+        label: Optional[str] = None,
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> HistogramFamily:
+        return self._register(
+            HistogramFamily(name, description, label, buckets=buckets)
+        )
+
+    def gauge(self, name: str, description: str, label: Optional[str] = None) -> GaugeFamily:
+        return self._register(GaugeFamily(name, description, label))
+
+    def render(self) -> str:
+        with self._lock:
+            families = list(self._families.values())
+        lines = []
+        for family in families:
+            lines.append(f"# HELP {family.name} {family.description}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            lines.extend(family.render())
+        return "\n".join(lines) + "\n"
+
+    def _register(self, family: _Family):
+        with self._lock:
+            existing = self._families.setdefault(family.name, family)
+        if type(existing) is not type(family):
+            raise ValueError(f"{family.name} is already registered as a {existing.kind}.")
+        return existing
+
+
+class MetricsServer:
+    """Serves `registry` on http://host:port/metrics from a daemon thread."""
+
+    def __init__(self, registry: MetricsRegistry, port: int, host: str = "127.0.0.1"):
+        self.registry = registry
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(handler):
+                if handler.path != "/metrics":
+                    handler.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                handler.send_response(200)
+                handler.send_header("Content-Type", "text/plain; version=0.0.4")
+                handler.send_header("Content-Length", str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, format, *args):
+                pass
+
+        self._server = http.server.ThreadingHTTPServer((host, port), Handler)
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="metrics-server", daemon=True
+        )
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def start(self):
+        self._thread.start()
+        logger.info(f"Serving metrics on port {self.port}.")
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,134 @@
+"""Time a full mappool run per lobby inside the bot, without any network.
+
+Feeds the IRC events of `--lobbies` lobbies, each playing every map of a
+`--maps` map mappool, into a `ReplayBot` and reports the handler time per
+lobby and per map.
+
+With `--log-levels`, the same events are run once per level with the bot's
+real logging setup writing to /dev/null, and the time per event through
+`_dispatcher` is compared across levels.
+
+    python microbench.py --lobbies 200 --maps 10
+    python microbench.py --log-levels INFO DEBUG
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+from typing import List, Tuple
+
+import irc.client
+
+from beatmap import Beatmap
+from logs import DroppingQueueHandler, setup_logging, stop_logging
+from replay import ReplayBot
+
+BANCHO = "BanchoBot!cho@ppy.sh"
+MODS = ["NM", "HD", "HR", "DT", "FM"]
+
+
+def lobby_events(
+    nickname: str, match_id: int, player: str, maps: int
+) -> List[irc.client.Event]:
+    """The events of one lobby, from `!play` to the last map finishing."""
+    channel = f"#mp_{match_id}"
+    pubmsg = lambda message: irc.client.Event(
+        "pubmsg", irc.client.NickMask(BANCHO), channel, [message]
+    )
+    created = f"Created the tournament match https://osu.ppy.sh/mp/{match_id} T - {player}"
+    events = [
+        irc.client.Event(
+            "privmsg", irc.client.NickMask(f"{player}!p@ppy.sh"), nickname, ["!play"]
+        ),
+        irc.client.Event("privmsg", irc.client.NickMask(BANCHO), nickname, [created]),
+        pubmsg(f"{player} joined in slot 1."),
+    ]
+    for _ in range(maps):
+        events.append(pubmsg("All players are ready"))
+        events.append(pubmsg("The match has started!"))
+        events.append(pubmsg(f"{player} finished playing (Score: 500000, PASSED)."))
+    return events
+
+
+def run(lobbies: int, maps: int) -> Tuple[float, int]:
+    """Run the lobbies, print the timings and return (seconds, events)."""
+    with tempfile.TemporaryDirectory() as directory:
+        bot = ReplayBot(
+            nickname="TryoutsBot",
+            password="",
+            mappool=[
+                Beatmap(str(1000 + idx), MODS[idx % len(MODS)]) for idx in range(maps)
+            ],
+            journal_path=os.path.join(directory, "lobbies.journal"),
+            store_path=os.path.join(directory, "tryouts.sqlite3"),
+            mirror_to_sheets=False,
+        )
+        tournament = bot.default_tournament
+        tournament.tournament_start = tournament.tournament_start.replace(year=2000)
+        tournament.tournament_end = tournament.tournament_end.replace(year=2100)
+        # Lobbies run one after the other, never hitting the match limit.
+        events = [
+            event
+            for idx in range(lobbies)
+            for event in lobby_events("TryoutsBot", 100000 + idx, f"player_{idx}", maps)
+        ]
+
+        start = time.perf_counter()
+        for event in events:
+            bot.reactor._handle_event(bot.connection, event)
+        elapsed = time.perf_counter() - start
+        bot.shutdown()
+
+    closed = sum(1 for _, message in bot.sent if message == "!mp close")
+    print(
+        f"{closed}/{lobbies} lobbies, {len(events)} events, {len(bot.sent)} sends "
+        f"in {elapsed:.3f}s\n"
+        f"{elapsed / lobbies * 1e6:.0f}us per lobby, "
+        f"{elapsed / (lobbies * maps) * 1e6:.0f}us per map"
+    )
+    return elapsed, len(events)
+
+
+def compare_log_levels(lobbies: int, maps: int, levels: List[str]):
+    logger = logging.getLogger("tryouts-bot")
+    stdout = sys.stdout
+    baseline = None
+    with open(os.devnull, "w") as devnull:
+        for level in levels:
+            sys.stdout = devnull
+            setup_logging(level)
+            try:
+                elapsed, events = run(lobbies, maps)
+            finally:
+                stop_logging()
+                sys.stdout = stdout
+            dropped = sum(
+                handler.dropped
+                for handler in logger.handlers
+                if isinstance(handler, DroppingQueueHandler)
+            )
+            per_event = elapsed / events * 1e6
+            if baseline is None:
+                baseline = per_event
+            print(
+                f"{level}: {per_event:.2f}us per event over {events} events "
+                f"({per_event - baseline:+.2f}us), {dropped} records dropped"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--lobbies", type=int, default=200)
+    parser.add_argument("--maps", type=int, default=10)
+    parser.add_argument(
+        "--log-levels", nargs="+", help="Compare the time per event at these levels."
+    )
+    args = parser.parse_args()
+
+    if args.log_levels:
+        compare_log_levels(args.lobbies, args.maps, args.log_levels)
+    else:
+        logging.basicConfig(level=logging.WARNING)
+        run(args.lobbies, args.maps)
@@ -0,0 +1,172 @@
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("tryouts-bot")
+
+
+class Priority(IntEnum):
+    CRITICAL = 0
+    NORMAL = 1
+    LOW = 2
+
+
+CRITICAL_COMMANDS = ("!mp start", "!mp abort", "!mp close")
+
+
+def classify(message: str) -> Priority:
+    if message.startswith(CRITICAL_COMMANDS):
+        return Priority.CRITICAL
+    return Priority.NORMAL
+
+
+@dataclass
+class OutboxMetrics:
+    sent: int = 0
+    max_queue_depth: int = 0
+    latency_sum: Dict[Priority, float] = field(
+        default_factory=lambda: {priority: 0.0 for priority in Priority}
+    )
+    latency_max: Dict[Priority, float] = field(
+        default_factory=lambda: {priority: 0.0 for priority in Priority}
+    )
+    latency_count: Dict[Priority, int] = field(
+        default_factory=lambda: {priority: 0 for priority in Priority}
+    )
+
+    def average_latency(self, priority: Priority) -> float:
+        count = self.latency_count[priority]
+        return self.latency_sum[priority] / count if count else 0.0
+
+
+class OutboundScheduler:
+    """Paces outgoing messages with a token bucket and shares them fairly.
+
+    Messages keep their order per target. Targets take turns round-robin, and a
+    target with a higher priority message queued is served before the others.
+    Nothing is sent while `can_send` is false, messages wait in the queue.
+    Must only be used from the reactor thread.
+    """
+
+    def __init__(
+        self,
+        send_func: Callable[[str, str], None],
+        rate: float = 1.0,
+        burst: int = 4,
+        can_send: Callable[[], bool] = lambda: True,
+    ):
+        self.send_func = send_func
+        self.can_send = can_send
+        self.rate = rate
+        self.burst = burst
+        self.metrics = OutboxMetrics()
+
+        self._tokens = float(burst)
+        self._last_refill = time.monotonic()
+        self._queues: Dict[str, Deque[Tuple[str, Priority, float]]] = {}
+        self._target_priority: Dict[str, Priority] = {}
+        self._target_generation: Dict[str, int] = {}
+        self._rings: List[Deque[Tuple[str, int]]] = [deque() for _ in Priority]
+        self._queue_depth = 0
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue_depth
+
+    def push(self, target: str, message: str, priority: Priority = None):
+        if priority is None:
+            priority = classify(message)
+        queue = self._queues.setdefault(target, deque())
+        queue.append((message, priority, time.monotonic()))
+        self._queue_depth += 1
+        self.metrics.max_queue_depth = max(
+            self.metrics.max_queue_depth, self._queue_depth
+        )
+
+        current = self._target_priority.get(target)
+        if current is None or priority < current:
+            self._schedule(target, priority)
+
+        self.drain()
+
+    def queued(self, target: str) -> List[str]:
+        """The messages to `target` that were not sent yet, oldest first."""
+        return [message for message, _, _ in self._queues.get(target, ())]
+
+    def seconds_until_token(self) -> float:
+        """How long until the next message can be sent."""
+        self._refill()
+        return max(0.0, (1 - self._tokens) / self.rate)
+
+    def drain(self):
+        """Send as many queued messages as the token bucket allows."""
+        self._refill()
+        if not self.can_send():
+            return
+        while self._tokens >= 1 and self._queue_depth:
+            target = self._next_target()
+            if target is None:
+                break
+            self._send_head(target)
+            self._tokens -= 1
+
+    def flush(self, timeout: Optional[float] = None):
+        """Block until everything queued is sent or `timeout` passes.
+
+        By default waits as long as the queue takes to send at `rate`, plus
+        30 seconds, so a long shutdown queue of `!mp close` lines gets out.
+        """
+        if timeout is None:
+            timeout = self._queue_depth / self.rate + 30
+        deadline = time.monotonic() + timeout
+        while self._queue_depth and self.can_send() and time.monotonic() < deadline:
+            self.drain()
+            time.sleep(1 / self.rate)
+        if self._queue_depth:
+            logger.error(f"Dropping {self._queue_depth} unsent messages.")
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(
+            self.burst, self._tokens + (now - self._last_refill) * self.rate
+        )
+        self._last_refill = now
+
+    def _schedule(self, target: str, priority: Priority):
+        generation = self._target_generation.get(target, 0) + 1
+        self._target_generation[target] = generation
+        self._target_priority[target] = priority
+        self._rings[priority].append((target, generation))
+
+    def _next_target(self):
+        for ring in self._rings:
+            while ring:
+                target, generation = ring.popleft()
+                if self._target_generation.get(target) == generation:
+                    return target
+        return None
+
+    def _send_head(self, target: str):
+        queue = self._queues[target]
+        message, priority, enqueued_at = queue.popleft()
+        self._queue_depth -= 1
+
+        latency = time.monotonic() - enqueued_at
+        self.metrics.sent += 1
+        self.metrics.latency_sum[priority] += latency
+        self.metrics.latency_count[priority] += 1
+        self.metrics.latency_max[priority] = max(
+            self.metrics.latency_max[priority], latency
+        )
+        logger.debug("Sending %s to %s after %.2fs", message, target, latency)
+        self.send_func(target, message)
+
+        if queue:
+            self._schedule(target, min(item[1] for item in queue))
+        else:
+            del self._queues[target]
+            del self._target_priority[target]
+            del self._target_generation[target]
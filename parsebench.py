@@ -0,0 +1,71 @@
+"""Check and time the BanchoBot message parser on a corpus of Bancho lines.
+
+Every line of `--corpus` is parsed once and compared with the event it lists,
+then the whole corpus is parsed `--rounds` times and the messages parsed per
+second are reported. Exits with status 1 if any line parses differently.
+
+    python parsebench.py
+    python parsebench.py --rounds 2000
+"""
+import argparse
+import sys
+import time
+from typing import List, Tuple
+
+from bancho import parse_privmsg, parse_pubmsg
+
+PARSERS = {"privmsg": parse_privmsg, "pubmsg": parse_pubmsg}
+
+
+def read_corpus(path: str) -> List[Tuple[str, str, str]]:
+    """(kind, expected event repr, message) of every line of `path`."""
+    corpus = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if line and not line.startswith("#"):
+                kind, expected, message = line.split("\t", 2)
+                corpus.append((kind, expected, message))
+    return corpus
+
+
+def check(corpus: List[Tuple[str, str, str]]) -> List[str]:
+    """Describe every line that does not parse into its listed event."""
+    mismatches = []
+    for kind, expected, message in corpus:
+        event = PARSERS[kind](message)
+        parsed = "-" if event is None else repr(event)
+        if parsed != expected:
+            mismatches.append(f"{kind} {message!r}: expected {expected}, got {parsed}")
+    return mismatches
+
+
+def bench(corpus: List[Tuple[str, str, str]], rounds: int) -> float:
+    """Messages parsed per second over `rounds` passes of the corpus."""
+    lines = [(PARSERS[kind], message) for kind, _, message in corpus]
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for parse, message in lines:
+            parse(message)
+    return len(lines) * rounds / (time.perf_counter() - start)
+
+
+def main(args: argparse.Namespace) -> int:
+    corpus = read_corpus(args.corpus)
+    mismatches = check(corpus)
+    for mismatch in mismatches:
+        print(mismatch)
+    print(f"{len(corpus) - len(mismatches)}/{len(corpus)} lines parse as expected.")
+
+    for kind in PARSERS:
+        lines = [line for line in corpus if line[0] == kind]
+        print(f"{kind}: {bench(lines, args.rounds):,.0f} messages/s over {len(lines)} lines")
+    print(f"all: {bench(corpus, args.rounds):,.0f} messages/s")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--corpus", default="bancho_lines.txt")
+    parser.add_argument("--rounds", type=int, default=1000)
+    sys.exit(main(parser.parse_args()))
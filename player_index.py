@@ -0,0 +1,81 @@
+from typing import Dict, List
+
+from store import TryoutStore, player_key
+
+
+def id_identity(player_id: str) -> str:
+    return f"id:{player_id}"
+
+
+def name_identity(player: str) -> str:
+    """The identity of `player` while their player id is not known."""
+    return f"name:{player_key(player)}"
+
+
+class PlayerIndex:
+    """Maps every spelling of a player to one identity, and identities to lobbies.
+
+    Names are folded with `player_key`, and the names a player id was seen
+    with, from the Players sheet or `!stats`, all resolve to that id. Players
+    whose id is not known yet are identified by their key. Identities are
+    prefixed with `id:` or `name:`, so a name made of digits never passes
+    for another player's id. Every lookup is a dict access, so eligibility
+    checks do not hit the store.
+
+    Only used from the reactor thread.
+    """
+
+    def __init__(self):
+        # player key: id identity
+        self._ids: Dict[str, str] = {}
+        # identity: tournament: lobby urls, oldest first
+        self._played: Dict[str, Dict[str, List[str]]] = {}
+
+    @classmethod
+    def from_store(cls, store: TryoutStore) -> "PlayerIndex":
+        index = cls()
+        index._ids = {
+            key: id_identity(player_id) for key, player_id in store.player_aliases()
+        }
+        for tournament, key, player_id, lobby_url in store.played_lobby_rows():
+            if player_id:
+                identity = id_identity(player_id)
+            else:
+                identity = index._ids.get(key) or name_identity(key)
+            index._played.setdefault(identity, {}).setdefault(tournament, []).append(
+                lobby_url
+            )
+        return index
+
+    def __len__(self) -> int:
+        return len(self._played)
+
+    def identity(self, player: str) -> str:
+        """The id identity of `player` if known, otherwise its name identity."""
+        return self._ids.get(player_key(player)) or name_identity(player)
+
+    def add_player(self, player_id: str, player: str):
+        """Record that `player` is a name of `player_id`."""
+        key = player_key(player)
+        previous = self._ids.get(key)
+        self._ids[key] = id_identity(player_id)
+        if previous is not None:
+            # Known already, or a name another player id used before a rename.
+            return
+        # Lobbies played before the id was known move to the id.
+        played = self._played.pop(name_identity(key), None)
+        if played:
+            merged = self._played.setdefault(id_identity(player_id), {})
+            for tournament, lobby_urls in played.items():
+                merged.setdefault(tournament, []).extend(lobby_urls)
+
+    def add_lobby(self, player: str, lobby_url: str, tournament: str = ""):
+        self._played.setdefault(self.identity(player), {}).setdefault(
+            tournament, []
+        ).append(lobby_url)
+
+    def played_lobby_urls(self, player: str, tournament: str = "") -> List[str]:
+        played = self._played.get(self.identity(player))
+        if played is None:
+            return []
+        return played.get(tournament, [])
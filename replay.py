@@ -0,0 +1,209 @@
+"""Replay a trace recorded with `irc_trace.TraceWriter` into TryoutsBot.
+
+The events are fed into a bot that does not connect anywhere nor mirror to
+Sheets, the messages it sends are checked against the trace and the
+handlers are timed per event type.
+
+    python replay.py tryouts.trace --realtime
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import irc.client
+
+from bancho import BANCHO_BOT, parse_privmsg, parse_pubmsg
+from beatmap import Beatmap
+from config_watcher import ConfigWatcher
+from irc_bot import TryoutsBot
+from irc_trace import read_trace
+from outbox import Priority
+from score import RunningStats
+from tournaments import Tournament
+
+logger = logging.getLogger("tryouts-bot")
+
+
+def make_event(entry: list) -> irc.client.Event:
+    event_type, source, target, arguments = entry
+    if source is not None:
+        source = irc.client.NickMask(source)
+    return irc.client.Event(event_type, source, target, arguments)
+
+
+def event_key(event: irc.client.Event) -> str:
+    """Event type, refined to the Bancho event or player command for messages."""
+    if event.type not in ("privmsg", "pubmsg") or not event.arguments:
+        return event.type
+    message = event.arguments[0]
+    if event.source.nick == BANCHO_BOT:
+        parse = parse_privmsg if event.type == "privmsg" else parse_pubmsg
+        bancho_event = parse(message)
+        name = type(bancho_event).__name__ if bancho_event is not None else "other"
+        return f"{event.type}:{name}"
+    return f"{event.type}:{message.split(' ', 1)[0]}"
+
+
+def make_tournament(entry: dict, settings_path: str) -> Tournament:
+    """The tournament a trace header entry describes.
+
+    Its settings are written to `settings_path` for its `ConfigWatcher`.
+    """
+    with open(settings_path, "w", encoding="utf-8") as f:
+        json.dump(entry["settings"], f)
+    mappool = [Beatmap(*beatmap) for beatmap in entry["mappool"]]
+    return Tournament(
+        entry["key"],
+        ConfigWatcher(load_mappool=lambda: mappool, settings_path=settings_path),
+        entry["allowed_players"],
+    )
+
+
+class ReplayBot(TryoutsBot):
+    """TryoutsBot that keeps what it sends instead of writing to a socket."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sent: List[Tuple[str, str]] = []
+        self.connection.real_nickname = self._nickname
+        self.connection.send_raw = lambda line: None
+        # Wall clock time of the event being replayed.
+        self.replay_time = datetime.datetime.now(tz=datetime.timezone.utc)
+
+    def current_time(self) -> datetime.datetime:
+        return self.replay_time
+
+    def send(self, target: str, message: str, priority: Priority = None):
+        self.sent.append((target, message))
+
+
+class TraceReplayer:
+    """Replays a trace into a `ReplayBot`, as fast as possible or in real time.
+
+    Work the bot does from its scheduler (queue retries, outbox pacing) does
+    not run, and the store starts empty unless `store_path` points to a copy
+    of the one the trace was recorded with.
+    """
+
+    def __init__(self, path: str, store_path: Optional[str] = None):
+        self.path = path
+        self.store_path = store_path
+        self.expected: List[Tuple[str, str]] = []
+        self.handler_stats: Dict[str, RunningStats] = defaultdict(RunningStats)
+
+    def replay(self, realtime: bool = False, speed: float = 1.0) -> "ReplayResult":
+        header, entries = read_trace(self.path)
+        with tempfile.TemporaryDirectory() as directory:
+            tournaments = [
+                make_tournament(entry, os.path.join(directory, f"settings.{idx}.json"))
+                for idx, entry in enumerate(header["tournaments"])
+            ]
+            bot = ReplayBot(
+                nickname=header["nickname"],
+                password="",
+                mappool=tournaments[0].mappool,
+                allowed_players=tournaments[0].allowed_players,
+                admins=header["admins"],
+                journal_path=os.path.join(directory, "lobbies.journal"),
+                store_path=self.store_path or os.path.join(directory, "tryouts.sqlite3"),
+                mirror_to_sheets=False,
+                tournaments=tournaments,
+            )
+            for tournament, entry in zip(tournaments, header["tournaments"]):
+                # The window can differ from the settings, the bench scripts move it.
+                tournament.tournament_start = datetime.datetime.fromisoformat(
+                    entry["tournament_start"]
+                )
+                tournament.tournament_end = datetime.datetime.fromisoformat(
+                    entry["tournament_end"]
+                )
+            trace_start = datetime.datetime.fromtimestamp(
+                header["wall_time"], tz=datetime.timezone.utc
+            )
+
+            started_at = time.monotonic()
+            for entry in entries:
+                if "s" in entry:
+                    self.expected.append(tuple(entry["s"]))
+                    continue
+                if realtime:
+                    delay = entry["t"] / speed - (time.monotonic() - started_at)
+                    if delay > 0:
+                        time.sleep(delay)
+                event = make_event(entry["e"])
+                bot.replay_time = trace_start + datetime.timedelta(seconds=entry["t"])
+                handle_start = time.perf_counter()
+                bot.reactor._handle_event(bot.connection, event)
+                self.handler_stats[event_key(event)].add(
+                    time.perf_counter() - handle_start
+                )
+            elapsed = time.monotonic() - started_at
+            bot.shutdown()
+        return ReplayResult(self.expected, bot.sent, self.handler_stats, elapsed)
+
+
+class ReplayResult:
+    def __init__(
+        self,
+        expected: List[Tuple[str, str]],
+        sent: List[Tuple[str, str]],
+        handler_stats: Dict[str, RunningStats],
+        elapsed_seconds: float,
+    ):
+        self.expected = expected
+        self.sent = sent
+        self.handler_stats = handler_stats
+        self.elapsed_seconds = elapsed_seconds
+
+    @property
+    def first_mismatch(self) -> Optional[int]:
+        """Index of the first differing send, None if both streams match."""
+        for idx, (expected, sent) in enumerate(zip(self.expected, self.sent)):
+            if expected != sent:
+                return idx
+        if len(self.expected) != len(self.sent):
+            return min(len(self.expected), len(self.sent))
+        return None
+
+    def report(self) -> str:
+        lines = [f"Replayed in {self.elapsed_seconds:.2f}s."]
+        mismatch = self.first_mismatch
+        if mismatch is None:
+            lines.append(f"All {len(self.sent)} sends match the trace.")
+        else:
+            lines.append(
+                f"Sends differ at #{mismatch}: expected "
+                f"{self.expected[mismatch] if mismatch < len(self.expected) else None},"
+                f" sent {self.sent[mismatch] if mismatch < len(self.sent) else None}"
+                f" ({len(self.expected)} expected, {len(self.sent)} sent)."
+            )
+        lines.append(f"{'event':<32} {'count':>7} {'mean us':>9} {'stddev us':>10}")
+        for key, stats in sorted(
+            self.handler_stats.items(),
+            key=lambda item: item[1].mean * item[1].count,
+            reverse=True,
+        ):
+            lines.append(
+                f"{key:<32} {stats.count:>7} {stats.mean * 1e6:>9.1f}"
+                f" {stats.stddev * 1e6:>10.1f}"
+            )
+        return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("trace")
+    parser.add_argument("--realtime", action="store_true")
+    parser.add_argument("--speed", type=float, default=1.0)
+    parser.add_argument("--store", help="Copy of the store the trace started with.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    result = TraceReplayer(args.trace, args.store).replay(args.realtime, args.speed)
+    print(result.report())
@@ -1,6 +1,7 @@
+import bisect
 import math
 from dataclasses import dataclass
-from typing import List, Optional
+from typing import FrozenSet, Iterable, List, Optional
 
 
 @dataclass
@@ -45,38 +46,104 @@ class OsuScore:
         return self.z_score
 
 
-class BeatmapScores:
-    def __init__(self, beatmap_id: str, scores: Optional[List[OsuScore]] = None):
-        self.beatmap_id = beatmap_id
-        self.scores = sorted(scores) if scores else []
-        self.z_scores = self.calc_z()
+class RunningStats:
+    """Welford's online mean and variance."""
 
-    def add_score(self, score: OsuScore, tryout_players: Optional[List] = None):
-        self.scores.append(score)
-        self.scores.sort(reverse=True)
-        self.z_scores = self.calc_z(tryout_players)
+    __slots__ = ("count", "mean", "_m2")
 
-    def calc_z(self, tryout_players: Optional[List] = None) -> List[float]:
-        if tryout_players:
-            scores = [score for score in self.scores if score.player in tryout_players]
-        else:
-            scores = self.scores
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
 
-        if len(scores) < 2:
-            return []
+    def add(self, value: float):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
 
-        mean = sum(scores) / len(scores)
+    @property
+    def stddev(self) -> float:
+        if self.count < 2:
+            return 0.0
+        return math.sqrt(self._m2 / (self.count - 1))
 
-        mean_sq = sum([(score - mean) ** 2 for score in scores])
-        stddev = math.sqrt(mean_sq / (len(scores) - 1))
 
-        z_scores = [score.calc_z(mean, stddev) for score in scores]
-        return z_scores
+class BeatmapScores:
+    """Scores of one map, best first, with running statistics of the counted ones.
+
+    Only scores of `tryout_players` are counted, every score when it is empty.
+    Give it to the constructor; passing it again to `add_score` or `calc_z`
+    is compared by content and only a different set recounts the scores.
+    """
+
+    def __init__(
+        self,
+        beatmap_id: str,
+        scores: Optional[List[OsuScore]] = None,
+        tryout_players: Optional[Iterable[str]] = None,
+    ):
+        self.beatmap_id = beatmap_id
+        self.scores: List[OsuScore] = []
+        self.stats = RunningStats()
+        self._tryout_players: Optional[FrozenSet[str]] = (
+            frozenset(tryout_players) if tryout_players else None
+        )
+        if scores:
+            self.scores = sorted(scores, key=_descending_score)
+            for score in self.scores:
+                if self._is_counted(score):
+                    self.stats.add(score.score)
+
+    def add_score(self, score: OsuScore, tryout_players: Optional[Iterable] = None):
+        """Insert a score keeping `scores` sorted from highest to lowest."""
+        if tryout_players is not None:
+            self._set_tryout_players(tryout_players)
+        bisect.insort(self.scores, score, key=_descending_score)
+        if self._is_counted(score):
+            self.stats.add(score.score)
+
+    @property
+    def z_scores(self) -> List[float]:
+        return self.calc_z()
+
+    def calc_z(self, tryout_players: Optional[Iterable] = None) -> List[float]:
+        """Z-scores of the counted scores, computed from the running statistics."""
+        if tryout_players is not None:
+            self._set_tryout_players(tryout_players)
+
+        if self.stats.count < 2:
+            return []
+
+        mean = self.stats.mean
+        stddev = self.stats.stddev
+        return [
+            score.calc_z(mean, stddev)
+            for score in self.scores
+            if self._is_counted(score)
+        ]
+
+    def _set_tryout_players(self, tryout_players: Iterable):
+        players = frozenset(tryout_players) if tryout_players else None
+        if players == self._tryout_players:
+            return
+        self._tryout_players = players
+        self.stats = RunningStats()
+        for score in self.scores:
+            if self._is_counted(score):
+                self.stats.add(score.score)
+
+    def _is_counted(self, score: OsuScore) -> bool:
+        return self._tryout_players is None or score.player in self._tryout_players
 
     def __iter__(self):
         return iter(self.scores)
 
 
+def _descending_score(score: OsuScore) -> int:
+    return -score.score
+
+
 class PlayerScores:
     def __init__(self, player: str, scores: Optional[List[OsuScore]] = None):
         self.player = player
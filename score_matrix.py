@@ -0,0 +1,167 @@
+from dataclasses import dataclass
+from itertools import chain
+from operator import attrgetter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from score import BeatmapScores, PlayerScores
+
+_player = attrgetter("player")
+_score = attrgetter("score")
+
+
+class _PlayerIndex(dict):
+    """Numbers players in the order they are first looked up."""
+
+    def __missing__(self, player: str) -> int:
+        idx = self[player] = len(self)
+        return idx
+
+
+@dataclass
+class Seeding:
+    """Result of `ScoreMatrix.seed`, every array is indexed like the matrix."""
+    mean: np.ndarray
+    stddev: np.ndarray
+    z_scores: np.ndarray
+    sum_z: np.ndarray
+    rank: np.ndarray
+    percentile: np.ndarray
+
+
+class ScoreMatrix:
+    """Scores of the whole tryout as a players x beatmaps array, NaN when missing."""
+
+    def __init__(self, players: List[str], beatmap_ids: List[str], scores: np.ndarray):
+        self.players = players
+        self.beatmap_ids = beatmap_ids
+        self.scores = scores
+
+    @classmethod
+    def from_beatmap_scores(
+        cls,
+        beatmap_scores: Iterable[BeatmapScores],
+        tryout_players: Optional[Iterable[str]] = None,
+    ):
+        columns = [
+            (
+                scores.beatmap_id,
+                len(scores.scores),
+                map(_player, scores.scores),
+                map(_score, scores.scores),
+            )
+            for scores in beatmap_scores
+        ]
+        return cls._from_columns(columns, tryout_players)
+
+    @classmethod
+    def from_player_scores(
+        cls,
+        player_scores: Iterable[PlayerScores],
+        tryout_players: Optional[Iterable[str]] = None,
+    ):
+        columns: Dict[str, Tuple[List[str], List[int]]] = {}
+        for scores in player_scores:
+            for score in scores.scores:
+                players, values = columns.setdefault(score.beatmap_id, ([], []))
+                players.append(scores.player)
+                values.append(score.score)
+        return cls._from_columns(
+            [
+                (beatmap_id, len(players), players, values)
+                for beatmap_id, (players, values) in columns.items()
+            ],
+            tryout_players,
+        )
+
+    @classmethod
+    def _from_columns(
+        cls,
+        columns: List[Tuple[str, int, Iterable[str], Iterable[int]]],
+        tryout_players: Optional[Iterable[str]],
+    ):
+        """Fill the matrix from (beatmap_id, count, players, scores) columns.
+
+        Rows and scores are read in one pass into preallocated arrays with
+        `np.fromiter`, players numbered in the order they are first seen.
+        Players outside `tryout_players` are then dropped with a mask.
+        """
+        lengths = [length for _, length, _, _ in columns]
+        total = sum(lengths)
+        player_idx = _PlayerIndex()
+        rows = np.fromiter(
+            map(
+                player_idx.__getitem__,
+                chain.from_iterable(players for _, _, players, _ in columns),
+            ),
+            dtype=np.intp,
+            count=total,
+        )
+        values = np.fromiter(
+            chain.from_iterable(values for _, _, _, values in columns),
+            dtype=np.float64,
+            count=total,
+        )
+        cols = np.repeat(np.arange(len(columns)), lengths)
+
+        players = list(player_idx)
+        if tryout_players:
+            allowed = set(tryout_players)
+            kept = np.fromiter(
+                map(allowed.__contains__, players), dtype=bool, count=len(players)
+            )
+            counted = kept[rows]
+            rows = (np.cumsum(kept) - 1)[rows[counted]]
+            cols = cols[counted]
+            values = values[counted]
+            players = [player for player, keep in zip(players, kept) if keep]
+
+        scores = np.full((len(players), len(columns)), np.nan)
+        scores[rows, cols] = values
+        return cls(
+            players=players,
+            beatmap_ids=[beatmap_id for beatmap_id, _, _, _ in columns],
+            scores=scores,
+        )
+
+    def seed(self, missing_z: float = 0.0) -> Seeding:
+        """Compute the per map statistics and the overall ranking.
+
+        A missing score counts as `missing_z` in the sum of z-scores. Rank 1 is
+        the highest sum, percentile 100 the best player.
+        """
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = np.nanmean(self.scores, axis=0)
+            stddev = np.nanstd(self.scores, axis=0, ddof=1)
+            z_scores = (self.scores - mean) / stddev
+        sum_z = np.where(np.isnan(z_scores), missing_z, z_scores).sum(axis=1)
+
+        order = np.argsort(-sum_z, kind="stable")
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(1, len(order) + 1)
+        player_count = len(self.players)
+        if player_count > 1:
+            percentile = (player_count - rank) / (player_count - 1) * 100
+        else:
+            percentile = np.full(player_count, 100.0)
+
+        return Seeding(
+            mean=mean,
+            stddev=stddev,
+            z_scores=z_scores,
+            sum_z=sum_z,
+            rank=rank,
+            percentile=percentile,
+        )
+
+    def ranking(self, missing_z: float = 0.0) -> List[Tuple[int, str, float, float]]:
+        """(rank, player, sum of z-scores, percentile) rows, best player first."""
+        seeding = self.seed(missing_z)
+        rows = [
+            (int(rank), player, float(sum_z), float(percentile))
+            for player, rank, sum_z, percentile in zip(
+                self.players, seeding.rank, seeding.sum_z, seeding.percentile
+            )
+        ]
+        return sorted(rows)
@@ -0,0 +1,184 @@
+"""Time BeatmapScores ingesting scores one at a time, like the bot does.
+
+Adds `--scores` random scores to one map with `add_score`, counted against a
+tryout player list, then reads the z-scores. The pre-running-statistics
+implementation, which re-sorted and recomputed every z-score on each add, is
+timed at `--baseline-scores` (it is quadratic) and its z-scores are compared
+with the current ones.
+
+With `--matrix`, seeds a whole tryout of `--players` players on `--maps` maps
+instead, once with `ScoreMatrix` and once with `BeatmapScores.calc_z` per map
+summed per player, and checks both rank the players the same.
+
+    python scorebench.py
+    python scorebench.py --scores 10000 --baseline-scores 1000
+    python scorebench.py --matrix --players 1000 --maps 20
+"""
+import argparse
+import math
+import random
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+from score import BeatmapScores, OsuScore
+from score_matrix import ScoreMatrix
+
+
+class BaselineBeatmapScores:
+    """BeatmapScores as it was before it kept running statistics."""
+
+    def __init__(self, beatmap_id: str, tryout_players: Optional[List] = None):
+        self.beatmap_id = beatmap_id
+        self.tryout_players = tryout_players
+        self.scores: List[OsuScore] = []
+        self.z_scores: List[float] = []
+
+    def add_score(self, score: OsuScore):
+        self.scores.append(score)
+        self.scores.sort(reverse=True)
+        self.z_scores = self.calc_z(self.tryout_players)
+
+    def calc_z(self, tryout_players: Optional[List] = None) -> List[float]:
+        if tryout_players:
+            scores = [score for score in self.scores if score.player in tryout_players]
+        else:
+            scores = self.scores
+
+        if len(scores) < 2:
+            return []
+
+        mean = sum(scores) / len(scores)
+        mean_sq = sum([(score - mean) ** 2 for score in scores])
+        stddev = math.sqrt(mean_sq / (len(scores) - 1))
+        return [score.calc_z(mean, stddev) for score in scores]
+
+
+def make_scores(count: int, seed: int = 1) -> List[OsuScore]:
+    rng = random.Random(seed)
+    return [
+        OsuScore(f"player_{idx}", "1000", rng.randint(100000, 1000000))
+        for idx in range(count)
+    ]
+
+
+def ingest(beatmap_scores, scores: List[OsuScore]) -> float:
+    """Seconds to add `scores` one by one and read the z-scores."""
+    start = time.perf_counter()
+    for score in scores:
+        beatmap_scores.add_score(score)
+    beatmap_scores.z_scores
+    return time.perf_counter() - start
+
+
+def per_object_ranking(
+    beatmap_scores: List[BeatmapScores], tryout_players: List[str]
+) -> List[Tuple[str, float]]:
+    """(player, sum of z-scores) rows, best first, from BeatmapScores alone."""
+    allowed = set(tryout_players)
+    sum_z: Dict[str, float] = {}
+    for scores in beatmap_scores:
+        scores.calc_z(tryout_players)
+        for score in scores:
+            if score.player in allowed:
+                sum_z[score.player] = sum_z.get(score.player, 0.0) + score.z_score
+    return sorted(sum_z.items(), key=lambda row: -row[1])
+
+
+def matrix_ranking(
+    beatmap_scores: List[BeatmapScores], tryout_players: List[str]
+) -> List[Tuple[str, float]]:
+    matrix = ScoreMatrix.from_beatmap_scores(beatmap_scores, tryout_players)
+    return [(player, sum_z) for _, player, sum_z, _ in matrix.ranking()]
+
+
+def compare_seeding(players: int, maps: int, rounds: int) -> int:
+    rng = random.Random(1)
+    beatmap_scores = []
+    for map_idx in range(maps):
+        beatmap_id = str(1000 + map_idx)
+        # Some players skip a map, it counts as a z-score of 0 for them.
+        beatmap_scores.append(
+            BeatmapScores(
+                beatmap_id,
+                [
+                    OsuScore(f"player_{idx}", beatmap_id, rng.randint(100000, 1000000))
+                    for idx in range(players)
+                    if rng.random() < 0.9
+                ],
+            )
+        )
+    tryout_players = [f"player_{idx}" for idx in range(players)]
+
+    timings = {}
+    rankings = {}
+    for name, rank in (("per object", per_object_ranking), ("ScoreMatrix", matrix_ranking)):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            rankings[name] = rank(beatmap_scores, tryout_players)
+        timings[name] = (time.perf_counter() - start) / rounds
+        print(f"{name}: {timings[name] * 1000:.2f}ms per seeding")
+    print(
+        f"{players} players x {maps} maps: ScoreMatrix is "
+        f"{timings['per object'] / timings['ScoreMatrix']:.1f}x the per object path"
+    )
+    # Most of the ScoreMatrix time is reading the scores out of the objects.
+    matrix = ScoreMatrix.from_beatmap_scores(beatmap_scores, tryout_players)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        matrix.ranking()
+    seed_seconds = (time.perf_counter() - start) / rounds
+    print(f"ScoreMatrix.ranking alone: {seed_seconds * 1000:.2f}ms per seeding")
+
+    expected, actual = rankings["per object"], rankings["ScoreMatrix"]
+    matches = len(expected) == len(actual) and all(
+        player == other_player and math.isclose(sum_z, other_sum_z, abs_tol=1e-9)
+        for (player, sum_z), (other_player, other_sum_z) in zip(expected, actual)
+    )
+    print(f"Rankings {'match' if matches else 'differ'}.")
+    return 0 if matches else 1
+
+
+def main(args: argparse.Namespace) -> int:
+    if args.matrix:
+        return compare_seeding(args.players, args.maps, args.rounds)
+
+    scores = make_scores(args.scores)
+    # Every other player is in the tryout, the rest are not counted.
+    tryout_players = [score.player for score in scores[::2]]
+
+    elapsed = ingest(BeatmapScores("1000", tryout_players=tryout_players), scores)
+    print(
+        f"BeatmapScores: {args.scores} scores in {elapsed * 1000:.1f}ms "
+        f"({elapsed / args.scores * 1e6:.2f}us per add_score)"
+    )
+
+    count = min(args.baseline_scores, args.scores)
+    # Fresh copies, calc_z writes z_score on the scores.
+    current = BeatmapScores("1000", tryout_players=tryout_players)
+    current_elapsed = ingest(current, make_scores(count))
+    baseline = BaselineBeatmapScores("1000", tryout_players)
+    baseline_elapsed = ingest(baseline, make_scores(count))
+    print(
+        f"At {count} scores: {current_elapsed * 1000:.1f}ms now, "
+        f"{baseline_elapsed * 1000:.1f}ms before "
+        f"({baseline_elapsed / current_elapsed:.0f}x)"
+    )
+
+    matches = len(current.z_scores) == len(baseline.z_scores) and all(
+        math.isclose(now, before, abs_tol=1e-9)
+        for now, before in zip(current.z_scores, baseline.z_scores)
+    )
+    print(f"z-scores {'match' if matches else 'differ from'} the baseline.")
+    return 0 if matches else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--scores", type=int, default=10000)
+    parser.add_argument("--baseline-scores", type=int, default=300)
+    parser.add_argument("--matrix", action="store_true")
+    parser.add_argument("--players", type=int, default=1000)
+    parser.add_argument("--maps", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=10)
+    sys.exit(main(parser.parse_args()))
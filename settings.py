@@ -16,7 +16,32 @@ class Settings:
 
         self.log_level = os.getenv("LOG_LEVEL", "DEBUG").upper()
 
+        self.irc_server = os.getenv("IRC_SERVER", "irc.ppy.sh")
+        self.irc_port = int(os.getenv("IRC_PORT", "6667"))
+        self.irc_asyncio = os.getenv("IRC_ASYNCIO", "false").lower() == "true"
+        # Record IRC traffic to this file, see replay.py.
+        self.irc_trace_path = os.getenv("IRC_TRACE_PATH")
         self.irc_nickname = os.getenv("IRC_NICKNAME")
+        # Serve /metrics on localhost at this port.
+        metrics_port = os.getenv("METRICS_PORT")
+        self.metrics_port = int(metrics_port) if metrics_port else None
         self.irc_password = os.getenv("IRC_PASSWORD")
+        # Coordinator mode: one worker bot per nickname/password pair.
+        self.worker_irc_nicknames = [
+            nickname
+            for nickname in os.getenv("WORKER_IRC_NICKNAMES", "").split(",")
+            if nickname
+        ]
+        self.worker_irc_passwords = [
+            password
+            for password in os.getenv("WORKER_IRC_PASSWORDS", "").split(",")
+            if password
+        ]
+        self.admins = [
+            admin for admin in os.getenv("ADMINS", "").split(",") if admin
+        ]
+
+        # Host every tournament listed in this JSON file, see tournaments.py.
+        self.tournaments_path = os.getenv("TOURNAMENTS_PATH")
 
         self.environment = os.getenv("ENVIRONMENT", "prod").lower()
@@ -2,61 +2,157 @@ from __future__ import print_function
 
 import logging
 import os.path
-from collections import defaultdict
-from typing import Union, List
+import threading
+import time
+from typing import Callable, Union, List, Dict, Optional, Set, Tuple
 
+import httplib2
 from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 
 from beatmap import Beatmap
-from lobbies import LobbyState, LobbyDetails
 from settings import Settings
 
 logger = logging.getLogger("tryouts-bot")
 
 config = Settings()
 
+SCOPES = [
+    "https://www.googleapis.com/auth/spreadsheets",
+]
+
+# Token files whose token may not read Drive metadata, see `get_modified_time`.
+_drive_forbidden: Set[str] = set()
+_credentials: Dict[str, Credentials] = {}
+_credentials_lock = threading.Lock()
+# httplib2 connections are not thread-safe, so each thread gets its own service.
+_services = threading.local()
+
+
+class _HookedHttp(AuthorizedHttp):
+    """AuthorizedHttp that calls the thread's request hook before every API call."""
+
+    def request(self, *args, **kwargs):
+        hook = getattr(_services, "request_hook", None)
+        if hook is not None:
+            hook()
+        return super().request(*args, **kwargs)
+
+
+def set_request_hook(hook: Optional[Callable[[], None]]):
+    """Call `hook` before every API request made from the calling thread.
+
+    Retries made by `execute(num_retries=...)` are requests too.
+    """
+    _services.request_hook = hook
+
+
+def get_credentials(token_file: str = "token.json") -> Credentials:
+    """Load the credentials for `token_file` once per process."""
+    with _credentials_lock:
+        if token_file not in _credentials:
+            if not os.path.exists(token_file):
+                logger.warning(
+                    f"Creating {token_file} with credentials from environment!"
+                )
+                with open(token_file, "w") as f:
+                    f.write(config.token_json_contents)
+            _credentials[token_file] = Credentials.from_authorized_user_file(
+                token_file, SCOPES
+            )
+        return _credentials[token_file]
+
+
+def get_sheets_service(token_file: str = "token.json"):
+    """Return the Sheets service of the calling thread for `token_file`.
+
+    The service is built from the discovery document bundled with
+    googleapiclient, so no request is made, and it keeps a single keep-alive
+    `httplib2.Http` connection that is reused for every call.
+    """
+    return _get_service("sheets", "v4", token_file)
+
+
+def get_sheets_values(token_file: str = "token.json"):
+    """Return the `spreadsheets().values()` resource of the calling thread.
+
+    googleapiclient builds the docstrings of every method whenever a resource
+    is created, which takes longer than a request, so it is created once.
+    """
+    resources = getattr(_services, "values_by_token_file", None)
+    if resources is None:
+        resources = _services.values_by_token_file = {}
+
+    if token_file not in resources:
+        resources[token_file] = get_sheets_service(token_file).spreadsheets().values()
+    return resources[token_file]
+
+
+def get_drive_service(token_file: str = "token.json"):
+    """Like `get_sheets_service`, for the Drive API."""
+    return _get_service("drive", "v3", token_file)
+
+
+def _get_service(api: str, version: str, token_file: str):
+    services = getattr(_services, "by_token_file", None)
+    if services is None:
+        services = _services.by_token_file = {}
+
+    key = (api, token_file)
+    if key not in services:
+        start = time.monotonic()
+        http = _HookedHttp(get_credentials(token_file), http=httplib2.Http())
+        services[key] = build(
+            api, version, http=http, static_discovery=True, cache_discovery=False
+        )
+        logger.debug(
+            f"Built {api} service for {threading.current_thread().name} "
+            f"in {time.monotonic() - start:.3f}s."
+        )
+    return services[key]
+
 
 class Spreadsheet:
     def __init__(self, spreadsheet_id, spreadsheet_range):
-        self.scopes = [
-            "https://www.googleapis.com/auth/spreadsheets",
-        ]
+        self.scopes = SCOPES
         self.spreadsheet_id = spreadsheet_id
         self.spreadsheet_range = spreadsheet_range
 
-        if not os.path.exists("token.json"):
-            logger.warning("Creating token.json with credentials from environment!")
-            with open("token.json", "w") as f:
-                f.write(config.token_json_contents)
-
-        self.sheet = self.initialize()
+        self.values = self.initialize()
 
     def initialize(self):
-        creds = Credentials.from_authorized_user_file("token.json", self.scopes)
-        service = build("sheets", "v4", credentials=creds)
-
-        # Call the Sheets API
-        sheet = service.spreadsheets()
-
-        return sheet
+        return get_sheets_values()
+
+    def append_rows(self, rows: List[list]):
+        """Append `rows` in order with a single request."""
+        logger.info(f"Appending {len(rows)} rows to {self.spreadsheet_range}.")
+        res = self.values.append(
+            spreadsheetId=self.spreadsheet_id,
+            range=self.spreadsheet_range,
+            valueInputOption="USER_ENTERED",
+            body={"values": rows},
+        ).execute()
+        logger.info(f"Received: {res}")
 
 
 class MappoolSpreadsheet(Spreadsheet):
     def __init__(
         self,
+        spreadsheet_id: Optional[str] = None,
+        spreadsheet_range: Optional[str] = None,
     ):
         super().__init__(
-            config.mappool_spreadsheet_id, config.mappool_spreadsheet_range
+            spreadsheet_id or config.mappool_spreadsheet_id,
+            spreadsheet_range or config.mappool_spreadsheet_range,
         )
 
     def get_mappool(self):
         logger.info("Getting the mappool from sheets.")
-        result = (
-            self.sheet.values()
-            .get(spreadsheetId=self.spreadsheet_id, range=self.spreadsheet_range)
-            .execute(num_retries=5)
-        )
+        result = self.values.get(
+            spreadsheetId=self.spreadsheet_id, range=self.spreadsheet_range
+        ).execute(num_retries=5)
         values = result.get("values", [])
 
         mappool = []
@@ -67,89 +163,79 @@ class MappoolSpreadsheet(Spreadsheet):
         logger.info(f"Collected the mappool: {mappool}.")
         return mappool
 
+    def get_modified_time(self, token_file: str = "token.json") -> Optional[str]:
+        """The spreadsheet's Drive modifiedTime, or None if we may not read it.
+
+        Reading it needs the drive.metadata.readonly scope on the token, which
+        tokens made for the Sheets API alone do not have; callers then have to
+        compare the values instead. After the first refusal Drive is not asked
+        again for `token_file`, so every poll does not pay for a failed request.
+        """
+        if token_file in _drive_forbidden:
+            return None
+        try:
+            result = (
+                get_drive_service(token_file)
+                .files()
+                .get(fileId=self.spreadsheet_id, fields="modifiedTime")
+                .execute(num_retries=2)
+            )
+        except HttpError as e:
+            if e.resp.status in (401, 403):
+                _drive_forbidden.add(token_file)
+                logger.warning(
+                    f"{token_file} may not read Drive metadata, the mappool is "
+                    f"compared on every poll instead: {e}"
+                )
+            else:
+                logger.debug(f"Could not get the mappool modifiedTime: {e}")
+            return None
+        return result.get("modifiedTime")
+
 
 class PlayersSheet(Spreadsheet):
     def __init__(
         self,
+        spreadsheet_id: Optional[str] = None,
+        spreadsheet_range: Optional[str] = None,
     ):
         super().__init__(
-            config.stats_spreadsheet_id, config.stats_spreadsheet_players_range
+            spreadsheet_id or config.stats_spreadsheet_id,
+            spreadsheet_range or config.stats_spreadsheet_players_range,
         )
 
-    def get_players(self):
-        logger.info("Getting the players from sheets.")
-        result = (
-            self.sheet.values()
-            .get(spreadsheetId=self.spreadsheet_id, range=self.spreadsheet_range)
-            .execute(num_retries=5)
-        )
-        values = result.get("values", [])
+    def get_player_rows(self) -> List[Tuple[str, str]]:
+        """(player_id, player_name) of every row, in sheet order."""
+        result = self.values.get(
+            spreadsheetId=self.spreadsheet_id, range=self.spreadsheet_range
+        ).execute(num_retries=5)
+        return [(v[0], v[1]) for v in result.get("values", [])]
 
-        players = [v[1] for v in values]
-        logger.info(f"Collected players: {players}.")
-        return players
-
-    def add_player(self, player_id: Union[str, int], player_name: str):
-        row = [player_id, player_name, player_name]
-        logger.info(f"Appending {row} to Players sheet.")
-        res = (
-            self.sheet.values()
-            .append(
-                spreadsheetId=self.spreadsheet_id,
-                range=self.spreadsheet_range,
-                valueInputOption="USER_ENTERED",
-                body={"values": [row]},
-            )
-            .execute()
-        )
-        logger.info(f"Received: {res}")
+    @staticmethod
+    def make_row(player_id: Union[str, int], player_name: str) -> list:
+        return [player_id, player_name, player_name]
 
 
 class TryoutLobbiesSheet(Spreadsheet):
     def __init__(
         self,
+        spreadsheet_id: Optional[str] = None,
+        spreadsheet_range: Optional[str] = None,
     ):
         super().__init__(
-            config.stats_spreadsheet_id, config.stats_spreadsheet_lobbies_range
+            spreadsheet_id or config.stats_spreadsheet_id,
+            spreadsheet_range or config.stats_spreadsheet_lobbies_range,
         )
 
-    def append_lobby(self, lobby_url):
-        row = [lobby_url]
-        logger.info(f"Appending {row} to TryoutLobbies sheet.")
-        res = (
-            self.sheet.values()
-            .append(
-                spreadsheetId=self.spreadsheet_id,
-                range=self.spreadsheet_range,
-                valueInputOption="USER_ENTERED",
-                body={"values": [row]},
-            )
-            .execute()
-        )
-        logger.info(f"Received: {res}")
+    @staticmethod
+    def make_row(lobby_url: str) -> list:
+        return [lobby_url]
 
-    def get_played_lobbies(self, players: List[str]):
+    def get_lobby_urls(self) -> List[str]:
         logger.info("Getting the tryout lobbies from sheets.")
-        result = (
-            self.sheet.values()
-            .get(spreadsheetId=self.spreadsheet_id, range=self.spreadsheet_range)
-            .execute(num_retries=5)
-        )
+        result = self.values.get(
+            spreadsheetId=self.spreadsheet_id, range=self.spreadsheet_range
+        ).execute(num_retries=5)
 
         values = result.get("values", [])
-
-        lobbies = defaultdict(list)
-        for row, player_name in zip(values, players):
-            match_url = row[0]
-            match_id = match_url.split("/")[-1]
-            lobbies[player_name].append(
-                LobbyDetails(
-                    lobby_channel=f"#mp_{match_id}",
-                    lobby_url=match_url,
-                    player=player_name,
-                    next_map_idx=0,
-                    lobby_state=LobbyState.LOBBY_ENDING,
-                )
-            )
-
-        return lobbies
+        return [row[0] for row in values]
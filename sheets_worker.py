@@ -0,0 +1,182 @@
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Any, Deque, Optional
+
+from googleapiclient.errors import HttpError
+
+from metrics import MetricsRegistry
+from sheets import set_request_hook
+
+logger = logging.getLogger("tryouts-bot")
+
+_STOP = ("stop",)
+
+
+@dataclass
+class SheetsWorkerMetrics:
+    """Counters describing the state of the Sheets write-behind queue."""
+    submitted: int = 0
+    completed: int = 0
+    failed: int = 0
+    retried: int = 0
+    throttled: int = 0
+    rejected: int = 0
+    requests: int = 0
+    max_queue_depth: int = 0
+    last_job_seconds: float = 0.0
+
+
+class SheetsWorker:
+    """Runs Google Sheets writes on a background thread.
+
+    The IRC reactor hands jobs to `submit`, which does not block. Failed jobs
+    are retried with exponential backoff. Every API request a job makes is held
+    back so we stay under `requests_per_minute`.
+    """
+
+    def __init__(
+        self,
+        max_queue_size: int = 256,
+        max_retries: int = 5,
+        retry_backoff_seconds: float = 1.0,
+        requests_per_minute: int = 50,
+        registry: Optional[MetricsRegistry] = None,
+    ):
+        self.max_retries = max_retries
+        self.retry_backoff_seconds = retry_backoff_seconds
+        self.requests_per_minute = requests_per_minute
+        self.metrics = SheetsWorkerMetrics()
+        self.request_seconds = (registry or MetricsRegistry()).histogram(
+            "tryouts_sheets_request_seconds",
+            "Duration of each Sheets call attempt.",
+            label="job",
+        )
+
+        self._queue: "queue.Queue[tuple]" = queue.Queue(maxsize=max_queue_size)
+        self._request_times: Deque[float] = deque()
+        self._thread = threading.Thread(
+            target=self._run, name="sheets-worker", daemon=True
+        )
+        self._lock = threading.Lock()
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    @property
+    def requests_last_minute(self) -> int:
+        """API requests counted against the quota in the last minute.
+
+        Safe to read from any thread, only the worker expires request times.
+        """
+        since = time.monotonic() - 60
+        return sum(1 for request_time in list(self._request_times) if request_time > since)
+
+    def start(self):
+        logger.info("Starting the sheets worker.")
+        self._thread.start()
+
+    def submit(self, description: str, job: Callable[..., Any], *args) -> bool:
+        """Queue a job without blocking. Returns False if the queue is full."""
+        return self._put(("job", description, job, args), description)
+
+    def stop(self, timeout: Optional[float] = 30):
+        """Flush the pending jobs and stop the worker thread."""
+        if not self._thread.is_alive():
+            return
+        logger.info(f"Flushing {self.queue_depth} pending sheets jobs.")
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.error(
+                f"Sheets worker did not finish in {timeout}s, {self.queue_depth} jobs left."
+            )
+        logger.info(f"Sheets worker stopped: {self.metrics}")
+
+    def _put(self, item: tuple, description: str) -> bool:
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            with self._lock:
+                self.metrics.rejected += 1
+            logger.error(
+                f"Sheets queue is full ({self._queue.maxsize}), dropping: {description}"
+            )
+            return False
+
+        with self._lock:
+            self.metrics.submitted += 1
+            self.metrics.max_queue_depth = max(
+                self.metrics.max_queue_depth, self._queue.qsize()
+            )
+        return True
+
+    def _run(self):
+        # Jobs make several API calls, each of them counts against the quota.
+        set_request_hook(self._wait_for_quota)
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            _, description, job, args = item
+            self._run_job(description, job, args)
+
+    def _wait_for_quota(self):
+        now = time.monotonic()
+        self._expire_request_times(now)
+        if len(self._request_times) >= self.requests_per_minute:
+            wait = self._request_times[0] + 60 - now
+            logger.warning(f"Sheets request quota reached, waiting {wait:.1f}s.")
+            time.sleep(wait)
+            self._expire_request_times(time.monotonic())
+        self._request_times.append(time.monotonic())
+        with self._lock:
+            self.metrics.requests += 1
+
+    def _expire_request_times(self, now: float):
+        while self._request_times and self._request_times[0] <= now - 60:
+            self._request_times.popleft()
+
+    def _run_job(
+        self,
+        description: str,
+        job: Callable[..., Any],
+        args: tuple,
+    ):
+        request_seconds = self.request_seconds.labels(getattr(job, "__name__", "job"))
+        start = time.monotonic()
+        for attempt in range(self.max_retries + 1):
+            attempt_start = time.perf_counter()
+            try:
+                job(*args)
+            except Exception as e:
+                request_seconds.observe(time.perf_counter() - attempt_start)
+                if attempt == self.max_retries:
+                    with self._lock:
+                        self.metrics.failed += 1
+                    logger.exception(
+                        f"Sheets job failed after {attempt + 1} attempts: {description}"
+                    )
+                    return
+                backoff = self.retry_backoff_seconds * 2 ** attempt
+                with self._lock:
+                    self.metrics.retried += 1
+                    if isinstance(e, HttpError) and e.resp.status == 429:
+                        self.metrics.throttled += 1
+                logger.warning(
+                    f"Sheets job failed: {description} ({e}), retrying in {backoff}s."
+                )
+                time.sleep(backoff)
+            else:
+                request_seconds.observe(time.perf_counter() - attempt_start)
+                with self._lock:
+                    self.metrics.completed += 1
+                    self.metrics.last_job_seconds = time.monotonic() - start
+                logger.debug(
+                    f"Sheets job done in {self.metrics.last_job_seconds:.3f}s: {description}"
+                )
+                return
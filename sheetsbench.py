@@ -0,0 +1,135 @@
+"""Time Sheets service builds and calls against a local fake Sheets API.
+
+Runs `--calls` `values().get()` calls against a keep-alive HTTP server on
+localhost, getting the `values()` resource three ways:
+
+- before: credentials loaded and a service built for every call, like each
+  `Spreadsheet` used to do;
+- service cached: the service comes from `sheets._get_service`, built once
+  per thread, and `spreadsheets().values()` is created for every call;
+- after: a `PlayersSheet` is created for every call, as the bot does, and
+  uses the resource `sheets.get_sheets_values` keeps per thread.
+
+Reports the time per call and how much of it went to getting the resource,
+and how many connections the server saw. The last two share the thread's
+service, so "after" reuses the connection "service cached" opened. Uses a throwaway token file in a
+temporary directory, nothing reaches Google.
+
+    python sheetsbench.py --calls 200
+"""
+import argparse
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import build
+
+import sheets
+
+SPREADSHEET_ID = "bench"
+RANGE = "Players!A:B"
+TOKEN = {
+    "token": "bench-token",
+    "refresh_token": "bench-refresh-token",
+    "client_id": "bench-client",
+    "client_secret": "bench-secret",
+    # Without an expiry the token counts as expired and gets refreshed.
+    "expiry": "2999-01-01T00:00:00Z",
+}
+
+
+class FakeSheetsHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    connections = 0
+
+    def setup(self):
+        super().setup()
+        # Headers and body are separate writes, don't let Nagle hold the body.
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        FakeSheetsHandler.connections += 1
+
+    def do_GET(self):
+        body = json.dumps({"range": RANGE, "values": [["1", "Cookiezi"]]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def values_before(token_file: str, base_url: str):
+    credentials = Credentials.from_authorized_user_file(token_file, sheets.SCOPES)
+    service = build("sheets", "v4", credentials=credentials, cache_discovery=False)
+    service._baseUrl = base_url
+    return service.spreadsheets().values()
+
+
+def values_service_cached(token_file: str, base_url: str):
+    service = sheets._get_service("sheets", "v4", token_file)
+    service._baseUrl = base_url
+    return service.spreadsheets().values()
+
+
+def values_after(token_file: str, base_url: str):
+    # Resources take the base URL of the service when they are created.
+    sheets.get_sheets_service(token_file)._baseUrl = base_url
+    return sheets.PlayersSheet(SPREADSHEET_ID, RANGE).values
+
+
+def run(get_values, token_file: str, base_url: str, calls: int):
+    FakeSheetsHandler.connections = 0
+    setup_seconds = 0.0
+    start = time.perf_counter()
+    for _ in range(calls):
+        setup_start = time.perf_counter()
+        values = get_values(token_file, base_url)
+        setup_seconds += time.perf_counter() - setup_start
+        values.get(spreadsheetId=SPREADSHEET_ID, range=RANGE).execute()
+    elapsed = time.perf_counter() - start
+    return elapsed, setup_seconds, FakeSheetsHandler.connections
+
+
+def main(args: argparse.Namespace):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeSheetsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}/"
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        # Spreadsheet reads token.json from the working directory.
+        os.chdir(directory)
+        token_file = "token.json"
+        with open(token_file, "w") as f:
+            json.dump(TOKEN, f)
+
+        try:
+            for name, get_values in (
+                ("before", values_before),
+                ("service cached", values_service_cached),
+                ("after", values_after),
+            ):
+                elapsed, setup_seconds, connections = run(
+                    get_values, token_file, base_url, args.calls
+                )
+                print(
+                    f"{name}: {elapsed / args.calls * 1000:.2f}ms per call, "
+                    f"{setup_seconds / args.calls * 1000:.3f}ms of it getting "
+                    f"values(), {connections} connections for {args.calls} calls"
+                )
+        finally:
+            os.chdir(cwd)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--calls", type=int, default=200)
+    main(parser.parse_args())
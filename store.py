@@ -0,0 +1,344 @@
+import logging
+import sqlite3
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from lobbies import LobbyState, LobbyDetails
+from metrics import MetricsRegistry
+from sheets import PlayersSheet, TryoutLobbiesSheet
+
+logger = logging.getLogger("tryouts-bot")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS players (
+    player_id TEXT PRIMARY KEY,
+    player_name TEXT NOT NULL,
+    player_key TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS players_player_key ON players (player_key);
+
+-- Every name a player id was seen with, so renamed players keep their lobbies.
+CREATE TABLE IF NOT EXISTS player_aliases (
+    player_key TEXT PRIMARY KEY,
+    player_id TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS lobbies (
+    match_id TEXT PRIMARY KEY,
+    lobby_url TEXT NOT NULL,
+    player_key TEXT NOT NULL,
+    player_id TEXT,
+    created_at REAL NOT NULL,
+    lobby_mirrored INTEGER NOT NULL DEFAULT 0,
+    player_mirrored INTEGER NOT NULL DEFAULT 0,
+    tournament TEXT NOT NULL DEFAULT ''
+);
+
+CREATE TABLE IF NOT EXISTS lobby_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    match_id TEXT NOT NULL,
+    event TEXT NOT NULL,
+    lobby_state TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS lobby_events_match_id ON lobby_events (match_id);
+"""
+
+# Run after the migrations, they may need columns older stores do not have.
+INDEXES = """
+DROP INDEX IF EXISTS lobbies_player_key;
+DROP INDEX IF EXISTS lobbies_unmirrored;
+CREATE INDEX IF NOT EXISTS lobbies_tournament_player_key
+    ON lobbies (tournament, player_key);
+CREATE INDEX IF NOT EXISTS lobbies_tournament_unmirrored
+    ON lobbies (tournament, lobby_mirrored, player_mirrored);
+CREATE INDEX IF NOT EXISTS lobbies_tournament_player_id
+    ON lobbies (tournament, player_id);
+"""
+
+
+# Bump with a migration in `TryoutStore._migrate` when stored keys change.
+SCHEMA_VERSION = 1
+
+
+def irc_nickname(player_name: str) -> str:
+    """IRC replaces spaces in names with underscores."""
+    return player_name.replace(" ", "_")
+
+
+def player_key(player_name: str) -> str:
+    """Every spelling of a name shares a key: spaces or underscores, any case."""
+    return irc_nickname(player_name).lower()
+
+
+class TryoutStore:
+    """SQLite store of players, lobbies and lobby events.
+
+    This is the source of truth for eligibility checks. The Players and
+    TryoutLobbies sheets are only a mirror of it, see `SheetsMirror`. Lobbies
+    belong to a tournament, players are shared by all of them.
+    """
+
+    def __init__(self, path: str = "tryouts.sqlite3"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(SCHEMA)
+        self._migrate()
+        self._connection.executescript(INDEXES)
+
+    def _migrate(self):
+        columns = {
+            row[1] for row in self._connection.execute("PRAGMA table_info(lobbies)")
+        }
+        if "tournament" not in columns:
+            logger.info("Adding the tournament column to the lobbies table.")
+            with self._connection:
+                self._connection.execute(
+                    "ALTER TABLE lobbies ADD COLUMN tournament TEXT NOT NULL DEFAULT ''"
+                )
+
+        (schema_version,) = self._connection.execute("PRAGMA user_version").fetchone()
+        if schema_version < 1:
+            logger.info("Normalizing player keys to lower case.")
+            with self._connection:
+                for table in ("players", "lobbies"):
+                    self._connection.executemany(
+                        f"UPDATE {table} SET player_key = ? WHERE player_key = ?",
+                        [
+                            (player_key(key), key)
+                            for (key,) in self._connection.execute(
+                                f"SELECT DISTINCT player_key FROM {table}"
+                            ).fetchall()
+                        ],
+                    )
+                self._connection.execute(
+                    "INSERT OR IGNORE INTO player_aliases (player_key, player_id)"
+                    " SELECT player_key, player_id FROM players"
+                )
+        self._connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def is_empty(self, tournament: str = "") -> bool:
+        return (
+            self._query_one(
+                "SELECT COUNT(*) FROM lobbies WHERE tournament = ?", (tournament,)
+            )[0]
+            == 0
+        )
+
+    def add_lobby(self, match_id: str, lobby_url: str, player: str, tournament: str = ""):
+        self._execute(
+            "INSERT OR IGNORE INTO lobbies"
+            " (match_id, lobby_url, player_key, created_at, tournament)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (match_id, lobby_url, player_key(player), time.time(), tournament),
+        )
+
+    def add_player(self, player_id: str, player_name: str):
+        key = player_key(player_name)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT INTO players (player_id, player_name, player_key) VALUES (?, ?, ?)"
+                " ON CONFLICT (player_id) DO UPDATE"
+                " SET player_name = excluded.player_name, player_key = excluded.player_key",
+                (player_id, player_name, key),
+            )
+            self._connection.execute(
+                "INSERT OR REPLACE INTO player_aliases (player_key, player_id) VALUES (?, ?)",
+                (key, player_id),
+            )
+            self._connection.execute(
+                "UPDATE lobbies SET player_id = ? WHERE player_key = ? AND player_id IS NULL",
+                (player_id, key),
+            )
+
+    def add_lobby_event(self, match_id: str, event: str, lobby_state: LobbyState):
+        self._execute(
+            "INSERT INTO lobby_events (match_id, event, lobby_state, created_at)"
+            " VALUES (?, ?, ?, ?)",
+            (match_id, event, lobby_state.name, time.time()),
+        )
+
+    def get_played_lobbies(self, player: str, tournament: str = "") -> List[LobbyDetails]:
+        """Lobbies played under this name or any other name of the same player id."""
+        key = player_key(player)
+        rows = self._query(
+            "SELECT match_id, lobby_url FROM lobbies WHERE tournament = ?"
+            " AND (player_key = ? OR player_id ="
+            " (SELECT player_id FROM player_aliases WHERE player_key = ?))"
+            " ORDER BY created_at",
+            (tournament, key, key),
+        )
+        return [
+            LobbyDetails(
+                lobby_channel=f"#mp_{match_id}",
+                lobby_url=lobby_url,
+                player=player,
+                next_map_idx=0,
+                lobby_state=LobbyState.LOBBY_ENDING,
+                tournament=tournament,
+            )
+            for match_id, lobby_url in rows
+        ]
+
+    def import_from_sheets(
+        self,
+        players: List[Tuple[str, str]],
+        lobby_urls: List[str],
+        tournament: str = "",
+    ):
+        """Import rows that are already in the sheets, paired by row like before."""
+        with self._lock, self._connection:
+            for row_idx, ((player_id, player_name), lobby_url) in enumerate(
+                zip(players, lobby_urls)
+            ):
+                key = player_key(player_name)
+                self._connection.execute(
+                    "INSERT OR IGNORE INTO players (player_id, player_name, player_key)"
+                    " VALUES (?, ?, ?)",
+                    (player_id, player_name, key),
+                )
+                self._connection.execute(
+                    "INSERT OR IGNORE INTO player_aliases (player_key, player_id)"
+                    " VALUES (?, ?)",
+                    (key, player_id),
+                )
+                self._connection.execute(
+                    "INSERT OR IGNORE INTO lobbies (match_id, lobby_url, player_key,"
+                    " player_id, created_at, lobby_mirrored, player_mirrored, tournament)"
+                    " VALUES (?, ?, ?, ?, ?, 1, 1, ?)",
+                    (
+                        lobby_url.split("/")[-1],
+                        lobby_url,
+                        key,
+                        player_id,
+                        row_idx,
+                        tournament,
+                    ),
+                )
+
+    def unmirrored_lobbies(
+        self, tournament: str = ""
+    ) -> List[Tuple[str, str, int, Optional[str], str, int]]:
+        """(match_id, lobby_url, lobby_mirrored, player_id, player_name, player_mirrored)
+
+        Only lobbies whose player is known are returned so that both sheets
+        stay aligned row by row.
+        """
+        return self._query(
+            "SELECT lobbies.match_id, lobbies.lobby_url, lobbies.lobby_mirrored,"
+            " lobbies.player_id, players.player_name, lobbies.player_mirrored"
+            " FROM lobbies JOIN players ON players.player_id = lobbies.player_id"
+            " WHERE lobbies.tournament = ?"
+            " AND (lobbies.lobby_mirrored = 0 OR lobbies.player_mirrored = 0)"
+            " ORDER BY lobbies.created_at",
+            (tournament,),
+        )
+
+    def player_aliases(self) -> List[Tuple[str, str]]:
+        """(player_key, player_id) of every name a player id was seen with."""
+        return self._query("SELECT player_key, player_id FROM player_aliases")
+
+    def played_lobby_rows(self) -> List[Tuple[str, str, Optional[str], str]]:
+        """(tournament, player_key, player_id, lobby_url) of every lobby, oldest first."""
+        return self._query(
+            "SELECT tournament, player_key, player_id, lobby_url FROM lobbies"
+            " ORDER BY created_at"
+        )
+
+    def mark_mirrored(self, column: str, match_ids: List[str]):
+        assert column in ("lobby_mirrored", "player_mirrored")
+        with self._lock, self._connection:
+            self._connection.executemany(
+                f"UPDATE lobbies SET {column} = 1 WHERE match_id = ?",
+                [(match_id,) for match_id in match_ids],
+            )
+
+    def _execute(self, sql: str, params: tuple = ()):
+        with self._lock, self._connection:
+            self._connection.execute(sql, params)
+
+    def _query(self, sql: str, params: tuple = ()) -> list:
+        with self._lock:
+            return self._connection.execute(sql, params).fetchall()
+
+    def _query_one(self, sql: str, params: tuple = ()):
+        with self._lock:
+            return self._connection.execute(sql, params).fetchone()
+
+
+ROWS_PER_REQUEST_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class SheetsMirror:
+    """Copies store rows of a tournament that are not in its sheets yet.
+
+    Each sheet's new rows go out in one append request, the rows per request
+    are observed in `registry`. The spreadsheet and ranges default to the
+    ones in `Settings`.
+    """
+
+    def __init__(
+        self,
+        store: TryoutStore,
+        tournament: str = "",
+        spreadsheet_id: Optional[str] = None,
+        lobbies_range: Optional[str] = None,
+        players_range: Optional[str] = None,
+        registry: Optional[MetricsRegistry] = None,
+    ):
+        self.store = store
+        self.tournament = tournament
+        self.spreadsheet_id = spreadsheet_id
+        self.lobbies_range = lobbies_range
+        self.players_range = players_range
+        self.rows_per_request = (registry or MetricsRegistry()).histogram(
+            "tryouts_sheets_rows_per_request",
+            "Rows sent by each Sheets append request.",
+            label="tournament",
+            buckets=ROWS_PER_REQUEST_BUCKETS,
+        ).labels(tournament)
+
+    def players_sheet(self) -> PlayersSheet:
+        return PlayersSheet(self.spreadsheet_id, self.players_range)
+
+    def lobbies_sheet(self) -> TryoutLobbiesSheet:
+        return TryoutLobbiesSheet(self.spreadsheet_id, self.lobbies_range)
+
+    def import_sheets(self, only_if_empty: bool = False):
+        """Import rows from the sheets that the store does not have yet."""
+        if only_if_empty and not self.store.is_empty(self.tournament):
+            return
+        players = self.players_sheet().get_player_rows()
+        lobby_urls = self.lobbies_sheet().get_lobby_urls()
+        self.store.import_from_sheets(players, lobby_urls, self.tournament)
+        logger.info(f"Imported {len(lobby_urls)} lobbies from sheets into the store.")
+
+    def sync(self):
+        rows = self.store.unmirrored_lobbies(self.tournament)
+        if not rows:
+            return
+
+        lobby_rows = [row for row in rows if not row[2]]
+        if lobby_rows:
+            self.lobbies_sheet().append_rows(
+                [TryoutLobbiesSheet.make_row(row[1]) for row in lobby_rows]
+            )
+            self.rows_per_request.observe(len(lobby_rows))
+            self.store.mark_mirrored("lobby_mirrored", [row[0] for row in lobby_rows])
+
+        player_rows = [row for row in rows if not row[5]]
+        if player_rows:
+            self.players_sheet().append_rows(
+                [PlayersSheet.make_row(row[3], row[4]) for row in player_rows]
+            )
+            self.rows_per_request.observe(len(player_rows))
+            self.store.mark_mirrored("player_mirrored", [row[0] for row in player_rows])
+        logger.info(f"Mirrored {len(rows)} lobbies to sheets.")
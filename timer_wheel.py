@@ -0,0 +1,119 @@
+import math
+import time
+from typing import Callable, Dict, Hashable, List, Optional
+
+
+class _Timer:
+    __slots__ = ("key", "expires", "callback", "level", "slot")
+
+    def __init__(self, key: Hashable, expires: int, callback: Callable[[Hashable], None]):
+        self.key = key
+        self.expires = expires
+        self.callback = callback
+        self.level = 0
+        self.slot = 0
+
+
+class TimerWheel:
+    """Hierarchical timing wheel with one timer per key.
+
+    Level 0 has one slot per tick, each level above has slots `slots` times as
+    wide. A timer goes into the lowest level that covers its deadline and moves
+    down a level whenever the level below wraps around to its slot, so
+    scheduling, cancelling and each tick are O(1) no matter how many timers
+    there are. With 1s ticks and 64 slots, four levels cover about 194 days;
+    later deadlines are parked at the top and re-placed when they come round.
+
+    `advance` runs the callbacks that are due, on the caller's thread.
+    """
+
+    def __init__(
+        self,
+        tick_seconds: float = 1.0,
+        slots: int = 64,
+        levels: int = 4,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.tick_seconds = tick_seconds
+        self.slots = slots
+        self.levels = levels
+        self.clock = clock
+        self.current_tick = self._tick_at(clock())
+        self._wheels: List[List[Dict[Hashable, _Timer]]] = [
+            [{} for _ in range(slots)] for _ in range(levels)
+        ]
+        self._timers: Dict[Hashable, _Timer] = {}
+
+    def __len__(self) -> int:
+        return len(self._timers)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._timers
+
+    def schedule(
+        self, key: Hashable, delay_seconds: float, callback: Callable[[Hashable], None]
+    ):
+        """Call `callback(key)` in `delay_seconds`, replacing the timer of `key`."""
+        self.cancel(key)
+        ticks = max(1, math.ceil(delay_seconds / self.tick_seconds))
+        timer = _Timer(key, self.current_tick + ticks, callback)
+        self._timers[key] = timer
+        self._insert(timer)
+
+    def cancel(self, key: Hashable) -> bool:
+        timer = self._timers.pop(key, None)
+        if timer is None:
+            return False
+        del self._wheels[timer.level][timer.slot][key]
+        return True
+
+    def seconds_left(self, key: Hashable) -> Optional[float]:
+        timer = self._timers.get(key)
+        if timer is None:
+            return None
+        return (timer.expires - self.current_tick) * self.tick_seconds
+
+    def advance(self, now: Optional[float] = None):
+        """Process every tick up to `now` and fire the timers that expired."""
+        target_tick = self._tick_at(self.clock() if now is None else now)
+        while self.current_tick < target_tick:
+            self.current_tick += 1
+            self._cascade()
+            slot = self._wheels[0][self.current_tick % self.slots]
+            if not slot:
+                continue
+            for key, timer in list(slot.items()):
+                del slot[key]
+                if timer.expires > self.current_tick:
+                    # Parked beyond the top level, place it again.
+                    self._insert(timer)
+                    continue
+                del self._timers[key]
+                timer.callback(key)
+
+    def _tick_at(self, seconds: float) -> int:
+        return int(seconds / self.tick_seconds)
+
+    def _cascade(self):
+        span = 1
+        for level in range(1, self.levels):
+            span *= self.slots
+            if self.current_tick % span:
+                return
+            slot = self._wheels[level][(self.current_tick // span) % self.slots]
+            timers = list(slot.values())
+            slot.clear()
+            for timer in timers:
+                self._insert(timer)
+
+    def _insert(self, timer: _Timer):
+        delta = max(0, timer.expires - self.current_tick)
+        span = 1
+        for level in range(self.levels):
+            if delta < span * self.slots or level == self.levels - 1:
+                break
+            span *= self.slots
+        expires = min(timer.expires, self.current_tick + span * self.slots - 1)
+        timer.level = level
+        timer.slot = (expires // span) % self.slots
+        self._wheels[level][timer.slot][timer.key] = timer
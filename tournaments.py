@@ -0,0 +1,152 @@
+import datetime
+import json
+import logging
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Tuple
+
+from beatmap import Beatmap
+from config_watcher import ConfigVersion, ConfigWatcher
+from player_index import PlayerIndex, id_identity, name_identity
+from sheets import MappoolSpreadsheet
+
+logger = logging.getLogger("tryouts-bot")
+
+
+class Tournament:
+    """One tryout hosted by the bot: its config, players and sheets.
+
+    `key` tags its lobbies in the store and journal. The stats spreadsheet
+    and ranges default to the ones in `Settings` when left out.
+    """
+
+    def __init__(
+        self,
+        key: str,
+        config: ConfigWatcher,
+        allowed_players: Optional[List[str]] = None,
+        stats_spreadsheet_id: Optional[str] = None,
+        lobbies_range: Optional[str] = None,
+        players_range: Optional[str] = None,
+    ):
+        self.key = key
+        self.config = config
+        self.allowed_players = allowed_players or []
+        self.stats_spreadsheet_id = stats_spreadsheet_id
+        self.lobbies_range = lobbies_range
+        self.players_range = players_range
+        self.apply_config(config.current)
+
+    def __repr__(self):
+        return f"Tournament({self.key!r}, {self.tournament_name!r})"
+
+    def apply_config(self, config_version: ConfigVersion):
+        """Use `config_version` for new lobbies and everything outside lobbies."""
+        settings = config_version.settings
+        tournament_start, tournament_end = tournament_window(settings)
+        tournament_name = settings["tournamentName"]
+        self.tournament_start = tournament_start
+        self.tournament_end = tournament_end
+        self.tournament_name = tournament_name
+        self.mappool = config_version.mappool
+        self.settings = settings
+        self.config_version = config_version
+
+
+def tournament_window(
+    settings: Mapping[str, Any]
+) -> Tuple[datetime.datetime, datetime.datetime]:
+    """The start and end of the tournament in `settings`."""
+    return (
+        datetime.datetime.fromisoformat(settings["tournamentStart"]),
+        datetime.datetime.fromisoformat(settings["tournamentEnd"]),
+    )
+
+
+class TournamentIndex:
+    """Finds the tournament of a player with a dict lookup or two.
+
+    Players listed in a tournament's `allowed_players` go to it. Everyone
+    else goes to the first tournament that is open to all players, if any.
+    Names are matched by `player_key`, and by player id through
+    `player_index` for players that renamed since signing up.
+    """
+
+    def __init__(
+        self,
+        tournaments: Iterable[Tournament],
+        player_index: Optional[PlayerIndex] = None,
+    ):
+        self.player_index = player_index
+        self._by_player: Dict[str, Tournament] = {}
+        self._open_tournament: Optional[Tournament] = None
+        for tournament in tournaments:
+            if not tournament.allowed_players:
+                self._open_tournament = self._open_tournament or tournament
+            for player in tournament.allowed_players:
+                keys = {name_identity(player)}
+                if player_index is not None:
+                    keys.add(player_index.identity(player))
+                for key in keys:
+                    existing = self._by_player.setdefault(key, tournament)
+                    if existing is not tournament:
+                        logger.warning(
+                            f"{player} is allowed in both {existing.key} and "
+                            f"{tournament.key}, routing them to {existing.key}."
+                        )
+                        break
+
+    def __len__(self) -> int:
+        return len(self._by_player)
+
+    def add_player(self, player_id: str, player: str):
+        """Route `player_id` like `player`, for when they come back renamed."""
+        tournament = self._by_player.get(name_identity(player))
+        if tournament is not None:
+            self._by_player.setdefault(id_identity(player_id), tournament)
+
+    def tournament_for(self, player: str) -> Optional[Tournament]:
+        tournament = self._by_player.get(name_identity(player))
+        if tournament is None and self.player_index is not None:
+            tournament = self._by_player.get(self.player_index.identity(player))
+        return tournament or self._open_tournament
+
+
+def load_tournaments(
+    path: str,
+    select_mappool: Callable[[List[Beatmap]], List[Beatmap]] = lambda mappool: mappool,
+) -> List[Tournament]:
+    """Build the tournaments listed in a JSON file like:
+
+    [{"key": "tr", "settings": "settings.tr.json",
+      "mappoolSpreadsheetId": "...", "mappoolRange": "...",
+      "statsSpreadsheetId": "...", "lobbiesRange": "...", "playersRange": "...",
+      "allowedPlayers": ["..."]}]
+
+    Only `key` and `settings` are required, the rest default to `Settings`.
+    """
+    with open(path, encoding="utf-8") as f:
+        entries = json.load(f)
+
+    tournaments = []
+    for entry in entries:
+        mappool_sheet_args = (entry.get("mappoolSpreadsheetId"), entry.get("mappoolRange"))
+        config = ConfigWatcher(
+            load_mappool=lambda args=mappool_sheet_args: select_mappool(
+                MappoolSpreadsheet(*args).get_mappool()
+            ),
+            mappool_revision=lambda args=mappool_sheet_args: MappoolSpreadsheet(
+                *args
+            ).get_modified_time(),
+            settings_path=entry["settings"],
+        )
+        tournaments.append(
+            Tournament(
+                entry["key"],
+                config,
+                allowed_players=entry.get("allowedPlayers"),
+                stats_spreadsheet_id=entry.get("statsSpreadsheetId"),
+                lobbies_range=entry.get("lobbiesRange"),
+                players_range=entry.get("playersRange"),
+            )
+        )
+    logger.info(f"Loaded tournaments: {tournaments}")
+    return tournaments